@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+# compares two result files written by bench.run, e.g. from two commits
+# usage: python -m bench.compare old.json new.json
+import sys
+import json
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m bench.compare old.json new.json')
+        sys.exit(1)
+    old_results = load_results(sys.argv[1])
+    new_results = load_results(sys.argv[2])
+    print('{} -> {}'.format(old_results.get('commit'),
+                            new_results.get('commit')))
+    for scale, new_scale in new_results['scales'].items():
+        old_scale = old_results['scales'].get(scale)
+        if old_scale is None:
+            continue
+        print(scale)
+        print('  {:<36} {:>10} {:>10} {:>8}'.format('benchmark', 'old (s)',
+                                                   'new (s)', 'change'))
+        for name, new_timing in new_scale['timings'].items():
+            old_timing = old_scale['timings'].get(name)
+            if old_timing is None:
+                continue
+            old_time = old_timing['min']
+            new_time = new_timing['min']
+            change = (new_time - old_time) / old_time * 100 if old_time else 0
+            print('  {:<36} {:>10.4f} {:>10.4f} {:>+7.1f}%'.format(
+                name, old_time, new_time, change))
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# times formatting music objects with info formats (-F) the way the server
+# did before formats were compiled (a regex built for every object, every
+# field computed) and with the compiled formatter, on objects built in
+# memory. tests/test_info_format.py checks that both give the same output
+# usage: python -m bench.format_info [-n songs] [-r repeats] [-o out.json]
+import json
+import time
+import argparse
+
+from bench.run import Timer, get_git_commit
+from pmus.music import Song, Album, Artist
+from pmus.utils import multiple_replace
+from pmus.info_format import InfoFormatter
+
+# formats both implementations support, then ones only the compiled one does
+FORMATS = ['id\n',
+           'id\tname\tartist_name\talbum_name\turl\n',
+           'id name - artist_name (album_name) time_listened\n']
+NEW_FORMATS = ['id duration year time_liked play_count time_listened\n',
+               '@json']
+
+# the format_info the server had before, for comparison
+def legacy_format_info(music_object, fmt, extra_fields=None):
+    if isinstance(music_object, Song):
+        fields = {'artist_name' : music_object.artists[0].name,
+                  'album_id' : str(music_object.album.id),
+                  'album_name': music_object.album.name,
+                  'name': music_object.name,
+                  'id': str(music_object.id),
+                  'url': music_object.audio_url}
+    elif isinstance(music_object, Album):
+        fields = {'id': str(music_object.id),
+                  'artist_name': music_object.artists[0].name,
+                  'name': music_object.name,
+                  'first_audio_url': music_object.songs[0].audio_url}
+    elif isinstance(music_object, Artist):
+        try:
+            first_audio_url = music_object.albums[0].songs[0].audio_url
+        except:
+            first_audio_url = 'none'
+        fields = {'id': str(music_object.id),
+                  'name': music_object.name,
+                  'first_audio_url': first_audio_url}
+    else:
+        return None
+    fields['time_listened'] = str(music_object.time_listened())
+    if extra_fields:
+        fields.update(extra_fields)
+    return multiple_replace(fmt, fields)
+
+# songs_per_album songs in each of albums_per_artist albums of every artist
+def generate_songs(song_count, albums_per_artist=10, songs_per_album=10):
+    songs = []
+    artist_id = 0
+    album_id = 0
+    while len(songs) < song_count:
+        artist_id += 1
+        artist = Artist(artist_id, 'artist {}'.format(artist_id), [], [])
+        for i in range(albums_per_artist):
+            album_id += 1
+            album = Album(album_id, 'album {}'.format(album_id), [], [artist],
+                          1990 + album_id % 30)
+            artist.albums.append(album)
+            for idx_in_album in range(1, songs_per_album + 1):
+                song_id = len(songs) + 1
+                audio_url = '/music/artist {}/album {}/{:02} song {}.flac'\
+                        .format(artist_id, album_id, idx_in_album, song_id)
+                song = Song(song_id, audio_url, 'song {}'.format(song_id),
+                            [artist], 200.0 + song_id % 100, idx_in_album,
+                            None, [], album)
+                song.total_time_listened = song_id * 1000
+                song.play_count = song_id % 7
+                album.songs.append(song)
+                songs.append(song)
+    return songs[:song_count]
+
+def run(timer, song_count):
+    songs = generate_songs(song_count)
+    for fmt in FORMATS:
+        name = repr(fmt)[1:-1]
+        timer.time('legacy   {}'.format(name),
+                   lambda: [legacy_format_info(song, fmt) for song in songs])
+        def format_songs():
+            formatter = InfoFormatter(fmt)
+            return [formatter.format(song) for song in songs]
+        timer.time('compiled {}'.format(name), format_songs)
+    for fmt in NEW_FORMATS:
+        name = repr(fmt)[1:-1]
+        def format_songs():
+            formatter = InfoFormatter(fmt)
+            return [formatter.format(song) for song in songs]
+        timer.time('compiled {}'.format(name), format_songs)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='benchmark formatting music objects with -F formats')
+    parser.add_argument('-n', '--songs', type=int, default=100000,
+                        help='how many songs to format')
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help='how many times each benchmark is run')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to as json')
+    args = parser.parse_args()
+
+    print('{} songs'.format(args.songs), flush=True)
+    timer = Timer(args.repeats)
+    run(timer, args.songs)
+    if args.output:
+        results = {'commit': get_git_commit(),
+                   'time': int(time.time() * 1000),
+                   'songs': args.songs,
+                   'timings': timer.timings}
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2) + '\n')
+        print('results written to {}'.format(args.output))
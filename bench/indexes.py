@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# times the lookups DBProvider does on a hot path on a database at the schema
+# of the first release, then again after the migrations added the indexes
+# usage: python -m bench.indexes [-s songs] [-p playbacks]
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+
+from bench.synthetic import generate_database
+from pmus.migrations import migrate
+
+SONGS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 5
+
+# (name, query, function that returns parameters for the i-th run)
+QUERIES = [
+    ('songs.audio_url',
+     'SELECT id FROM songs WHERE audio_url = ?',
+     lambda conn, i: conn.execute('SELECT audio_url FROM songs WHERE id = ?',
+                                  (i,)).fetchone()),
+    ('artists.name',
+     'SELECT * FROM artists WHERE name = ?',
+     lambda conn, i: ('artist {}'.format(i),)),
+    ('albums.name + album_artists',
+     'SELECT * FROM albums WHERE name = ? AND id IN\
+      (SELECT album_id FROM album_artists WHERE artist_id = ?)',
+     lambda conn, i: ('album {} 0'.format(i), i + 1)),
+    ('album_songs(album_id, index)',
+     'SELECT * FROM album_songs WHERE album_id = ? AND index_in_album = ?',
+     lambda conn, i: (i, 3)),
+    ('playbacks.song_id',
+     'SELECT * FROM playbacks WHERE song_id = ?',
+     lambda conn, i: (i,)),
+    ('pauses.playback_id',
+     'SELECT * FROM pauses WHERE playback_id = ?',
+     lambda conn, i: (i,)),
+    ('resumes.playback_id',
+     'SELECT * FROM resumes WHERE playback_id = ?',
+     lambda conn, i: (i,)),
+    ('seeks.playback_id',
+     'SELECT * FROM seeks WHERE playback_id = ?',
+     lambda conn, i: (i,)),
+]
+
+def time_queries(conn, runs):
+    timings = {}
+    for name, query, get_params in QUERIES:
+        params = [get_params(conn, i + 1) for i in range(runs)]
+        time_started = time.perf_counter()
+        for param in params:
+            conn.execute(query, param).fetchall()
+        timings[name] = (time.perf_counter() - time_started) / runs
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='time hot path queries before and after the migrations')
+    parser.add_argument('-s', '--songs', type=int, default=20000)
+    parser.add_argument('-p', '--playbacks', type=int, default=200000)
+    parser.add_argument('-r', '--runs', type=int, default=200,
+                        help='how many times each query is run')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='pmus_bench_'), 'music.db')
+    artist_count = max(args.songs // SONGS_PER_ALBUM // ALBUMS_PER_ARTIST, 1)
+    counts = generate_database(db_path, artist_count, ALBUMS_PER_ARTIST,
+                               SONGS_PER_ALBUM, args.playbacks,
+                               migrate=False)
+    print('{songs} songs, {albums} albums, {artists} artists, '
+          '{playbacks} playbacks, {pauses} pauses'.format(**counts))
+
+    conn = sqlite3.connect(db_path)
+    before = time_queries(conn, args.runs)
+    time_started = time.perf_counter()
+    migrate(conn)
+    print('migrations took {:.3f}s'.format(time.perf_counter() - time_started))
+    after = time_queries(conn, args.runs)
+    conn.close()
+    os.remove(db_path)
+
+    print('{:<30} {:>12} {:>12} {:>10}'.format('query', 'before (ms)',
+                                               'after (ms)', 'speedup'))
+    for name, query, get_params in QUERIES:
+        print('{:<30} {:>12.4f} {:>12.4f} {:>9.0f}x'.format(
+            name, before[name] * 1000, after[name] * 1000,
+            before[name] / after[name]))
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# times the hot paths of loading, scanning, querying and analyzing the music
+# on synthetic libraries of a few sizes and writes the results as json so
+# that runs on different commits can be compared
+# usage: python -m bench.run [-s small,medium] [-r repeats] [-o results.json]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import statistics
+
+from bench.synthetic import (generate_database, generate_audio_tree,
+                             SYNTHETIC_EPOCH)
+
+# artists, albums per artist, songs per album, playbacks, pauses per playback
+# and artists in the audio tree that find_music is timed on (with 2 albums
+# of 10 songs each)
+SCALES = {
+    'tiny': (2, 2, 3, 50, 1, 1),
+    'small': (20, 5, 10, 10000, 1, 5),
+    'medium': (200, 5, 10, 100000, 1, 25),
+    'large': (800, 10, 10, 500000, 2, 100),
+}
+
+INFO_FORMAT = 'id\tname\tartist_name\talbum_name\turl\n'
+
+class Timer:
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.timings = {}
+
+    # runs func repeats times (setup before each run, untimed), records the
+    # fastest and the median run and returns what the last run returned
+    def time(self, name, func, setup=None, repeats=None):
+        times = []
+        result = None
+        for i in range(repeats or self.repeats):
+            if setup is not None:
+                setup()
+            time_started = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - time_started)
+        self.timings[name] = {'min': min(times),
+                              'median': statistics.median(times),
+                              'runs': len(times)}
+        print('  {:<36} {:>10.4f}s'.format(name, min(times)), flush=True)
+        return result
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))\
+                .stdout.strip() or None
+    except OSError:
+        return None
+
+# stands in for the server that get_info expects, only the music provider
+# is used for the specifiers benchmarked here
+class BenchServer:
+    def __init__(self, music_provider):
+        self.music_provider = music_provider
+        self.music_player = None
+
+def bench_catalog(timer, work_dir, scale):
+    from pmus.db import MusicProvider
+    from pmus.sorting import sort
+    from pmus.server import get_info, format_info
+
+    (artist_count, albums_per_artist, songs_per_album, playback_count,
+     pauses_per_playback, tree_artist_count) = scale
+    db_path = os.path.join(work_dir, 'music.db')
+    counts = generate_database(db_path, artist_count, albums_per_artist,
+                               songs_per_album, playback_count,
+                               pauses_per_playback)
+
+    provider = MusicProvider(db_path)
+    def remove_snapshot():
+        if os.path.exists(provider.snapshot_path):
+            os.remove(provider.snapshot_path)
+    def load_music():
+        provider.unload_music()
+        provider.load_music(validate_files=False)
+    timer.time('load_music (no snapshot)', load_music, remove_snapshot)
+    # the snapshot is written in the background after a load from sqlite
+    provider.write_snapshot(provider.db_provider.get_change_counter(),
+                            provider.db_provider.get_schema_version(),
+                            provider.get_catalog_rows())
+    timer.time('load_music (snapshot)', load_music)
+
+    songs = provider.get_songs_list()
+    albums = provider.get_albums_list()
+    artists = provider.get_artists_list()
+    server = BenchServer(provider)
+    timer.time('get_info song all id',
+               lambda: list(get_info(server, 'song', 'all', 'id', 0,
+                                     INFO_FORMAT)))
+    timer.time('get_info song all name limit 20',
+               lambda: list(get_info(server, 'song', 'all', 'name', 20,
+                                     INFO_FORMAT)))
+    timer.time('get_info song liked rev_time_liked',
+               lambda: list(get_info(server, 'song', 'liked',
+                                     'rev_time_liked', 0, INFO_FORMAT)))
+    timer.time('format_info songs',
+               lambda: [format_info(song, INFO_FORMAT) for song in songs])
+    timer.time('sort songs name', lambda: sort(songs, 'name'))
+    timer.time('sort songs time_liked limit 20',
+               lambda: sort(songs, 'time_liked', 20))
+    timer.time('sort songs artist_name,idx_in_album',
+               lambda: sort(songs, 'artist_name,idx_in_album'))
+    timer.time('sort albums rev_year,name',
+               lambda: sort(albums, 'rev_year,name'))
+
+    first_time = SYNTHETIC_EPOCH
+    last_time = max(playback.time_ended
+                    for playback in provider.get_playbacks_list())
+    day = 24 * 3600 * 1000
+    timer.time('time_listened artists (all time)',
+               lambda: [artist.time_listened() for artist in artists])
+    timer.time('time_listened songs (one day)',
+               lambda: [song.time_listened(last_time - day, last_time)
+                        for song in songs])
+    timer.time('time_listened albums (one week)',
+               lambda: [album.time_listened(last_time - 7 * day, last_time)
+                        for album in albums])
+    timer.time('time_listened_timeline 300 bins',
+               lambda: provider.time_listened_timeline(first_time, last_time,
+                                                       300))
+    timer.time('get_top song 20 (one month)',
+               lambda: provider.get_top('song', 20, last_time - 30 * day,
+                                        last_time))
+    timer.time('get_listening_stats (one month)',
+               lambda: provider.get_listening_stats(last_time - 30 * day - 1,
+                                                    last_time))
+    provider.db_provider.close()
+    return counts
+
+def bench_find_music(timer, work_dir, scale):
+    from pmus.db import MusicProvider
+
+    tree_artist_count = scale[5]
+    music_dir = os.path.join(work_dir, 'music')
+    file_count = len(generate_audio_tree(music_dir, tree_artist_count, 2, 10))
+    db_path = os.path.join(work_dir, 'scan.db')
+    def remove_db():
+        for path in (db_path, db_path + '.snapshot'):
+            if os.path.exists(path):
+                os.remove(path)
+    def find_music():
+        provider = MusicProvider(db_path)
+        provider.find_music(music_dir)
+        provider.db_provider.close()
+    timer.time('find_music (empty database)', find_music, remove_db)
+    timer.time('find_music (nothing changed)', find_music)
+    return file_count
+
+def run_scale(timer, name, scale):
+    work_dir = tempfile.mkdtemp(prefix='pmus_bench_')
+    try:
+        print(name, flush=True)
+        counts = bench_catalog(timer, work_dir, scale)
+        counts['audio_files'] = bench_find_music(timer, work_dir, scale)
+        return counts
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='benchmark pmus on synthetic libraries')
+    parser.add_argument('-s', '--scales', default='small,medium',
+                        help='comma separated scales to run ({})'.format(
+                            ', '.join(SCALES)))
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help='how many times each benchmark is run')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to, stdout if not given')
+    args = parser.parse_args()
+
+    results = {'commit': get_git_commit(),
+               'time': int(time.time() * 1000),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'scales': {}}
+    try:
+        import numpy
+        results['numpy'] = numpy.__version__
+    except ImportError:
+        results['numpy'] = None
+
+    for name in args.scales.split(','):
+        if not name in SCALES:
+            print('unknown scale {}'.format(name))
+            sys.exit(1)
+        timer = Timer(args.repeats)
+        counts = run_scale(timer, name, SCALES[name])
+        results['scales'][name] = {'counts': counts,
+                                   'timings': timer.timings}
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print('results written to {}'.format(args.output))
+    else:
+        print(output)
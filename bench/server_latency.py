@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# measures how long progress requests take to be answered by the server,
+# first while it is idle and then while another client keeps it busy with a
+# heavy info command, on a synthetic library of one of the sizes in bench.run.
+# each is timed with a new connection per request and with one connection
+# kept open (the way a status bar would poll)
+# usage: python -m bench.server_latency [-s medium] [-n requests] [-o out.json]
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+
+from bench.synthetic import generate_database
+from bench.run import SCALES, INFO_FORMAT, get_git_commit
+
+HEAVY_COMMAND = 'info song all name 0 ' + INFO_FORMAT
+
+# stands in for the music player, the server only asks it for the progress
+# of the current song here
+class BenchPlayer:
+    def __init__(self, song):
+        self.song = song
+        self.progress = 12.5
+
+    def current_song(self):
+        return self.song
+
+    def terminate(self):
+        pass
+
+def get_free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def wait_for_server(port, timeout=30):
+    time_started = time.time()
+    while time.time() - time_started < timeout:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    print('server didnt start listening')
+    sys.exit(1)
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[int(round(percentile / 100 * (len(values) - 1)))]
+
+def summarize(latencies):
+    return {'p50': get_percentile(latencies, 50),
+            'p99': get_percentile(latencies, 99),
+            'max': max(latencies),
+            'requests': len(latencies)}
+
+# latencies of count progress requests in seconds
+def time_progress_requests(port, count, persistent=False):
+    from pmus.client import Connection, send_cmd_wait_all
+    conn = None
+    if persistent:
+        conn = Connection('127.0.0.1', port)
+    latencies = []
+    for i in range(count):
+        time_started = time.perf_counter()
+        if conn is not None:
+            conn.cmd('progress')
+        else:
+            send_cmd_wait_all('progress', '127.0.0.1', port)
+        latencies.append(time.perf_counter() - time_started)
+        time.sleep(0.005)
+    if conn is not None:
+        conn.close()
+    return latencies
+
+def time_phase(results, name, port, count):
+    for persistent in (False, True):
+        key = '{} ({})'.format(name, 'persistent' if persistent else 'new')
+        results[key] = summarize(time_progress_requests(port, count,
+                                                        persistent))
+        print('  progress {:<24} p50 {p50:.5f}s  p99 {p99:.5f}s  max\
+ {max:.5f}s'.format(key, **results[key]), flush=True)
+
+def run(scale, request_count):
+    from pmus.db import MusicProvider
+    from pmus.server import Server
+    from pmus.client import send_cmd_wait_all
+
+    work_dir = tempfile.mkdtemp(prefix='pmus_bench_')
+    try:
+        db_path = os.path.join(work_dir, 'music.db')
+        generate_database(db_path, *scale[:5])
+        provider = MusicProvider(db_path)
+        provider.load_music(validate_files=False)
+        port = get_free_port()
+        server = Server(BenchPlayer(provider.get_songs_list()[0]), provider,
+                        '127.0.0.1', port)
+        threading.Thread(target=server.start, daemon=True).start()
+        wait_for_server(port)
+
+        results = {}
+        time_phase(results, 'idle', port, request_count)
+
+        stop = threading.Event()
+        heavy_times = []
+        def run_heavy_commands():
+            while not stop.is_set():
+                time_started = time.perf_counter()
+                send_cmd_wait_all(HEAVY_COMMAND, '127.0.0.1', port)
+                heavy_times.append(time.perf_counter() - time_started)
+        heavy_thread = threading.Thread(target=run_heavy_commands)
+        heavy_thread.start()
+        time.sleep(0.1)
+        time_phase(results, 'busy', port, request_count)
+        stop.set()
+        heavy_thread.join()
+        results['heavy_command'] = {'command': HEAVY_COMMAND.split(' ')[:5],
+                                    'runs': len(heavy_times),
+                                    'mean': sum(heavy_times) / len(heavy_times)}
+        print('  heavy command: {} runs, {:.4f}s each'.format(
+            len(heavy_times), results['heavy_command']['mean']))
+        server.loop.call_soon_threadsafe(server.server.close)
+        provider.db_provider.close()
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='benchmark how quickly the server answers player\
+ commands while it is busy')
+    parser.add_argument('-s', '--scale', default='medium',
+                        help='size of the library ({})'.format(
+                            ', '.join(SCALES)))
+    parser.add_argument('-n', '--requests', type=int, default=500,
+                        help='progress requests sent in each phase')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to as json')
+    args = parser.parse_args()
+    if not args.scale in SCALES:
+        print('unknown scale {}'.format(args.scale))
+        sys.exit(1)
+
+    print(args.scale, flush=True)
+    results = {'commit': get_git_commit(),
+               'time': int(time.time() * 1000),
+               'scale': args.scale,
+               'latencies': run(SCALES[args.scale], args.requests)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2) + '\n')
+        print('results written to {}'.format(args.output))
@@ -0,0 +1,255 @@
+import os
+import struct
+
+# writers for small but valid audio files with tags, used by the benchmarks
+# to build libraries of any size without needing real music
+
+MPEG_FRAME_HEADER = b'\xff\xfb\x90\x64' # mpeg 1 layer 3, 128kbps, 44.1khz
+MPEG_FRAME_SIZE = 417
+
+def syncsafe_bytes(value):
+    return bytes([(value >> 21) & 0x7f, (value >> 14) & 0x7f,
+                  (value >> 7) & 0x7f, value & 0x7f])
+
+def id3v2_tag(tags):
+    frame_ids = {'title': 'TIT2', 'artist': 'TPE1',
+                 'album_artist': 'TPE2', 'album': 'TALB', 'track': 'TRCK',
+                 'date': 'TDRC'}
+    frames = b''
+    for key, value in tags.items():
+        data = b'\x03' + value.encode('utf-8')
+        frames += frame_ids[key].encode() + syncsafe_bytes(len(data)) +\
+                  b'\x00\x00' + data
+    frames += b'\x00' * 256 # padding, like most taggers leave
+    return b'ID3\x04\x00\x00' + syncsafe_bytes(len(frames)) + frames
+
+def write_mp3(filepath, tags, seconds):
+    frame_count = int(seconds * 44100 / 1152)
+    frame = MPEG_FRAME_HEADER + b'\x00' * (MPEG_FRAME_SIZE - 4)
+    with open(filepath, 'wb') as f:
+        f.write(id3v2_tag(tags))
+        f.write(frame * frame_count)
+
+def vorbis_comment(tags):
+    keys = {'album_artist': 'ALBUMARTIST', 'track': 'TRACKNUMBER'}
+    vendor = b'pmus synthetic'
+    data = struct.pack('<I', len(vendor)) + vendor +\
+           struct.pack('<I', len(tags))
+    for key, value in tags.items():
+        comment = '{}={}'.format(keys.get(key, key.upper()), value).encode()
+        data += struct.pack('<I', len(comment)) + comment
+    return data
+
+def write_flac(filepath, tags, seconds):
+    sample_rate = 44100
+    total_samples = int(seconds * sample_rate)
+    streaminfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bps - 1, 36 bits samples
+    packed = (sample_rate << 44) | (1 << 41) | (15 << 36) | total_samples
+    streaminfo += packed.to_bytes(8, 'big') + b'\x00' * 16
+    comment = vorbis_comment(tags)
+    with open(filepath, 'wb') as f:
+        f.write(b'fLaC')
+        f.write(b'\x00' + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+        f.write(b'\x84' + len(comment).to_bytes(3, 'big') + comment)
+
+def ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for i in range(8):
+            if crc & 0x80000000:
+                crc = ((crc << 1) ^ 0x04c11db7) & 0xffffffff
+            else:
+                crc = (crc << 1) & 0xffffffff
+    return crc
+
+def ogg_page(packet, granule_position, serial, sequence, header_type=0):
+    segments = [255] * (len(packet) // 255) + [len(packet) % 255]
+    header = b'OggS\x00' + bytes([header_type]) +\
+             struct.pack('<qIII', granule_position, serial, sequence, 0) +\
+             bytes([len(segments)]) + bytes(segments)
+    page = header + packet
+    crc = ogg_crc(page)
+    return page[:22] + struct.pack('<I', crc) + page[26:]
+
+def write_opus(filepath, tags, seconds):
+    serial = 0x706d7573
+    pre_skip = 312
+    opus_head = b'OpusHead\x01\x02' + struct.pack('<HIhB', pre_skip, 48000,
+                                                  0, 0)
+    opus_tags = b'OpusTags' + vorbis_comment(tags)
+    granule_position = int(seconds * 48000) + pre_skip
+    with open(filepath, 'wb') as f:
+        f.write(ogg_page(opus_head, 0, serial, 0, 0x02))
+        f.write(ogg_page(opus_tags, 0, serial, 1))
+        # a single silent 20ms frame (toc byte for celt fb 20ms) per page
+        f.write(ogg_page(b'\xfc', granule_position, serial, 2, 0x04))
+
+def mp4_atom(atom_type, data):
+    return struct.pack('>I', len(data) + 8) + atom_type + data
+
+def write_m4a(filepath, tags, seconds):
+    atom_types = {'title': b'\xa9nam', 'artist': b'\xa9ART',
+                  'album_artist': b'aART', 'album': b'\xa9alb',
+                  'date': b'\xa9day'}
+    items = b''
+    for key, value in tags.items():
+        if key == 'track':
+            number = int(value.split('/')[0])
+            data = struct.pack('>IIHHHH', 0, 0, 0, number, 0, 0)
+            items += mp4_atom(b'trkn', mp4_atom(b'data', data))
+        else:
+            data = struct.pack('>II', 1, 0) + value.encode('utf-8')
+            items += mp4_atom(atom_types[key], mp4_atom(b'data', data))
+    timescale = 44100
+    mvhd = struct.pack('>IIIII', 0, 0, 0, timescale, int(seconds * timescale))
+    mvhd += b'\x00' * 80
+    hdlr = mp4_atom(b'hdlr', b'\x00' * 8 + b'mdirappl' + b'\x00' * 9)
+    meta = mp4_atom(b'meta', b'\x00' * 4 + hdlr + mp4_atom(b'ilst', items))
+    moov = mp4_atom(b'moov', mp4_atom(b'mvhd', mvhd) +
+                    mp4_atom(b'udta', meta))
+    with open(filepath, 'wb') as f:
+        f.write(mp4_atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom'))
+        f.write(moov)
+        f.write(mp4_atom(b'mdat', b''))
+
+AUDIO_FILE_WRITERS = {
+    'mp3': write_mp3,
+    'flac': write_flac,
+    'opus': write_opus,
+    'm4a': write_m4a,
+}
+
+# writes artist_count * albums_per_artist * songs_per_album tagged files
+# under music_dir, cycling through the supported formats, returns their paths
+def generate_audio_tree(music_dir, artist_count, albums_per_artist,
+                        songs_per_album, extensions=None, seconds=3):
+    if extensions is None:
+        extensions = list(AUDIO_FILE_WRITERS)
+    filepaths = []
+    for artist_idx in range(artist_count):
+        artist_name = 'artist {}'.format(artist_idx)
+        for album_idx in range(albums_per_artist):
+            album_name = 'album {} {}'.format(artist_idx, album_idx)
+            album_dir = os.path.join(music_dir, artist_name, album_name)
+            os.makedirs(album_dir, exist_ok=True)
+            extension = extensions[(artist_idx * albums_per_artist + album_idx)
+                                   % len(extensions)]
+            for song_idx in range(songs_per_album):
+                tags = {'title': 'song {} {} {}'.format(artist_idx, album_idx,
+                                                        song_idx),
+                        'artist': artist_name,
+                        'album_artist': artist_name,
+                        'album': album_name,
+                        'track': '{}/{}'.format(song_idx + 1, songs_per_album),
+                        'date': str(2000 + album_idx)}
+                filepath = os.path.join(album_dir, '{:02} {}.{}'.format(
+                    song_idx + 1, tags['title'], extension))
+                AUDIO_FILE_WRITERS[extension](filepath, tags, seconds)
+                filepaths.append(filepath)
+    return filepaths
+
+# fixed so that generated databases are the same on every run
+SYNTHETIC_EPOCH = 1600000000000 # ms
+SONG_DURATION = 200 # seconds
+
+# creates a music database at path with artist_count * albums_per_artist *
+# songs_per_album songs and playback_count playbacks spread over the songs,
+# each with pauses_per_playback pause/resume pairs, audio urls point under
+# music_dir (which doesnt have to exist). migrate=False leaves the database
+# at the schema of the first release
+def generate_database(path, artist_count, albums_per_artist, songs_per_album,
+                      playback_count, pauses_per_playback=1,
+                      music_dir='/synthetic/music', migrate=True, seed=0):
+    import random
+    import sqlite3
+    from pmus.db import get_schema_buffer
+    from pmus import migrations, rollups
+
+    rand = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(get_schema_buffer())
+    if migrate:
+        migrations.migrate(conn)
+
+    artists = []
+    albums = []
+    album_artists = []
+    songs = []
+    song_artists = []
+    album_songs = []
+    liked_songs = []
+    for artist_idx in range(artist_count):
+        artist_id = artist_idx + 1
+        artist_name = 'artist {}'.format(artist_idx)
+        artists.append((artist_id, artist_name, SYNTHETIC_EPOCH))
+        for album_idx in range(albums_per_artist):
+            album_id = len(albums) + 1
+            album_name = 'album {} {}'.format(artist_idx, album_idx)
+            albums.append((album_id, album_name, 2000 + album_idx,
+                           SYNTHETIC_EPOCH))
+            album_artists.append((artist_id, album_id))
+            for song_idx in range(songs_per_album):
+                song_id = len(songs) + 1
+                audio_url = '{}/{}/{}/{:02} song {}.flac'.format(
+                        music_dir, artist_name, album_name, song_idx + 1,
+                        song_id)
+                songs.append((song_id, 'song {}'.format(song_id),
+                              SYNTHETIC_EPOCH, audio_url, SONG_DURATION))
+                song_artists.append((artist_id, song_id))
+                album_songs.append((song_id, album_id, song_idx + 1))
+                if song_id % 10 == 0:
+                    liked_songs.append((song_id, SYNTHETIC_EPOCH + song_id))
+
+    playbacks = []
+    pauses = []
+    resumes = []
+    seeks = []
+    time_started = SYNTHETIC_EPOCH
+    for playback_idx in range(playback_count):
+        playback_id = playback_idx + 1
+        song_id = rand.randint(1, len(songs))
+        time_ended = time_started + SONG_DURATION * 1000
+        # pauses are spread evenly over the playback and last 10s each
+        for pause_idx in range(pauses_per_playback):
+            pause_time = time_started + (pause_idx + 1) * SONG_DURATION * 1000\
+                    // (pauses_per_playback + 1)
+            pauses.append((pause_time, playback_id))
+            resumes.append((pause_time + 10000, playback_id))
+            time_ended += 10000
+        if playback_idx % 20 == 0:
+            seeks.append((time_started + 1000, 30, playback_id))
+        playbacks.append((playback_id, time_started, time_ended, song_id))
+        time_started = time_ended + rand.randint(0, 3600 * 1000)
+
+    with conn:
+        conn.executemany('INSERT INTO artists (id, name, time)\
+                          VALUES (?, ?, ?)', artists)
+        conn.executemany('INSERT INTO albums (id, name, year, time)\
+                          VALUES (?, ?, ?, ?)', albums)
+        conn.executemany('INSERT INTO album_artists (artist_id, album_id)\
+                          VALUES (?, ?)', album_artists)
+        conn.executemany('INSERT INTO songs (id, name, time, audio_url,\
+                          duration) VALUES (?, ?, ?, ?, ?)', songs)
+        conn.executemany('INSERT INTO song_artists (artist_id, song_id)\
+                          VALUES (?, ?)', song_artists)
+        conn.executemany('INSERT INTO album_songs (song_id, album_id,\
+                          index_in_album) VALUES (?, ?, ?)', album_songs)
+        conn.executemany('INSERT INTO liked_songs (song_id, time)\
+                          VALUES (?, ?)', liked_songs)
+        conn.executemany('INSERT INTO playbacks (id, time_started,\
+                          time_ended, song_id) VALUES (?, ?, ?, ?)', playbacks)
+        conn.executemany('INSERT INTO pauses (time, playback_id)\
+                          VALUES (?, ?)', pauses)
+        conn.executemany('INSERT INTO resumes (time, playback_id)\
+                          VALUES (?, ?)', resumes)
+        conn.executemany('INSERT INTO seeks (time, position, playback_id)\
+                          VALUES (?, ?, ?)', seeks)
+        # the playbacks were inserted behind the daemon's back
+        if migrate:
+            rollups.fill_rollups(conn)
+    conn.close()
+    return {'artists': len(artists), 'albums': len(albums),
+            'songs': len(songs), 'playbacks': len(playbacks),
+            'pauses': len(pauses)}
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# compares the builtin tag reader against spawning ffprobe for every file
+# usage: python -m bench.tag_reader [-n files] [music_dir]
+import argparse
+import shutil
+import tempfile
+import time
+
+from bench.synthetic import generate_audio_tree
+from pmus import ffmpeg
+from pmus.scan import list_audio_files
+from pmus.tags import read_audio_format
+
+def time_reader(reader, filepaths):
+    results = {}
+    time_started = time.perf_counter()
+    for filepath in filepaths:
+        try:
+            results[filepath] = reader(filepath)
+        except Exception as e:
+            results[filepath] = e
+    return time.perf_counter() - time_started, results
+
+def same_format(builtin_format, ffprobe_format):
+    if not isinstance(builtin_format, dict) or\
+            not isinstance(ffprobe_format, dict):
+        return False
+    if abs(float(builtin_format['duration']) -
+           float(ffprobe_format['duration'])) > 0.1:
+        return False
+    ffprobe_tags = ffprobe_format.get('tags', {})
+    for key in ('title', 'artist', 'album', 'track'):
+        if builtin_format.get('tags', {}).get(key) != ffprobe_tags.get(key):
+            return False
+    return True
+
+def print_timing(name, seconds, file_count):
+    print('{:>8}: {:8.3f}s total, {:8.3f}ms per file'.format(
+        name, seconds, seconds / file_count * 1000))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='benchmark the builtin tag reader against ffprobe')
+    parser.add_argument('music_dir', nargs='?',
+                        help='library to read, a synthetic one is generated if omitted')
+    parser.add_argument('-n', '--files', type=int, default=400,
+                        help='number of synthetic files to generate')
+    args = parser.parse_args()
+
+    tmp_dir = None
+    music_dir = args.music_dir
+    if music_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix='pmus_bench_')
+        music_dir = tmp_dir
+        songs_per_album = 10
+        generate_audio_tree(music_dir, max(args.files // songs_per_album // 4, 1),
+                            4, songs_per_album)
+    filepaths = list_audio_files(music_dir)
+    print('reading {} files from {}'.format(len(filepaths), music_dir))
+
+    builtin_seconds, builtin_results = time_reader(read_audio_format, filepaths)
+    print_timing('builtin', builtin_seconds, len(filepaths))
+    unreadable = [filepath for filepath, result in builtin_results.items()
+                  if not isinstance(result, dict)]
+    print('{} files would fall back to ffprobe'.format(len(unreadable)))
+
+    if shutil.which('ffprobe'):
+        ffprobe_seconds, ffprobe_results = time_reader(ffmpeg.get_audio_format,
+                                                       filepaths)
+        print_timing('ffprobe', ffprobe_seconds, len(filepaths))
+        print('speedup: {:.1f}x'.format(ffprobe_seconds / builtin_seconds))
+        mismatches = [filepath for filepath in filepaths
+                      if filepath not in unreadable and
+                      not same_format(builtin_results[filepath],
+                                      ffprobe_results[filepath])]
+        print('{} files read differently than ffprobe'.format(len(mismatches)))
+        for filepath in mismatches[:10]:
+            print('  {}'.format(filepath))
+    else:
+        print('ffprobe not found in $PATH, skipping the comparison')
+
+    if tmp_dir is not None:
+        shutil.rmtree(tmp_dir)
@@ -1,21 +1,91 @@
 import socket
 from pmus.config import config
+from pmus.protocol import (MAGIC, PROTOCOL_VERSION, RESPONSE_HEADER,
+                           FRAME_DATA, FRAME_ERROR, FRAME_END, CommandError,
+                           encode_handshake, encode_request)
 
-RECV_CHUNK_SIZE = 1024
+# a connection to the daemon that commands can be sent over one after the
+# other (or several at once, see send() and iter_response()), for clients
+# that send a lot of commands like status bars polling the progress:
+#   with Connection() as conn:
+#       while True:
+#           print(conn.cmd('progress'))
+# the daemon closes it after config.idle_connection_timeout without a
+# command. not safe to use from more than one thread at a time
+class Connection:
+    def __init__(self, host=config.host, port=config.port):
+        self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile('rb')
+        self.next_request_id = 1
+        # frames of requests other than the one being read, by request id
+        self.pending_frames = {}
+        self.socket.sendall(encode_handshake())
+        reply = self.read_exactly(len(MAGIC) + 1)
+        if reply[:len(MAGIC)] != MAGIC or reply[-1] != PROTOCOL_VERSION:
+            self.close()
+            raise ConnectionError('the daemon doesnt speak protocol version'
+                                  ' {}'.format(PROTOCOL_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def read_exactly(self, n):
+        data = self.file.read(n)
+        if len(data) < n:
+            raise ConnectionError('the daemon closed the connection')
+        return data
+
+    # sends the command without waiting for the response, returns the id to
+    # get it with
+    def send(self, cmd):
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.socket.sendall(encode_request(request_id, cmd))
+        self.pending_frames[request_id] = []
+        return request_id
+
+    def read_frame(self):
+        request_id, frame_type, length = RESPONSE_HEADER.unpack(
+                self.read_exactly(RESPONSE_HEADER.size))
+        return request_id, frame_type, self.read_exactly(length)
+
+    # yields the response to the request as it comes in, frames of other
+    # requests read in the meantime are kept until their turn
+    def iter_response(self, request_id):
+        while True:
+            frames = self.pending_frames[request_id]
+            if frames:
+                frame_type, payload = frames.pop(0)
+            else:
+                frame_request_id, frame_type, payload = self.read_frame()
+                if frame_request_id != request_id:
+                    if frame_request_id in self.pending_frames:
+                        self.pending_frames[frame_request_id].append(
+                                (frame_type, payload))
+                    continue
+            if frame_type == FRAME_DATA:
+                yield payload.decode()
+            elif frame_type == FRAME_ERROR:
+                del self.pending_frames[request_id]
+                raise CommandError(payload.decode())
+            elif frame_type == FRAME_END:
+                del self.pending_frames[request_id]
+                return
+
+    def cmd(self, cmd):
+        return ''.join(self.iter_response(self.send(cmd)))
 
 def send_cmd(cmd, host=config.host, port=config.port):
-    if isinstance(cmd, str):
-        cmd = cmd.encode()
-    s = socket.socket()
-    s.connect((host, port))
-    s.sendall(cmd)
-    data = s.recv(RECV_CHUNK_SIZE)
-    while data:
-        try:
-            yield data.decode()
-            data = s.recv(RECV_CHUNK_SIZE)
-        except UnicodeDecodeError:
-            data += s.recv(RECV_CHUNK_SIZE)
+    with Connection(host, port) as conn:
+        for data in conn.iter_response(conn.send(cmd)):
+            yield data
 
 def send_cmd_wait_all(cmd, host=config.host, port=config.port):
     all_data = ''
@@ -24,5 +94,8 @@ def send_cmd_wait_all(cmd, host=config.host, port=config.port):
     return all_data
 
 def cmd_to_stdout(cmd, host=config.host, port=config.port):
-    for data in send_cmd(cmd, host, port):
-        print(data, end='', flush=True)
+    try:
+        for data in send_cmd(cmd, host, port):
+            print(data, end='', flush=True)
+    except CommandError as e:
+        print('error: {}'.format(e))
@@ -1,3 +1,4 @@
+import os
 import json
 import subprocess
 from pathlib import Path
@@ -19,6 +20,38 @@ def load_config():
         config.port = int(config_json['port'])
         config.host = config_json['host']
         config.on_play_script = config_json['on_play_script']
+        config.scan_workers = int(config_json.get('scan_workers',
+                                                  config.scan_workers))
+        config.scan_use_processes = bool(config_json.get('scan_use_processes',
+                                                         config.scan_use_processes))
+        config.use_builtin_tag_reader = bool(config_json.get(
+            'use_builtin_tag_reader', config.use_builtin_tag_reader))
+        config.validate_workers = int(config_json.get('validate_workers',
+                                                      config.validate_workers))
+        config.watch_music_dir = bool(config_json.get('watch_music_directory',
+                                                      config.watch_music_dir))
+        config.watch_debounce = float(config_json.get('watch_debounce',
+                                                      config.watch_debounce))
+        config.watch_poll_interval = float(config_json.get(
+            'watch_poll_interval', config.watch_poll_interval))
+        config.enable_metrics = bool(config_json.get('enable_metrics',
+                                                     config.enable_metrics))
+        config.catalog_wait_timeout = float(config_json.get(
+            'catalog_wait_timeout', config.catalog_wait_timeout))
+        config.journal_commit_delay = float(config_json.get(
+            'journal_commit_delay', config.journal_commit_delay))
+        config.db_read_connections = int(config_json.get(
+            'db_read_connections', config.db_read_connections))
+        config.db_busy_timeout = float(config_json.get('db_busy_timeout',
+                                                       config.db_busy_timeout))
+        config.server_workers = int(config_json.get('server_workers',
+                                                    config.server_workers))
+        config.output_flush_size = int(config_json.get(
+            'output_flush_size', config.output_flush_size))
+        config.client_timeout = float(config_json.get('client_timeout',
+                                                      config.client_timeout))
+        config.idle_connection_timeout = float(config_json.get(
+            'idle_connection_timeout', config.idle_connection_timeout))
     except Exception as e:
         print('error loading config file')
         print(e)
@@ -43,5 +76,21 @@ class Config:
     host = '0.0.0.0'
     port = 5150
     on_play_script = None
+    scan_workers = os.cpu_count() or 1 # number of files probed in parallel
+    scan_use_processes = False
+    use_builtin_tag_reader = True # only fall back to ffprobe when needed
+    validate_workers = 8 # directories checked in parallel at startup
+    watch_music_dir = False # pick up changes to music_dir while running
+    watch_debounce = 2.0 # seconds without changes before we rescan
+    watch_poll_interval = 30.0 # used when inotify isnt available
+    enable_metrics = False # time commands and sqlite statements
+    catalog_wait_timeout = 2.0 # seconds commands wait for the music to load
+    journal_commit_delay = 0.05 # seconds playback writes are gathered for
+    db_read_connections = 4 # read-only connections reads can run on at once
+    db_busy_timeout = 5.0 # seconds to wait for another writer to finish
+    server_workers = 4 # commands other than player ones handled at once
+    output_flush_size = 65536 # characters of output sent to clients at once
+    client_timeout = 30.0 # seconds a client has to send a command (or handshake)
+    idle_connection_timeout = 600.0 # seconds a framed connection can sit idle
 
 config = load_config()
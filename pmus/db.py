@@ -1,13 +1,30 @@
+import time
 import sqlite3
+import threading
+import traceback
+import queue
+from contextlib import contextmanager
+from urllib.request import pathname2url
+import heapq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os.path
 import os
 
-from pmus.ffmpeg import get_audio_format
-from pmus.music import Song, Album, Artist, Playback
+from pmus.scan import (AUDIO_FILE_EXTENSIONS, stat_audio_files, is_in_dir,
+                       is_audio_file, list_dir_files, probe_files,
+                       print_probe_error)
+from pmus.ingest import LibraryIngest
+from pmus.sorting import index_in_album_key
+from pmus.playback_store import PlaybackStore
+from pmus.timeline import PlaybackTimeline
+from pmus.migrations import migrate, get_schema_version
+from pmus.rollups import (add_playbacks_to_rollups, get_songs_time_listened,
+                          fill_rollups)
+from pmus.snapshot import get_snapshot_path, load_snapshot, save_snapshot
+from pmus.music import Song, Album, Artist, Playback, sum_totals
 from pmus.utils import current_time, file_exists
 from pmus.config import config
-
-AUDIO_FILE_EXTENSIONS = ['mp3', 'flac', 'opus', 'm4a']
+from pmus import metrics
 
 def get_schema_buffer():
     project_directory_path = os.path.realpath(
@@ -15,21 +32,64 @@ def get_schema_buffer():
     with open(os.path.join(project_directory_path, 'schema.sql')) as schema_file:
         return schema_file.read()
 
+# the columns MusicProvider.load_music needs from each table, these rows are
+# also what gets stored in the snapshot (see pmus.snapshot)
+CATALOG_QUERIES = {
+    'songs': 'SELECT id, name, audio_url, duration FROM songs',
+    'artists': 'SELECT id, name FROM artists',
+    'albums': 'SELECT id, name, year FROM albums',
+    'song_artists': 'SELECT song_id, artist_id FROM song_artists',
+    'album_artists': 'SELECT album_id, artist_id FROM album_artists',
+    'album_songs': 'SELECT song_id, album_id, index_in_album FROM album_songs',
+    'liked_songs': 'SELECT song_id, time FROM liked_songs',
+    'playbacks': 'SELECT id, song_id, time_started, time_ended FROM playbacks',
+    'pauses': 'SELECT playback_id, time FROM pauses',
+    'resumes': 'SELECT playback_id, time FROM resumes',
+}
+
+# the part of loading the music counted as done once the rows are read, the
+# rest is building the music from them
+LOAD_PROGRESS_READ = 0.3
+
+# the least time (in seconds) between removals of missing songs during the
+# validation, every removal copies the loaded songs (see change_catalog())
+VALIDATE_REMOVE_INTERVAL = 0.2
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
         d[col[0]] = row[idx]
     return d
 
+# songs first, the totals of albums and artists are summed from theirs
+def compute_listening_totals(songs, albums, artists):
+    for song in songs.values():
+        song.set_totals(song.compute_totals())
+    for album in albums.values():
+        album.set_totals(album.compute_totals())
+    for artist in artists.values():
+        artist.set_totals(artist.compute_totals())
+
 class DBProvider:
     def __init__(self, db_path=config.database_path):
         self.path = db_path
         should_create_db = False
         if not file_exists(self.path):
             should_create_db = True
+        # every write goes through self.conn, one transaction at a time (see
+        # writing()), reads that can run while something is being written go
+        # through a pool of read-only connections (see reading()). the
+        # database is in WAL mode so neither waits for the other, and other
+        # processes can read and write it while the daemon is running
         self.conn = self.get_new_conn()
+        self.write_lock = threading.RLock()
+        self.read_conns = queue.LifoQueue()
+        self.read_conn_count = 0
+        self.read_conns_lock = threading.Lock()
         if should_create_db:
             self.create_db()
+        migrate(self.conn)
+        self.fill_rollups()
 
     def create_db(self):
         self.conn.executescript(get_schema_buffer())
@@ -37,6 +97,73 @@ class DBProvider:
     def cursor(self):
         return self.conn.cursor()
 
+    # a transaction on the write connection that no other thread writes in
+    # the middle of, committed at the end (or rolled back on an exception)
+    @contextmanager
+    def writing(self):
+        with self.write_lock:
+            with self.conn:
+                yield self.conn
+
+    # a cursor on one of the read-only connections, has to be done with (the
+    # rows fetched) by the end of the with block
+    @contextmanager
+    def reading(self, tuples=False):
+        conn = self.get_read_conn()
+        try:
+            c = conn.cursor()
+            if tuples:
+                c.row_factory = None
+            yield c
+        finally:
+            self.read_conns.put(conn)
+
+    def get_read_conn(self):
+        with self.read_conns_lock:
+            if self.read_conns.empty() and\
+                    self.read_conn_count < config.db_read_connections:
+                self.read_conn_count += 1
+                return self.get_new_conn(read_only=True)
+        return self.read_conns.get()
+
+    def close(self):
+        with self.read_conns_lock:
+            while not self.read_conns.empty():
+                self.read_conns.get().close()
+                self.read_conn_count -= 1
+        self.conn.close()
+
+    # a cursor that returns plain tuples, much cheaper than dict_factory for
+    # queries that return a lot of rows
+    def tuple_cursor(self):
+        c = self.conn.cursor()
+        c.row_factory = None
+        return c
+
+    def get_change_counter(self):
+        with self.reading(tuples=True) as c:
+            return c.execute('SELECT change_counter FROM db_state')\
+                    .fetchone()[0]
+
+    def get_schema_version(self):
+        with self.write_lock:
+            return get_schema_version(self.conn)
+
+    # returns a map of table name to a list of row tuples, see CATALOG_QUERIES,
+    # all read in one transaction so they fit together
+    def get_catalog_rows(self):
+        catalog_rows = {}
+        with self.reading(tuples=True) as c:
+            c.execute('BEGIN')
+            try:
+                for table, query in CATALOG_QUERIES.items():
+                    catalog_rows[table] = c.execute(query).fetchall()
+            finally:
+                c.execute('COMMIT')
+        return catalog_rows
+
+    # the writes below use the write connection without taking the lock, they
+    # have to be called inside writing()
     def add_song(self, name, audio_url, duration):
         c = self.cursor()
         c.execute('INSERT INTO songs\
@@ -82,317 +209,967 @@ class DBProvider:
                    (name, current_time()))
         return c.lastrowid
 
+    # the bulk versions below take rows with their ids already allocated,
+    # see get_next_id()
+    def add_songs(self, rows):
+        self.cursor().executemany('INSERT INTO songs\
+                                   (id, name, audio_url, duration, time)\
+                                   VALUES (?, ?, ?, ?, ?)', rows)
+
+    def add_song_artists(self, rows):
+        self.cursor().executemany('INSERT INTO song_artists\
+                                   (artist_id, song_id)\
+                                   VALUES (?, ?)', rows)
+
+    def add_album_artists(self, rows):
+        self.cursor().executemany('INSERT INTO album_artists\
+                                   (artist_id, album_id)\
+                                   VALUES (?, ?)', rows)
+
+    def add_album_songs(self, rows):
+        self.cursor().executemany('INSERT INTO album_songs\
+                                   (song_id, album_id, index_in_album)\
+                                   VALUES (?, ?, ?)', rows)
+
+    def add_albums(self, rows):
+        self.cursor().executemany('INSERT INTO albums\
+                                   (id, name, year, time)\
+                                   VALUES (?, ?, ?, ?)', rows)
+
+    def add_artists(self, rows):
+        self.cursor().executemany('INSERT INTO artists\
+                                   (id, name, time)\
+                                   VALUES (?, ?, ?)', rows)
+
+    def update_songs(self, rows):
+        self.cursor().executemany('UPDATE songs SET name = ?, duration = ?\
+                                   WHERE id = ?', rows)
+
+    # the id the next row inserted into an AUTOINCREMENT table would get, read
+    # on the write connection so it includes what is being written
+    def get_next_id(self, table):
+        with self.write_lock:
+            c = self.cursor()
+            max_id = c.execute('SELECT MAX(id) AS max_id FROM {}'.format(
+                table)).fetchone()['max_id'] or 0
+            seq_row = c.execute('SELECT seq FROM sqlite_sequence\
+                                 WHERE name = ?', (table,)).fetchone()
+        if seq_row is not None and seq_row['seq'] > max_id:
+            max_id = seq_row['seq']
+        return max_id + 1
+
     def add_liked_song(self, song_id):
-        self.cursor().execute('INSERT INTO liked_songs\
-                               (song_id, time)\
-                               VALUES (?, ?)',
-                              (song_id, current_time()))
-        self.commit()
+        with self.writing() as conn:
+            conn.execute('INSERT INTO liked_songs\
+                          (song_id, time)\
+                          VALUES (?, ?)',
+                         (song_id, current_time()))
 
     def add_playback(self, time_started, time_ended, song_id):
-        c = self.cursor()
-        c.execute('INSERT INTO playbacks\
-                   (time_started, time_ended, song_id)\
-                   VALUES (?, ?, ?)',
-                  (time_started, time_ended, song_id))
-        self.commit()
+        with self.writing() as conn:
+            c = conn.execute('INSERT INTO playbacks\
+                              (time_started, time_ended, song_id)\
+                              VALUES (?, ?, ?)',
+                             (time_started, time_ended, song_id))
         return c.lastrowid
 
     def add_pause(self, time, playback_id):
-        self.cursor().execute('INSERT INTO pauses\
-                               (time, playback_id)\
-                               VALUES (?, ?)',
-                              (time, playback_id))
-        self.commit()
+        with self.writing() as conn:
+            conn.execute('INSERT INTO pauses\
+                          (time, playback_id)\
+                          VALUES (?, ?)',
+                         (time, playback_id))
 
     def add_resume(self, time, playback_id):
-        self.cursor().execute('INSERT INTO resumes\
-                               (time, playback_id)\
-                               VALUES (?, ?)',
-                              (time, playback_id))
-        self.commit()
+        with self.writing() as conn:
+            conn.execute('INSERT INTO resumes\
+                          (time, playback_id)\
+                          VALUES (?, ?)',
+                         (time, playback_id))
 
     def add_seek(self, time, position, playback_id):
-        self.cursor().execute('INSERT INTO seeks\
-                               (time, position, playback_id)\
-                               VALUES (?, ?, ?)',
-                              (time, position, playback_id))
-        self.commit()
+        with self.writing() as conn:
+            conn.execute('INSERT INTO seeks\
+                          (time, position, playback_id)\
+                          VALUES (?, ?, ?)',
+                         (time, position, playback_id))
 
     def get_playbacks(self):
-        return self.cursor().execute('SELECT * FROM playbacks').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM playbacks').fetchall()
 
     def get_pauses(self):
-        return self.cursor().execute('SELECT * FROM pauses').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM pauses').fetchall()
 
     def get_resumes(self):
-        return self.cursor().execute('SELECT * FROM resumes').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM resumes').fetchall()
 
     def get_seeks(self, playback_id):
-        c = self.cursor()
-        return c.execute('SELECT * FROM seeks WHERE playback_id = ?',
-                         (playback_id,)).fetchall()
-
-    def get_new_conn(self):
-        conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.reading() as c:
+            return c.execute('SELECT * FROM seeks WHERE playback_id = ?',
+                             (playback_id,)).fetchall()
+
+    def get_new_conn(self, read_only=False):
+        if read_only:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(
+                                       pathname2url(self.path)), uri=True,
+                                   check_same_thread=False,
+                                   timeout=config.db_busy_timeout,
+                                   factory=metrics.get_connection_factory())
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False,
+                                   timeout=config.db_busy_timeout,
+                                   factory=metrics.get_connection_factory())
+            conn.execute('PRAGMA journal_mode = WAL')
+            # safe with WAL, a crash can only lose the last transactions
+            conn.execute('PRAGMA synchronous = NORMAL')
         conn.row_factory = dict_factory
         return conn
 
+    # the playback has to have ended, see pmus/rollups.py
+    def add_playback_to_rollups(self, playback):
+        with self.writing():
+            add_playbacks_to_rollups(self.tuple_cursor(), [playback])
+
+    # rolls up the ended playbacks that werent, ones other processes wrote
+    # or whose rollup write was lost (see PlaybackJournal)
+    def fill_rollups(self):
+        with self.writing():
+            added_count = fill_rollups(self.tuple_cursor())
+        if added_count:
+            print('rolled up {} playbacks'.format(added_count))
+
+    # returns {song id: ms listened between from_time and to_time}
+    def get_songs_time_listened(self, from_time, to_time):
+        with self.reading(tuples=True) as c:
+            return get_songs_time_listened(c, from_time, to_time)
+
     def update_playback_time_ended(self, playback_id, time_ended):
-        c = self.cursor()
-        c.execute('UPDATE playbacks SET\
-                   time_ended = ?\
-                   WHERE id = ?',
-                  (time_ended, playback_id))
-        self.conn.commit()
+        with self.writing() as conn:
+            conn.execute('UPDATE playbacks SET\
+                          time_ended = ?\
+                          WHERE id = ?',
+                         (time_ended, playback_id))
 
     def get_artist(self, artist_id):
-        c = self.cursor()
-        return c.execute('SELECT * FROM artists WHERE id = ?',
-                         (artist_id,)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM artists WHERE id = ?',
+                             (artist_id,)).fetchone()
 
     def get_album(self, album_id):
-        c = self.cursor()
-        return c.execute('SELECT * FROM albums WHERE id = ?',
-                         (album_id,)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM albums WHERE id = ?',
+                             (album_id,)).fetchone()
 
     def get_song(self, song_id):
-        c = self.cursor()
-        return c.execute('SELECT * FROM songs WHERE id = ?',
-                         (song_id,)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM songs WHERE id = ?',
+                             (song_id,)).fetchone()
 
     def get_artist_by_name(self, artist_name):
-        return self.cursor().execute('SELECT * FROM artists WHERE name = ?',
-                                     (artist_name,)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM artists WHERE name = ?',
+                             (artist_name,)).fetchone()
 
     def get_album_by_name(self, album_name, artist_id):
-        return self.cursor().execute('SELECT * FROM albums WHERE name = ? AND\
-                                      id IN (select album_id from album_artists\
-                                      WHERE artist_id = ?)',
-                                     (album_name, artist_id)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM albums WHERE name = ? AND\
+                              id IN (select album_id from album_artists\
+                              WHERE artist_id = ?)',
+                             (album_name, artist_id)).fetchone()
 
     def get_album_song_by_idx(self, album_id, idx_in_album):
-        return self.cursor().execute('SELECT * FROM album_songs WHERE album_id = ? AND\
-                                      index_in_album = ?',
-                                     (album_id, idx_in_album)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM album_songs WHERE album_id = ? AND\
+                              index_in_album = ?',
+                             (album_id, idx_in_album)).fetchone()
 
     def song_with_audio_url_exists(self, url):
-        return self.cursor().execute('SELECT id FROM songs WHERE audio_url = ?',
-                                     (url,)).fetchone() is not None
+        with self.reading() as c:
+            return c.execute('SELECT id FROM songs WHERE audio_url = ?',
+                             (url,)).fetchone() is not None
+
+    def get_song_by_audio_url(self, url):
+        with self.reading() as c:
+            return c.execute('SELECT * FROM songs WHERE audio_url = ?',
+                             (url,)).fetchone()
+
+    def get_scan_manifest(self):
+        with self.reading() as c:
+            return c.execute('SELECT * FROM scan_manifest').fetchall()
+
+    # entries are (path, size, mtime, inode) tuples, like the other writes to
+    # the scan manifest it has to be called inside writing()
+    def add_scan_manifest_entries(self, entries, time_scanned):
+        self.cursor().executemany('INSERT OR REPLACE INTO scan_manifest\
+                                   (path, size, mtime, inode, time_scanned,\
+                                    time_vanished)\
+                                   VALUES (?, ?, ?, ?, ?, NULL)',
+                                  [entry + (time_scanned,) for entry in entries])
+
+    # like set_scan_manifest_vanished but paths can also be directories, in
+    # which case every file under them is marked
+    def set_scan_manifest_vanished_under(self, paths, time_vanished):
+        rows = []
+        for path in paths:
+            directory = os.path.join(path, '')
+            rows.append((time_vanished, path, len(directory), directory))
+        self.cursor().executemany('UPDATE scan_manifest SET time_vanished = ?\
+                                   WHERE time_vanished IS NULL AND\
+                                   (path = ? OR substr(path, 1, ?) = ?)', rows)
+
+    def set_scan_manifest_vanished(self, paths, time_vanished):
+        self.cursor().executemany('UPDATE scan_manifest SET time_vanished = ?\
+                                   WHERE path = ?',
+                                  [(time_vanished, path) for path in paths])
+
+    # SELECT columns FROM table WHERE column IN values, in chunks so we stay
+    # below sqlite's limit on the number of parameters
+    def get_rows_where_in(self, table, column, values, columns='*'):
+        values = list(values)
+        rows = []
+        chunk_size = 500
+        with self.reading() as c:
+            for i in range(0, len(values), chunk_size):
+                chunk = values[i:i + chunk_size]
+                rows += c.execute('SELECT {} FROM {} WHERE {} IN ({})'.format(
+                    columns, table, column, ','.join('?' * len(chunk))),
+                    chunk).fetchall()
+        return rows
 
     def get_songs(self):
-        return self.cursor().execute('SELECT id,name,time,audio_url,duration\
-                                      FROM songs').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT id,name,time,audio_url,duration\
+                              FROM songs').fetchall()
 
     def get_artists(self):
-        return self.cursor().execute('SELECT * FROM artists').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM artists').fetchall()
 
     def get_albums(self):
-        return self.cursor().execute('SELECT * FROM albums').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM albums').fetchall()
 
     def get_album_artists(self):
-        return self.cursor().execute('SELECT * FROM album_artists').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM album_artists').fetchall()
 
     def get_song_artists(self):
-        return self.cursor().execute('SELECT * FROM song_artists').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM song_artists').fetchall()
 
     def get_album_songs(self):
-        return self.cursor().execute('SELECT * FROM album_songs').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM album_songs').fetchall()
 
     def is_song_liked(self, song_id):
-        liked_song_row = self.cursor().execute('SELECT * FROM liked_songs\
-                                      WHERE song_id = ?', (song_id,)).fetchone()
+        with self.reading() as c:
+            liked_song_row = c.execute('SELECT * FROM liked_songs\
+                                        WHERE song_id = ?',
+                                       (song_id,)).fetchone()
         return liked_song_row is not None
 
     def get_liked_songs(self):
-        return self.cursor().execute('SELECT * FROM liked_songs').fetchall()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM liked_songs').fetchall()
+
+    # returns the id of the first playback that started at or after time, the
+    # ids of playbacks grow with the time they started at
+    def get_first_playback_id_since(self, time):
+        with self.reading(tuples=True) as c:
+            return c.execute('SELECT MIN(id) FROM playbacks\
+                              WHERE time_started >= ?', (time,)).fetchone()[0]
 
     def get_playback(self, playback_id):
-        return self.cursor().execute('SELECT * FROM playbacks WHERE id = ?',
-                         (playback_id,)).fetchone()
+        with self.reading() as c:
+            return c.execute('SELECT * FROM playbacks WHERE id = ?',
+                             (playback_id,)).fetchone()
 
     def set_song_lyrics(self, song_id, lyrics):
-        self.cursor().execute('UPDATE songs SET lyrics = ? WHERE id = ?',
-                              (lyrics, song_id))
+        with self.writing() as conn:
+            conn.execute('UPDATE songs SET lyrics = ? WHERE id = ?',
+                         (lyrics, song_id))
 
     def get_song_lyrics(self, song_id):
-        return self.cursor().execute('SELECT lyrics FROM songs WHERE id = ?',
-                         (song_id,)).fetchone()['lyrics']
+        with self.reading() as c:
+            return c.execute('SELECT lyrics FROM songs WHERE id = ?',
+                             (song_id,)).fetchone()['lyrics']
 
     def commit(self):
-        self.conn.commit()
+        with self.write_lock:
+            self.conn.commit()
+
+# the loaded music. it is never changed in place (except for playbacks
+# being added), changes are made to a copy that then replaces it (see
+# MusicProvider.change_catalog()), so that whoever is going through the songs
+# or albums meanwhile keeps seeing all of them
+class Catalog:
+    def __init__(self, songs=None, albums=None, artists=None, playbacks=None):
+        self.songs = {} if songs is None else songs
+        self.albums = {} if albums is None else albums
+        self.artists = {} if artists is None else artists
+        self.playbacks = {} if playbacks is None else playbacks
+
+    # the music objects are the same ones, only the dicts are copied
+    def copy(self):
+        return Catalog(dict(self.songs), dict(self.albums), dict(self.artists),
+                       self.playbacks)
 
 class MusicProvider:
-    def __init__(self):
-        self.db_provider = DBProvider()
-        self.songs = {}
-        self.albums = {}
+    def __init__(self, db_path=config.database_path):
+        self.db_provider = DBProvider(db_path)
+        self.catalog = Catalog()
+        # taken by whatever changes the catalog, readers dont need it
+        self.catalog_lock = threading.RLock()
         self.singles = {}
-        self.artists = {}
-        self.playbacks = {}
+        # built from self.playbacks the first time they are needed
+        self.playback_store = None
+        self.playback_timeline = None
+        self.loaded = False
+        # set once the music is loaded, load_progress goes from 0 to 1 meanwhile
+        self.loaded_event = threading.Event()
+        self.load_progress = 0
+        # whether songs whose files are gone were removed yet
+        self.validated = False
+        # find_music and the library watcher both write, only one at a time
+        self.scan_lock = threading.Lock()
+        self.ingest = None
+        self.snapshot_path = get_snapshot_path(self.db_provider.path)
+        self.snapshot_change_counter = None
+
+    @property
+    def songs(self):
+        return self.catalog.songs
+
+    @property
+    def albums(self):
+        return self.catalog.albums
+
+    @property
+    def artists(self):
+        return self.catalog.artists
+
+    @property
+    def playbacks(self):
+        return self.catalog.playbacks
+
+    # makes the changes to a copy of the catalog and swaps it in at the end
+    def change_catalog(self, change):
+        with self.catalog_lock:
+            catalog = self.catalog.copy()
+            change(catalog)
+            self.catalog = catalog
 
     def unload_music(self):
-        self.songs = {}
-        self.albums = {}
+        with self.catalog_lock:
+            self.catalog = Catalog()
         self.singles = {}
-        self.artists = {}
-        self.playbacks = {}
-
-    def load_music(self):
-        db_songs = self.db_provider.get_songs()
-        db_artists = self.db_provider.get_artists()
-        db_albums = self.db_provider.get_albums()
-        db_song_artists = self.db_provider.get_song_artists()
-        db_album_artists = self.db_provider.get_album_artists()
-        db_album_songs = self.db_provider.get_album_songs()
-        db_liked_songs = self.db_provider.get_liked_songs()
-        db_playbacks = self.db_provider.get_playbacks()
-        db_pauses = self.db_provider.get_pauses()
-        db_resumes = self.db_provider.get_resumes()
+        self.playback_store = None
+        self.playback_timeline = None
+        self.loaded = False
+        self.loaded_event.clear()
+        self.load_progress = 0
+
+    # validate_files=False skips checking that the audio files still exist,
+    # the caller should run validate_music() (or start_validation()) itself
+    def load_music(self, validate_files=True):
+        self.validated = False
+        self.load_progress = 0
+        with metrics.time_phase('load_music', 'read_catalog'):
+            catalog_rows = self.get_catalog_rows()
+        self.load_progress = LOAD_PROGRESS_READ
+        with metrics.time_phase('load_music', 'build_music'):
+            self.build_music(catalog_rows)
+        if validate_files:
+            self.validate_music()
+
+    # loads the music in a thread and then validates it in the same thread,
+    # on_loaded is called in between
+    def start_loading(self, on_loaded=None):
+        def load():
+            try:
+                self.load_music(validate_files=False)
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print(e)
+                return
+            print('music loaded')
+            if on_loaded is not None:
+                on_loaded()
+            self.validate_music()
+        threading.Thread(target=load, daemon=True).start()
+
+    # returns whether the music is loaded, waiting up to timeout seconds
+    def wait_loaded(self, timeout=None):
+        return self.loaded_event.wait(timeout)
+
+    def start_validation(self):
+        threading.Thread(target=self.validate_music, daemon=True).start()
+
+    # removes songs (and albums left without songs) whose files were deleted
+    # or moved. songs are grouped by directory so that every directory is
+    # listed once with scandir instead of stat'ing every file, which matters
+    # a lot on network mounts, directories are listed by a pool of workers
+    # and missing songs are pruned as listings come back (the ones found
+    # within VALIDATE_REMOVE_INTERVAL of each other together)
+    def validate_music(self, workers=None):
+        with metrics.time_phase('load_music', 'validate_music'):
+            self.validate_files(workers)
+        self.validated = True
+
+    def validate_files(self, workers):
+        if workers is None:
+            workers = config.validate_workers
+        songs_by_dir = {}
+        for song in self.get_songs_list():
+            directory, filename = os.path.split(song.audio_url)
+            songs_by_dir.setdefault(directory, []).append((filename, song))
+        missing_songs = []
+        last_removed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(list_dir_files, directory)
+                       for directory in songs_by_dir]
+            for future in as_completed(futures):
+                directory, filenames = future.result()
+                for filename, song in songs_by_dir[directory]:
+                    if not filename in filenames:
+                        missing_songs.append(song)
+                if missing_songs and time.monotonic() - last_removed >=\
+                        VALIDATE_REMOVE_INTERVAL:
+                    self.remove_songs(missing_songs)
+                    missing_songs = []
+                    last_removed = time.monotonic()
+        if missing_songs:
+            self.remove_songs(missing_songs)
+
+    # returns the rows to build the loaded music from, from the snapshot if
+    # nothing changed in the database since it was taken, from sqlite if
+    # something did (the snapshot is then refreshed in the background)
+    def get_catalog_rows(self):
+        schema_version = self.db_provider.get_schema_version()
+        change_counter = self.db_provider.get_change_counter()
+        catalog_rows = load_snapshot(self.snapshot_path, change_counter,
+                                     schema_version)
+        if catalog_rows is not None:
+            self.snapshot_change_counter = change_counter
+            return catalog_rows
+        catalog_rows = self.db_provider.get_catalog_rows()
+        # something may have been written while we were reading
+        if self.db_provider.get_change_counter() == change_counter:
+            threading.Thread(target=self.write_snapshot,
+                             args=(change_counter, schema_version,
+                                   catalog_rows)).start()
+        return catalog_rows
+
+    def write_snapshot(self, change_counter, schema_version, catalog_rows):
+        try:
+            save_snapshot(self.snapshot_path, change_counter, schema_version,
+                          catalog_rows)
+            self.snapshot_change_counter = change_counter
+        except Exception as e:
+            print('couldnt write snapshot {}: {}'.format(self.snapshot_path, e))
+
+    # takes a fresh snapshot if the database changed since the last one, to be
+    # called when terminating so the next start can skip sqlite
+    def update_snapshot(self):
+        change_counter = self.db_provider.get_change_counter()
+        if change_counter == self.snapshot_change_counter:
+            return
+        catalog_rows = self.db_provider.get_catalog_rows()
+        if self.db_provider.get_change_counter() == change_counter:
+            self.write_snapshot(change_counter,
+                                self.db_provider.get_schema_version(),
+                                catalog_rows)
+
+    # builds the music into new dicts and swaps them in at the end, so that
+    # whoever reads the loaded music meanwhile sees either the old music or
+    # the new one. the part of the rows gone through so far is kept in
+    # load_progress (the first LOAD_PROGRESS_READ of it is reading them)
+    def build_music(self, catalog_rows):
+        songs = {}
+        albums = {}
+        artists = {}
+        playbacks = {}
+        total_rows = sum(len(rows) for rows in catalog_rows.values()) or 1
+        rows_done = 0
+        def rows_built(rows):
+            nonlocal rows_done
+            rows_done += len(rows)
+            self.load_progress = LOAD_PROGRESS_READ +\
+                (1 - LOAD_PROGRESS_READ) * rows_done / total_rows
+
+        for artist_id, name in catalog_rows['artists']:
+            artists[artist_id] = Artist(artist_id, name, [], [])
+        rows_built(catalog_rows['artists'])
+
+        for song_id, name, audio_url, duration in catalog_rows['songs']:
+            songs[song_id] = Song(song_id, audio_url, name, [], duration,
+                                  playbacks=[])
+        rows_built(catalog_rows['songs'])
+
+        for album_id, name, year in catalog_rows['albums']:
+            albums[album_id] = Album(album_id, name, [], [], year)
+        rows_built(catalog_rows['albums'])
+
+        for album_id, artist_id in catalog_rows['album_artists']:
+            artists[artist_id].albums.append(albums[album_id])
+            albums[album_id].artists.append(artists[artist_id])
+        rows_built(catalog_rows['album_artists'])
+
+        for song_id, artist_id in catalog_rows['song_artists']:
+            songs[song_id].artists.append(artists[artist_id])
+        rows_built(catalog_rows['song_artists'])
+
+        for song_id, album_id, index_in_album in catalog_rows['album_songs']:
+            albums[album_id].songs.append(songs[song_id])
+            songs[song_id].album = albums[album_id]
+            songs[song_id].index_in_album = index_in_album
+        rows_built(catalog_rows['album_songs'])
+
+        for song_id, time_liked in catalog_rows['liked_songs']:
+            songs[song_id].time_liked = time_liked
+        rows_built(catalog_rows['liked_songs'])
+
+        # sort songs in album by their index in it
+        for album in albums.values():
+            album.songs.sort(key=index_in_album_key)
+
+        for playback_id, song_id, time_started, time_ended in\
+                catalog_rows['playbacks']:
+            playback = Playback(playback_id, song_id, time_started, time_ended,
+                                [], [])
+            playbacks[playback_id] = playback
+            if song_id in songs:
+                songs[song_id].add_playback(playback)
+        rows_built(catalog_rows['playbacks'])
+
+        for playback_id, time in catalog_rows['pauses']:
+            playbacks[playback_id].pauses.append(time)
+        rows_built(catalog_rows['pauses'])
+
+        for playback_id, time in catalog_rows['resumes']:
+            playbacks[playback_id].resumes.append(time)
+        rows_built(catalog_rows['resumes'])
+
+        compute_listening_totals(songs, albums, artists)
+        with self.catalog_lock:
+            self.catalog = Catalog(songs, albums, artists, playbacks)
+        self.playback_store = None
+        self.playback_timeline = None
+        self.load_progress = 1
+        self.loaded = True
+        self.loaded_event.set()
+
+    # refreshes the totals of albums and artists whose songs changed
+    def update_listening_totals(self, albums, artists):
+        for album in set(albums):
+            album.set_totals(album.compute_totals())
+        for artist in set(artists):
+            artist.set_totals(artist.compute_totals())
+
+    # returns (music object, kept totals, recomputed totals) for every song,
+    # album and artist whose running totals dont match the ones computed from
+    # scratch from the playbacks
+    def check_listening_totals(self):
+        mismatches = []
+        song_totals = {}
+        for song in self.get_songs_list():
+            song_totals[song.id] = song.compute_totals()
+            if song.get_totals() != song_totals[song.id]:
+                mismatches.append((song, song.get_totals(),
+                                   song_totals[song.id]))
+        for album in self.get_albums_list():
+            totals = sum_totals(song_totals[song.id] for song in album.songs
+                                if song.id in song_totals)
+            if album.get_totals() != totals:
+                mismatches.append((album, album.get_totals(), totals))
+        for artist in self.get_artists_list():
+            totals = sum_totals(song_totals[song.id]
+                                for song in artist.get_songs()
+                                if song.id in song_totals)
+            if artist.get_totals() != totals:
+                mismatches.append((artist, artist.get_totals(), totals))
+        return mismatches
+
+    # the artists whose time listened includes the song's
+    def get_counting_artists(self, song):
+        if song.album is not None:
+            return song.album.artists
+        return [artist for artist in song.artists if song in artist.singles]
+
+    # called by MusicMonitor when a song starts playing, time_ended is -1
+    # until end_playback() is called
+    def add_playback(self, playback_id, song_id, time_started):
+        playback = Playback(playback_id, song_id, time_started, -1, [], [])
+        self.playbacks[playback_id] = playback
+        if self.playback_timeline is not None:
+            self.playback_timeline.add(playback)
+        if song_id in self.songs:
+            self.songs[song_id].add_playback(playback)
+        return playback
+
+    # a playback that started while the music was loading was added to the
+    # music from before, which build_music() then replaced with music built
+    # from the database that either doesnt have it or has another object for
+    # it, returns the one in the loaded music (adding it if it isnt there)
+    def get_loaded_playback(self, playback):
+        loaded_playback = self.playbacks.get(playback.id)
+        if loaded_playback is playback:
+            return playback
+        if loaded_playback is None:
+            self.playbacks[playback.id] = playback
+            if self.playback_timeline is not None:
+                self.playback_timeline.add(playback)
+            song = self.songs.get(playback.song_id)
+            if song is not None:
+                song.add_playback(playback)
+            return playback
+        # the player keeps adding pauses and resumes to its own object
+        loaded_playback.pauses = playback.pauses
+        loaded_playback.resumes = playback.resumes
+        return loaded_playback
+
+    def end_playback(self, playback, time_ended):
+        player_playback = playback
+        playback = self.get_loaded_playback(playback)
+        song = self.songs.get(playback.song_id)
+        # the playback was already ended before, take back what it added
+        if playback.time_ended != -1 and song is not None:
+            self.add_to_listening_totals(song, (-playback.time_listened(), -1,
+                                                None))
+        playback.time_ended = time_ended
+        player_playback.time_ended = time_ended
+        self.playback_store = None
+        if self.playback_timeline is not None:
+            self.playback_timeline.on_playback_ended(playback)
+        if song is not None:
+            song.on_playback_ended(playback)
+            self.add_to_listening_totals(song, (playback.time_listened(), 1,
+                                                playback.time_started))
+
+    def add_to_listening_totals(self, song, totals):
+        for music_object in [song, song.album] + \
+                list(self.get_counting_artists(song)):
+            if music_object is not None:
+                music_object.set_totals(sum_totals([music_object.get_totals(),
+                                                    totals]))
+
+
+    # adds the songs with the given ids (and their albums/artists if they
+    # arent loaded yet) to the loaded music without reloading everything
+    def load_songs(self, song_ids):
+        self.change_catalog(
+                lambda catalog: self.load_songs_into(catalog, song_ids))
+
+    # lists of songs and albums that readers may be going through are
+    # replaced instead of appended to (or sorted) in place
+    def load_songs_into(self, catalog, song_ids):
+        db_songs = self.db_provider.get_rows_where_in(
+                'songs', 'id', song_ids, 'id,name,time,audio_url,duration')
+        db_song_artists = self.db_provider.get_rows_where_in(
+                'song_artists', 'song_id', song_ids)
+        db_album_songs = self.db_provider.get_rows_where_in(
+                'album_songs', 'song_id', song_ids)
+        db_liked_songs = self.db_provider.get_rows_where_in(
+                'liked_songs', 'song_id', song_ids)
+        album_ids = set(db_album_song['album_id']
+                        for db_album_song in db_album_songs)
+        album_ids.difference_update(catalog.albums)
+        db_albums = self.db_provider.get_rows_where_in('albums', 'id',
+                                                       album_ids)
+        db_album_artists = self.db_provider.get_rows_where_in(
+                'album_artists', 'album_id', album_ids)
+        artist_ids = set(row['artist_id']
+                         for row in db_song_artists + db_album_artists)
+        artist_ids.difference_update(catalog.artists)
+        db_artists = self.db_provider.get_rows_where_in('artists', 'id',
+                                                        artist_ids)
 
         for db_artist in db_artists:
             artist = Artist(db_artist['id'], db_artist['name'], [], [])
-            self.artists[artist.id] = artist
-
-        for db_song in db_songs:
-            song = Song(db_song['id'], db_song['audio_url'], db_song['name'],
-                        [], db_song['duration'], playbacks=[])
-            self.songs[song.id] = song
+            catalog.artists[artist.id] = artist
 
         for db_album in db_albums:
             album = Album(db_album['id'], db_album['name'], [],
                           [], db_album['year'])
-            self.albums[album.id] = album
+            catalog.albums[album.id] = album
 
         for db_album_artist in db_album_artists:
-            album_id = db_album_artist['album_id']
-            artist_id = db_album_artist['artist_id']
-            self.artists[artist_id].albums.append(self.albums[album_id])
-            self.albums[album_id].artists.append(self.artists[artist_id])
+            album = catalog.albums[db_album_artist['album_id']]
+            artist = catalog.artists[db_album_artist['artist_id']]
+            artist.albums = artist.albums + [album]
+            album.artists.append(artist)
+
+        new_songs = {}
+        for db_song in db_songs:
+            song = Song(db_song['id'], db_song['audio_url'], db_song['name'],
+                        [], db_song['duration'], playbacks=[])
+            new_songs[song.id] = song
 
         for db_song_artist in db_song_artists:
-            song_id = db_song_artist['song_id']
-            artist_id = db_song_artist['artist_id']
-            self.songs[song_id].artists.append(self.artists[artist_id])
+            new_songs[db_song_artist['song_id']].artists.append(
+                    catalog.artists[db_song_artist['artist_id']])
 
+        added_album_songs = {} # album -> its new songs
         for db_album_song in db_album_songs:
-            song_id = db_album_song['song_id']
-            album_id = db_album_song['album_id']
-            self.albums[album_id].songs.append(self.songs[song_id])
-            self.songs[song_id].album = self.albums[album_id]
-            self.songs[song_id].index_in_album = db_album_song['index_in_album']
+            song = new_songs[db_album_song['song_id']]
+            album = catalog.albums[db_album_song['album_id']]
+            song.album = album
+            song.index_in_album = db_album_song['index_in_album']
+            added_album_songs.setdefault(album, []).append(song)
+        for album, songs in added_album_songs.items():
+            album.songs = sorted(album.songs + songs, key=index_in_album_key)
+        changed_albums = list(added_album_songs)
 
         for db_liked_song in db_liked_songs:
-            song_id = db_liked_song['song_id']
-            self.songs[song_id].time_liked = db_liked_song['time']
-
-        # remove songs/albums that were deleted/moved from filesystem
-        for album in list(self.albums.values()):
-            for song in list(album.songs):
-                if not file_exists(song.audio_url):
-                    album.songs.remove(song)
-                    del self.songs[song.id]
-            if not album.songs:
-                del self.albums[album.id]
+            new_songs[db_liked_song['song_id']].time_liked = db_liked_song['time']
 
-        # sort songs in album by their index in it
-        for album in self.albums.values():
-            for i in range(len(album.songs)):
-                for j in range(i + 1, len(album.songs)):
-                    if album.songs[j].index_in_album < album.songs[i].index_in_album:
-                        album.songs[i], album.songs[j] = album.songs[j], album.songs[i]
-
-        for db_playback in db_playbacks:
-            playback = Playback(db_playback['id'],
-                                db_playback['song_id'],
-                                db_playback['time_started'],
-                                db_playback['time_ended'],
-                                [], [])
-            self.playbacks[db_playback['id']] = playback
-            if db_playback['song_id'] in self.songs:
-                self.songs[db_playback['song_id']].playbacks.append(playback)
+        # songs that come back after their file vanished already have history
+        for playback in list(catalog.playbacks.values()):
+            if playback.song_id in new_songs:
+                new_songs[playback.song_id].add_playback(playback)
 
-        for db_pause in db_pauses:
-            self.playbacks[db_pause['playback_id']].pauses.append(db_pause)
+        catalog.songs.update(new_songs)
 
-        for db_resume in db_resumes:
-            self.playbacks[db_resume['playback_id']].pauses.append(db_resume)
+        changed_artists = []
+        for song in new_songs.values():
+            song.set_totals(song.compute_totals())
+            changed_artists.extend(self.get_counting_artists(song))
+        self.update_listening_totals(changed_albums, changed_artists)
 
-    def on_audio_file_found(self, filepath):
-        for song in self.songs.values():
-            if song.audio_url == filepath:
-                return
-        audio_format = get_audio_format(filepath)
-        if not 'tags' in audio_format:
+    def remove_song(self, song):
+        self.remove_songs([song])
+
+    def remove_songs(self, songs):
+        def remove(catalog):
+            for song in songs:
+                self.remove_song_from(catalog, song)
+        self.change_catalog(remove)
+
+    def remove_song_from(self, catalog, song):
+        # the watcher and the validation can both try to remove a song
+        if catalog.songs.pop(song.id, None) is None:
             return
-        tags = audio_format['tags']
-        if not 'artist' in tags or not 'title' in tags:
+        artists = self.get_counting_artists(song)
+        album = song.album
+        if album is not None:
+            album.songs = [album_song for album_song in album.songs
+                           if album_song is not song]
+            if not album.songs:
+                catalog.albums.pop(album.id, None)
+                for artist in album.artists:
+                    artist.albums = [artist_album
+                                     for artist_album in artist.albums
+                                     if artist_album is not album]
+            self.update_listening_totals([album], artists)
+
+    # returns the loaded songs whose files are at (or under, for directories)
+    # the given paths
+    def get_songs_under(self, paths):
+        paths = set(paths)
+        if not paths:
+            return []
+        songs = []
+        for song in self.get_songs_list():
+            path = song.audio_url
+            while path and path != '/':
+                if path in paths:
+                    songs.append(song)
+                    break
+                path = os.path.dirname(path)
+        return songs
+
+    def remove_songs_under(self, paths):
+        songs = self.get_songs_under(paths)
+        if songs:
+            self.remove_songs(songs)
+
+    # whoever reads the loaded music meanwhile sees it either from before or
+    # from after all of the changes
+    def apply_library_changes(self, new_song_ids, updated_song_ids,
+                              vanished_paths):
+        if not self.loaded:
             return
-
-        artist_names = [tag.strip() for tag in tags['artist'].split(',')]
-        album_artist_names = artist_names
-        if 'album_artist' in tags:
-            album_artist_names = [tag.strip() for tag in tags['album_artist'].split(',')]
-        song_name = tags['title']
-
-        db_artists = []
-        for artist_name in artist_names:
-            db_artist = self.db_provider.get_artist_by_name(artist_name)
-            if db_artist is None:
-                self.db_provider.add_artist(artist_name)
-                db_artist = self.db_provider.get_artist_by_name(artist_name)
-            db_artists.append(db_artist)
-
-        if 'album' in tags:
-            if not 'track' in tags:
-                return
-            idx_in_album = tags['track'].split('/')[0]
-            album_name = tags['album']
-            album_year = None
-            if 'date' in tags:
-                album_year = tags['date']
-            db_album_artists = []
-            for db_album_artist_name in album_artist_names:
-                db_album_artist = self.db_provider.get_artist_by_name(db_album_artist_name)
-                if db_album_artist is None:
-                    self.db_provider.add_artist(db_album_artist_name)
-                    db_album_artist = self.db_provider.get_artist_by_name(db_album_artist_name)
-                db_album_artists.append(db_album_artist)
-            db_album = self.db_provider.get_album_by_name(album_name,
-                    db_album_artists[0]['id'])
-            album_id = None
-            if db_album is None:
-                album_id = self.db_provider.add_album(album_name, album_year)
-                for db_album_artist in db_album_artists:
-                    self.db_provider.add_album_artist(album_id, db_album_artist['id'])
-                print('added album {} - {}'.format(album_name, db_album_artists[0]['name']))
-            else:
-                album_id = db_album['id']
-                old_album_song = self.db_provider.get_album_song_by_idx(album_id, idx_in_album)
-                if old_album_song is not None:
-                    old_song = self.db_provider.get_song(old_album_song['song_id'])
-                    if old_album_song is not None and file_exists(old_song['audio_url']):
-                        return
-            song_id = self.db_provider.add_song(song_name, filepath, audio_format['duration'])
-            for db_artist in db_artists:
-                self.db_provider.add_song_artist(song_id, db_artist['id'])
-            self.db_provider.add_album_song(song_id, album_id, idx_in_album)
-        #else:
-            #print('adding single {}'.format(song_name))
-
-    def find_music(self, music_dir=config.music_dir):
-        for folder, subs, files in os.walk(music_dir):
-            if not '/trash' in folder:
-                for filename in files:
-                    is_audio_file = False
-                    for audio_ext in AUDIO_FILE_EXTENSIONS:
-                        if filename.endswith('.' + audio_ext):
-                            is_audio_file = True
-                    if not is_audio_file:
+        def apply(catalog):
+            for song in self.get_songs_under(vanished_paths):
+                self.remove_song_from(catalog, song)
+            loaded_song_ids = [song_id for song_id in updated_song_ids
+                               if song_id in catalog.songs]
+            for db_song in self.db_provider.get_rows_where_in(
+                    'songs', 'id', loaded_song_ids, 'id,name,duration'):
+                song = catalog.songs[db_song['id']]
+                song.name = db_song['name']
+                song.duration = db_song['duration']
+            self.load_songs_into(catalog, new_song_ids +
+                                 [song_id for song_id in updated_song_ids
+                                  if song_id not in catalog.songs])
+        self.change_catalog(apply)
+
+    # flushes the scan in progress, the ingest keeps what it knows about the
+    # library in memory so the watcher doesnt have to reload it every time,
+    # it is thrown away if writing fails so it cant get out of sync
+    def flush_ingest(self):
+        try:
+            return self.ingest.flush()
+        except:
+            self.ingest = None
+            raise
+
+    # job is given when it runs as a job (see pmus/jobs.py), it is kept up to
+    # date with how many files were seen, probed and added. if the job is
+    # cancelled probing stops and whatever was probed until then is written,
+    # the next scan picks up the rest
+    def find_music(self, music_dir=config.music_dir, workers=None, job=None):
+        with self.scan_lock:
+            self.scan_music_dir(music_dir, workers, job)
+
+    def scan_music_dir(self, music_dir, workers, job=None):
+        if workers is None:
+            workers = config.scan_workers
+        def set_phase(phase):
+            if job is not None:
+                job.set_phase(phase)
+        def add_to_job(counter, amount=1):
+            if job is not None:
+                job.add(counter, amount)
+        def is_cancelled():
+            return job is not None and job.cancelled()
+        scan_time = current_time()
+        set_phase('load_library')
+        with metrics.time_phase('find_music', 'load_library'):
+            manifest = {}
+            for entry in self.db_provider.get_scan_manifest():
+                manifest[entry['path']] = entry
+            self.ingest = LibraryIngest(self.db_provider)
+            ingest = self.ingest
+
+        # only files that are new or changed since the last scan get probed
+        file_stats = {}
+        unchanged_entries = []
+        filepaths = []
+        # songs whose files vanished and came back unchanged, they are in the
+        # database but not in the loaded music
+        returned_song_ids = []
+        set_phase('stat_files')
+        with metrics.time_phase('find_music', 'stat_files'):
+            music_dir_stats = stat_audio_files(music_dir)
+        add_to_job('files_seen', len(music_dir_stats))
+        for file_stat in music_dir_stats:
+            filepath, size, mtime, inode = file_stat
+            file_stats[filepath] = file_stat
+            entry = manifest.get(filepath)
+            if entry is None:
+                if filepath in ingest.song_ids:
+                    # added before the manifest existed, trust the database
+                    unchanged_entries.append(file_stat)
+                else:
+                    filepaths.append(filepath)
+            elif entry['size'] != size or entry['mtime'] != mtime or\
+                    entry['inode'] != inode:
+                filepaths.append(filepath)
+            elif entry['time_vanished'] is not None:
+                if filepath in ingest.song_ids:
+                    unchanged_entries.append(file_stat)
+                    returned_song_ids.append(ingest.song_ids[filepath])
+                else:
+                    # its song was deleted meanwhile
+                    filepaths.append(filepath)
+
+        vanished_paths = [path for path, entry in manifest.items()
+                          if entry['time_vanished'] is None and
+                          is_in_dir(path, music_dir) and
+                          path not in file_stats]
+
+        # probing runs in the pool, everything found is collected in memory
+        # and written to the database in one go at the end
+        probed_entries = []
+        add_to_job('files_to_probe', len(filepaths))
+        set_phase('probe_files')
+        with metrics.time_phase('find_music', 'probe_files'):
+            for filepath, audio_format, error in probe_files(
+                    filepaths, workers, config.scan_use_processes):
+                if is_cancelled():
+                    break
+                add_to_job('files_probed')
+                if error is not None:
+                    print_probe_error(filepath, error)
+                    continue
+                try:
+                    ingest.add(filepath, audio_format)
+                except Exception as e:
+                    print('failed to add {}: {}'.format(filepath, e))
+                    continue
+                probed_entries.append(file_stats[filepath])
+        # vanished files arent marked when cancelled, they may be among the
+        # ones that were moved and not probed yet
+        if is_cancelled():
+            vanished_paths = []
+        set_phase('write')
+        with metrics.time_phase('find_music', 'write'),\
+                self.db_provider.writing():
+            self.db_provider.add_scan_manifest_entries(
+                    unchanged_entries + probed_entries, scan_time)
+            self.db_provider.set_scan_manifest_vanished(vanished_paths,
+                                                        scan_time)
+            new_song_ids, updated_song_ids = self.flush_ingest()
+        add_to_job('songs_added', len(new_song_ids))
+        add_to_job('songs_updated', len(updated_song_ids))
+        add_to_job('files_vanished', len(vanished_paths))
+        set_phase('apply_changes')
+        # returned songs are loaded like updated ones that arent loaded
+        with metrics.time_phase('find_music', 'apply_changes'):
+            self.apply_library_changes(new_song_ids,
+                                       updated_song_ids + returned_song_ids,
+                                       vanished_paths)
+
+    # rescans only the given paths (files or directories), this is what the
+    # library watcher calls when something in the music directory changes
+    def update_music(self, paths, workers=None):
+        if workers is None:
+            workers = config.scan_workers
+        with self.scan_lock:
+            scan_time = current_time()
+            if self.ingest is None:
+                self.ingest = LibraryIngest(self.db_provider)
+            file_stats = {}
+            vanished_paths = []
+            for path in sorted(set(paths)):
+                if '/trash' in path:
+                    continue
+                if os.path.isdir(path):
+                    for file_stat in stat_audio_files(path):
+                        file_stats[file_stat[0]] = file_stat
+                elif os.path.isfile(path):
+                    if not is_audio_file(path):
                         continue
-                    filepath = os.path.join(folder, filename)
-                    self.on_audio_file_found(filepath)
-        self.db_provider.commit()
+                    stat = os.stat(path)
+                    file_stats[path] = (path, stat.st_size, stat.st_mtime_ns,
+                                        stat.st_ino)
+                else:
+                    vanished_paths.append(path)
+
+            probed_entries = []
+            for filepath, audio_format, error in probe_files(
+                    sorted(file_stats), workers, config.scan_use_processes):
+                if error is not None:
+                    print_probe_error(filepath, error)
+                    continue
+                try:
+                    self.ingest.add(filepath, audio_format)
+                except Exception as e:
+                    print('failed to add {}: {}'.format(filepath, e))
+                    continue
+                probed_entries.append(file_stats[filepath])
+            with self.db_provider.writing():
+                self.db_provider.add_scan_manifest_entries(probed_entries,
+                                                           scan_time)
+                self.db_provider.set_scan_manifest_vanished_under(
+                        vanished_paths, scan_time)
+                new_song_ids, updated_song_ids = self.flush_ingest()
+            self.apply_library_changes(new_song_ids, updated_song_ids,
+                                       vanished_paths)
 
     def get_songs_list(self):
         return list(self.songs.values())
@@ -406,6 +1183,127 @@ class MusicProvider:
     def get_playbacks_list(self):
         return list(self.playbacks.values())
 
+    def get_playback_timeline(self):
+        if self.playback_timeline is None:
+            self.playback_timeline = PlaybackTimeline(self.get_playbacks_list())
+        return self.playback_timeline
+
+    # returns the loaded songs that were playing at time
+    def get_songs_played_at(self, time):
+        songs = []
+        for playback in self.get_playback_timeline().get_playbacks_at(time):
+            if playback.song_id in self.songs:
+                songs.append(self.songs[playback.song_id])
+        return songs
+
+    def get_playback_store(self):
+        if self.playback_store is None:
+            self.playback_store = PlaybackStore(self.get_playbacks_list())
+        return self.playback_store
+
+    # returns {group: [ms listened between edges[i] and edges[i + 1], ...]}
+    # for the loaded songs, grouped by group_by which is one of 'song',
+    # 'album' and 'artist' (keyed by their ids, counted the same way their
+    # time_listened does) or None for the total of all songs (keyed by None)
+    def time_listened_histogram(self, edges, group_by=None):
+        song_groups = {}
+        if group_by is None:
+            for song_id in self.songs:
+                song_groups[song_id] = [None]
+        elif group_by == 'song':
+            for song_id in self.songs:
+                song_groups[song_id] = [song_id]
+        elif group_by == 'album':
+            for album in self.get_albums_list():
+                for song in album.songs:
+                    song_groups.setdefault(song.id, []).append(album.id)
+        elif group_by == 'artist':
+            for artist in self.get_artists_list():
+                for album in artist.albums:
+                    for song in album.songs:
+                        song_groups.setdefault(song.id, []).append(artist.id)
+                for single in artist.singles:
+                    song_groups.setdefault(single.id, []).append(artist.id)
+        else:
+            raise ValueError('cant group time listened by {}'.format(group_by))
+        histogram = self.get_playback_store().histogram(edges, song_groups)
+        if group_by is None:
+            histogram.setdefault(None, [0] * max(len(edges) - 1, 0))
+        return histogram
+
+    # returns the limit most listened to objects of music_type ('song',
+    # 'album' or 'artist') between from_time and to_time (all time if both
+    # are None) together with how long they were listened to, most listened
+    # first, objects that werent listened to at all are left out
+    def get_top(self, music_type, limit, from_time=None, to_time=None):
+        music_objects_map = self.get_music_objects_map(music_type)
+        if from_time is None and to_time is None:
+            times_listened = ((music_object, music_object.time_listened())
+                              for music_object in music_objects_map.values())
+        else:
+            if from_time is None:
+                from_time = 0
+            if to_time is None:
+                to_time = current_time()
+            histogram = self.time_listened_histogram([from_time, to_time],
+                                                     music_type)
+            times_listened = ((music_objects_map[music_object_id],
+                               round(row[0]))
+                              for music_object_id, row in histogram.items()
+                              if music_object_id in music_objects_map)
+        times_listened = [(music_object, time_listened)
+                          for music_object, time_listened in times_listened
+                          if time_listened > 0]
+        return heapq.nlargest(limit, times_listened,
+                              key=lambda item: item[1])
+
+    # returns {group: ms listened between from_time and to_time} from the
+    # rollups in the database (see pmus/rollups.py), grouped by group_by
+    # which is one of 'song', 'album' and 'artist' (only the loaded ones) or
+    # None for the total of all songs, keyed by None
+    def get_listening_stats(self, from_time, to_time, group_by=None):
+        songs_time_listened = self.db_provider.get_songs_time_listened(
+                from_time, to_time)
+        if group_by is None:
+            return {None: sum(songs_time_listened.values())}
+        stats = {}
+        if group_by == 'song':
+            for song_id, time_listened in songs_time_listened.items():
+                if song_id in self.songs:
+                    stats[song_id] = time_listened
+            return stats
+        for song_id, time_listened in songs_time_listened.items():
+            song = self.songs.get(song_id)
+            if song is None:
+                continue
+            if group_by == 'album':
+                groups = [song.album] if song.album is not None else []
+            elif group_by == 'artist':
+                groups = self.get_counting_artists(song)
+            else:
+                raise ValueError('cant group stats by {}'.format(group_by))
+            for group in groups:
+                stats[group.id] = stats.get(group.id, 0) + time_listened
+        return stats
+
+    def get_music_objects_map(self, music_type):
+        if music_type == 'song':
+            return self.songs
+        if music_type == 'album':
+            return self.albums
+        if music_type == 'artist':
+            return self.artists
+        raise ValueError('unknown music object type {}'.format(music_type))
+
+    # splits from_time to to_time into bin_count equal windows and returns
+    # their edges together with the histogram over them
+    def time_listened_timeline(self, from_time, to_time, bin_count,
+                               group_by=None):
+        bin_size = (to_time - from_time) / bin_count
+        edges = [from_time + bin_size * idx for idx in range(bin_count)]
+        edges.append(to_time)
+        return edges, self.time_listened_histogram(edges, group_by)
+
     def like_song(self, song):
         if self.db_provider.is_song_liked(song.id):
             return
@@ -0,0 +1,107 @@
+import io
+import csv
+import json
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_CHUNK_SIZE = 1000
+
+CSV_COLUMNS = ['playback_id', 'song_id', 'song_name', 'time_started',
+               'time_ended', 'event', 'time', 'position']
+
+# yields lists of up to chunk_size playbacks with an id of at least
+# since_id, each a dict with its pauses, resumes and seeks. the playbacks are
+# read a chunk at a time by id so that memory use doesnt depend on the size
+# of the history and no read transaction stays open between chunks
+def iter_history_chunks(db_provider, since_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    last_id = since_id - 1
+    while True:
+        with db_provider.reading(tuples=True) as c:
+            playbacks = read_history_chunk(c, last_id, chunk_size)
+        if not playbacks:
+            return
+        last_id = max(playbacks)
+        yield list(playbacks.values())
+
+# returns {playback id: playback dict} for up to chunk_size playbacks with
+# an id greater than after_id
+def read_history_chunk(c, after_id, chunk_size):
+    c.execute('SELECT playbacks.id, playbacks.song_id, songs.name,\
+                      playbacks.time_started, playbacks.time_ended\
+               FROM playbacks LEFT JOIN songs\
+               ON songs.id = playbacks.song_id\
+               WHERE playbacks.id > ? ORDER BY playbacks.id LIMIT ?',
+              (after_id, chunk_size))
+    playbacks = {}
+    for playback_id, song_id, song_name, time_started, time_ended in\
+            c.fetchall():
+        playbacks[playback_id] = {'id': playback_id,
+                                  'song_id': song_id,
+                                  'song_name': song_name,
+                                  'time_started': time_started,
+                                  'time_ended': time_ended,
+                                  'pauses': [],
+                                  'resumes': [],
+                                  'seeks': []}
+    if not playbacks:
+        return playbacks
+    first_id = min(playbacks)
+    last_id = max(playbacks)
+    for table in ('pauses', 'resumes'):
+        c.execute('SELECT playback_id, time FROM {}\
+                   WHERE playback_id BETWEEN ? AND ?\
+                   ORDER BY playback_id, id'.format(table),
+                  (first_id, last_id))
+        for playback_id, time in c:
+            if playback_id in playbacks:
+                playbacks[playback_id][table].append(time)
+    c.execute('SELECT playback_id, time, position FROM seeks\
+               WHERE playback_id BETWEEN ? AND ?\
+               ORDER BY playback_id, id',
+              (first_id, last_id))
+    for playback_id, time, position in c:
+        if playback_id in playbacks:
+            playbacks[playback_id]['seeks'].append({'time': time,
+                                                    'position': position})
+    return playbacks
+
+def format_jsonl(playbacks):
+    return ''.join(json.dumps(playback) + '\n' for playback in playbacks)
+
+# one row for the playback itself and one for each pause, resume and seek in
+# it, with the playback's columns repeated
+def format_csv(playbacks):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    for playback in playbacks:
+        playback_row = [playback['id'], playback['song_id'],
+                        playback['song_name'], playback['time_started'],
+                        playback['time_ended']]
+        writer.writerow(playback_row + ['playback', '', ''])
+        for time in playback['pauses']:
+            writer.writerow(playback_row + ['pause', time, ''])
+        for time in playback['resumes']:
+            writer.writerow(playback_row + ['resume', time, ''])
+        for seek in playback['seeks']:
+            writer.writerow(playback_row + ['seek', seek['time'],
+                                            seek['position']])
+    return out.getvalue()
+
+# yields the history in export_format a chunk at a time, since_time (ms)
+# leaves out the playbacks that started before it
+def export_history(db_provider, export_format, since_time=None,
+                   chunk_size=EXPORT_CHUNK_SIZE):
+    if not export_format in EXPORT_FORMATS:
+        raise ValueError('unknown export format {}'.format(export_format))
+    if export_format == 'csv':
+        yield ','.join(CSV_COLUMNS) + '\n'
+        format_chunk = format_csv
+    else:
+        format_chunk = format_jsonl
+    since_id = 0
+    if since_time is not None:
+        since_id = db_provider.get_first_playback_id_since(since_time)
+        # nothing started since then, only the header is written
+        if since_id is None:
+            return
+    for playbacks in iter_history_chunks(db_provider, since_id, chunk_size):
+        yield format_chunk(playbacks)
@@ -0,0 +1,158 @@
+import re
+from functools import lru_cache
+
+from pmus.music import Song, Album, Artist
+from pmus.output import is_json_format, encode_json
+
+# the fields an info format (-F) can have for each type of music object,
+# each a function that returns the field of a music object as a string.
+# missing values (a song without an album, an artist without songs..) are
+# 'none'
+
+def to_field(value):
+    if value is None:
+        return 'none'
+    return str(value)
+
+def get_song_album_field(song, get_field):
+    if song.album is None:
+        return 'none'
+    return to_field(get_field(song.album))
+
+def get_first_audio_url(songs):
+    if not songs:
+        return 'none'
+    return songs[0].audio_url
+
+def get_artist_first_audio_url(artist):
+    for album in artist.albums:
+        if album.songs:
+            return album.songs[0].audio_url
+    return get_first_audio_url(artist.singles)
+
+def get_first_artist_name(music_object):
+    if not music_object.artists:
+        return 'none'
+    return music_object.artists[0].name
+
+TOTALS_FIELDS = {
+    'time_listened': lambda music_object: to_field(
+        music_object.total_time_listened),
+    'play_count': lambda music_object: to_field(music_object.play_count),
+    'last_played': lambda music_object: to_field(music_object.last_played),
+}
+
+FIELDS = {
+    Song: {
+        'id': lambda song: to_field(song.id),
+        'name': lambda song: song.name,
+        'url': lambda song: song.audio_url,
+        'artist_name': get_first_artist_name,
+        'album_id': lambda song: get_song_album_field(
+            song, lambda album: album.id),
+        'album_name': lambda song: get_song_album_field(
+            song, lambda album: album.name),
+        'year': lambda song: get_song_album_field(
+            song, lambda album: album.year),
+        'duration': lambda song: to_field(song.duration),
+        'idx_in_album': lambda song: to_field(song.index_in_album),
+        'time_liked': lambda song: to_field(song.time_liked),
+        **TOTALS_FIELDS,
+    },
+    Album: {
+        'id': lambda album: to_field(album.id),
+        'name': lambda album: album.name,
+        'artist_name': get_first_artist_name,
+        'year': lambda album: to_field(album.year),
+        'first_audio_url': lambda album: get_first_audio_url(album.songs),
+        'duration': lambda album: to_field(
+            sum(song.duration or 0 for song in album.songs)),
+        **TOTALS_FIELDS,
+    },
+    Artist: {
+        'id': lambda artist: to_field(artist.id),
+        'name': lambda artist: artist.name,
+        'first_audio_url': get_artist_first_audio_url,
+        **TOTALS_FIELDS,
+    },
+}
+
+def get_field_names():
+    names = set()
+    for fields in FIELDS.values():
+        names.update(fields)
+    return names
+
+# splits fmt into literal text and names of fields, a field is any of
+# field_names wherever it occurs in fmt and the longest one wins where more
+# than one start at the same place, which is what multiple_replace() does
+def parse_format(fmt, field_names):
+    if not field_names:
+        return [(False, fmt)]
+    pattern = re.compile('|'.join(re.escape(name) for name in
+                                  sorted(field_names, key=len, reverse=True)),
+                         flags=re.DOTALL)
+    parts = []
+    position = 0
+    for match in pattern.finditer(fmt):
+        if match.start() > position:
+            parts.append((False, fmt[position:match.start()]))
+        parts.append((True, match.group(0)))
+        position = match.end()
+    if position < len(fmt):
+        parts.append((False, fmt[position:]))
+    return parts
+
+# what the parts of a compiled format are
+LITERAL = 0 # text that is copied as it is
+FIELD = 1 # a field of the music object, the part has the function to get it
+EXTRA_FIELD = 2 # a field given to format(), the part has its name
+
+# an info format parsed once (for every type of music object it is used on)
+# instead of once per object, only the fields it has are looked up. fields
+# given as extra_fields to format() are filled in from there instead, they
+# have to be the same ones for every object
+class InfoFormatter:
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.json = is_json_format(fmt)
+        self.compiled = {} # (type, extra field names) -> parts
+
+    def compile(self, music_type, extra_field_names):
+        fields = FIELDS[music_type]
+        parts = []
+        for is_field, text in parse_format(
+                self.fmt, set(fields) | set(extra_field_names)):
+            if not is_field:
+                parts.append((LITERAL, text))
+            elif text in extra_field_names:
+                parts.append((EXTRA_FIELD, text))
+            else:
+                parts.append((FIELD, fields[text]))
+        return parts
+
+    def format(self, music_object, extra_fields=None):
+        if self.json:
+            return encode_json(music_object, extra_fields)
+        music_type = type(music_object)
+        if not music_type in FIELDS:
+            return None
+        extra_field_names = tuple(extra_fields) if extra_fields else ()
+        key = (music_type, extra_field_names)
+        parts = self.compiled.get(key)
+        if parts is None:
+            parts = self.compile(music_type, extra_field_names)
+            self.compiled[key] = parts
+        strings = []
+        for kind, value in parts:
+            if kind == LITERAL:
+                strings.append(value)
+            elif kind == FIELD:
+                strings.append(value(music_object))
+            else:
+                strings.append(to_field(extra_fields[value]))
+        return ''.join(strings)
+
+@lru_cache(maxsize=64)
+def get_info_formatter(fmt):
+    return InfoFormatter(fmt)
@@ -0,0 +1,165 @@
+from pmus.utils import current_time, file_exists
+
+# names are compared after collapsing whitespace and case so that
+# 'Some Artist' and 'some  artist ' end up as the same artist
+def normalize_name(name):
+    return ' '.join(name.split()).casefold()
+
+def split_names(tag):
+    names = {}
+    for name in tag.split(','):
+        name = ' '.join(name.split())
+        if name:
+            names.setdefault(normalize_name(name), name)
+    return list(names.values())
+
+def parse_index_in_album(track_tag):
+    idx_in_album = track_tag.split('/')[0].strip()
+    try:
+        return int(idx_in_album)
+    except ValueError:
+        return idx_in_album
+
+# collects the songs, albums and artists found while scanning in memory and
+# writes them to the database in one transaction when flush() is called,
+# instead of running a handful of queries per audio file
+class LibraryIngest:
+    def __init__(self, db_provider):
+        self.db_provider = db_provider
+        self.artist_ids = {}      # normalized name -> id
+        self.artist_names = {}    # id -> name
+        self.album_ids = {}       # (normalized name, artist id) -> id
+        self.album_song_ids = {}  # (album id, index in album) -> song id
+        self.song_ids = {}        # audio url -> id
+        self.song_urls = {}       # id -> audio url
+        self.new_artists = []
+        self.new_albums = []
+        self.new_album_artists = []
+        self.new_songs = []
+        self.new_song_artists = []
+        self.new_album_songs = []
+        self.song_updates = []
+        self.load()
+        self.next_artist_id = self.db_provider.get_next_id('artists')
+        self.next_album_id = self.db_provider.get_next_id('albums')
+        self.next_song_id = self.db_provider.get_next_id('songs')
+
+    def load(self):
+        for db_artist in self.db_provider.get_artists():
+            # keep the oldest row if the database already has duplicates
+            self.artist_ids.setdefault(normalize_name(db_artist['name']),
+                                       db_artist['id'])
+            self.artist_names[db_artist['id']] = db_artist['name']
+        album_names = {}
+        for db_album in self.db_provider.get_albums():
+            album_names[db_album['id']] = normalize_name(db_album['name'])
+        for db_album_artist in self.db_provider.get_album_artists():
+            album_id = db_album_artist['album_id']
+            if album_id in album_names:
+                self.album_ids.setdefault((album_names[album_id],
+                                           db_album_artist['artist_id']),
+                                          album_id)
+        for db_song in self.db_provider.get_songs():
+            self.song_ids[db_song['audio_url']] = db_song['id']
+            self.song_urls[db_song['id']] = db_song['audio_url']
+        for db_album_song in self.db_provider.get_album_songs():
+            self.album_song_ids[(db_album_song['album_id'],
+                                 db_album_song['index_in_album'])] =\
+                    db_album_song['song_id']
+
+    def get_or_add_artist(self, name):
+        key = normalize_name(name)
+        if key in self.artist_ids:
+            return self.artist_ids[key]
+        artist_id = self.next_artist_id
+        self.next_artist_id += 1
+        self.artist_ids[key] = artist_id
+        self.artist_names[artist_id] = name
+        self.new_artists.append((artist_id, name, current_time()))
+        return artist_id
+
+    # returns the id of the song that was added, None if nothing was added
+    def add(self, filepath, audio_format):
+        if not 'tags' in audio_format:
+            return None
+        tags = audio_format['tags']
+        if not 'artist' in tags or not 'title' in tags:
+            return None
+        song_name = tags['title']
+        duration = audio_format.get('duration')
+
+        # the file changed since the last scan, refresh what we know about it
+        if filepath in self.song_ids:
+            self.song_updates.append((song_name, duration,
+                                      self.song_ids[filepath]))
+            return None
+
+        if not 'album' in tags or not 'track' in tags:
+            return None # singles arent supported yet
+        artist_names = split_names(tags['artist'])
+        album_artist_names = artist_names
+        if 'album_artist' in tags:
+            album_artist_names = split_names(tags['album_artist'])
+        if not artist_names or not album_artist_names:
+            return None
+        idx_in_album = parse_index_in_album(tags['track'])
+        album_name = tags['album']
+        album_year = tags.get('date')
+
+        album_artist_ids = [self.get_or_add_artist(name)
+                            for name in album_artist_names]
+        album_key = (normalize_name(album_name), album_artist_ids[0])
+        album_id = self.album_ids.get(album_key)
+        if album_id is None:
+            album_id = self.next_album_id
+            self.next_album_id += 1
+            self.album_ids[album_key] = album_id
+            self.new_albums.append((album_id, album_name, album_year,
+                                    current_time()))
+            for album_artist_id in album_artist_ids:
+                self.album_ids.setdefault((album_key[0], album_artist_id),
+                                          album_id)
+                self.new_album_artists.append((album_artist_id, album_id))
+            print('added album {} - {}'.format(
+                album_name, self.artist_names[album_artist_ids[0]]))
+        else:
+            old_song_id = self.album_song_ids.get((album_id, idx_in_album))
+            if old_song_id is not None and\
+                    file_exists(self.song_urls[old_song_id]):
+                return None
+
+        song_id = self.next_song_id
+        self.next_song_id += 1
+        self.song_ids[filepath] = song_id
+        self.song_urls[song_id] = filepath
+        self.album_song_ids[(album_id, idx_in_album)] = song_id
+        self.new_songs.append((song_id, song_name, filepath, duration,
+                               current_time()))
+        for artist_name in artist_names:
+            self.new_song_artists.append((self.get_or_add_artist(artist_name),
+                                          song_id))
+        self.new_album_songs.append((song_id, album_id, idx_in_album))
+        return song_id
+
+    # writes everything collected so far, together with any other pending
+    # changes on the connection, in a single transaction, returns the ids of
+    # the songs that were added and of the ones that were updated
+    def flush(self):
+        with self.db_provider.writing():
+            self.db_provider.add_artists(self.new_artists)
+            self.db_provider.add_albums(self.new_albums)
+            self.db_provider.add_album_artists(self.new_album_artists)
+            self.db_provider.add_songs(self.new_songs)
+            self.db_provider.add_song_artists(self.new_song_artists)
+            self.db_provider.add_album_songs(self.new_album_songs)
+            self.db_provider.update_songs(self.song_updates)
+        new_song_ids = [new_song[0] for new_song in self.new_songs]
+        updated_song_ids = [song_update[2] for song_update in self.song_updates]
+        self.new_artists = []
+        self.new_albums = []
+        self.new_album_artists = []
+        self.new_songs = []
+        self.new_song_artists = []
+        self.new_album_songs = []
+        self.song_updates = []
+        return new_song_ids, updated_song_ids
@@ -0,0 +1,130 @@
+import time
+import threading
+import traceback
+
+# long operations (like find_music) run as jobs in their own thread, the
+# command that starts one answers with the job's id right away and the job
+# command reports how far along it is or cancels it
+
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+# how many finished jobs are kept around for job status
+FINISHED_JOBS_KEPT = 16
+
+class Job:
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = JOB_RUNNING
+        self.phase = None
+        self.error = None
+        self.time_started = time.time()
+        self.time_ended = None
+        # counter name -> [value, time it was first added to, time it was
+        # last added to]
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+        self.cancel_event = threading.Event()
+
+    def is_running(self):
+        return self.state == JOB_RUNNING
+
+    # the job stops at the next point where it checks cancelled()
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def add(self, counter, amount=1):
+        with self.counters_lock:
+            now = time.time()
+            if counter in self.counters:
+                self.counters[counter][0] += amount
+                self.counters[counter][2] = now
+            else:
+                self.counters[counter] = [amount, now, now]
+
+    def finish(self, state, error=None):
+        self.time_ended = time.time()
+        self.error = error
+        self.state = state
+
+    # the status as 'key value' lines, counters that went up more than once
+    # come with how many they went up by per second while they did
+    def get_status(self):
+        time_ended = self.time_ended or time.time()
+        lines = ['id {}'.format(self.id),
+                 'name {}'.format(self.name),
+                 'state {}'.format(self.state),
+                 'phase {}'.format(self.phase or 'none'),
+                 'elapsed {:.1f}'.format(time_ended - self.time_started)]
+        with self.counters_lock:
+            counters = [(counter, list(values))
+                        for counter, values in self.counters.items()]
+        for counter, (value, time_first_added, time_last_added) in counters:
+            seconds = time_last_added - time_first_added
+            if seconds > 0:
+                lines.append('{} {} ({:.1f}/s)'.format(counter, value,
+                                                       value / seconds))
+            else:
+                lines.append('{} {}'.format(counter, value))
+        if self.error is not None:
+            lines.append('error {}'.format(self.error))
+        return '\n'.join(lines) + '\n'
+
+    def get_summary(self):
+        return '{} {} {}\n'.format(self.id, self.name, self.state)
+
+class JobManager:
+    def __init__(self, finished_jobs_kept=FINISHED_JOBS_KEPT):
+        self.jobs = {} # job id -> job, in the order they were started
+        self.next_job_id = 1
+        self.finished_jobs_kept = finished_jobs_kept
+        self.lock = threading.Lock()
+
+    # runs func(*args, job=job) in a thread and returns the job, if exclusive
+    # and a job with the same name is running returns None instead
+    def start(self, name, func, *args, exclusive=False):
+        with self.lock:
+            if exclusive and any(job.name == name and job.is_running()
+                                 for job in self.jobs.values()):
+                return None
+            job = Job(self.next_job_id, name)
+            self.next_job_id += 1
+            self.jobs[job.id] = job
+            self.forget_finished_jobs()
+        threading.Thread(target=self.run, args=(job, func, args),
+                         daemon=True).start()
+        return job
+
+    def run(self, job, func, args):
+        try:
+            func(*args, job=job)
+            job.finish(JOB_CANCELLED if job.cancelled() else JOB_DONE)
+        except Exception as e:
+            traceback.print_tb(e.__traceback__)
+            print(e)
+            job.finish(JOB_FAILED, '{}: {}'.format(type(e).__name__, e))
+        print('job {} ({}) {} after {:.1f}s'.format(
+            job.id, job.name, job.state, job.time_ended - job.time_started))
+
+    def forget_finished_jobs(self):
+        finished_job_ids = [job.id for job in self.jobs.values()
+                            if not job.is_running()]
+        for job_id in finished_job_ids[:-self.finished_jobs_kept or None]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def get_jobs_list(self):
+        with self.lock:
+            return list(self.jobs.values())
@@ -0,0 +1,188 @@
+import copy
+import time
+import queue
+import sqlite3
+import threading
+import traceback
+
+from pmus.rollups import add_playbacks_to_rollups
+from pmus.config import config
+
+JOURNAL_MAX_BATCH = 1000 # most writes committed in one transaction
+JOURNAL_RETRIES = 5 # times a batch is retried while the database is locked
+
+# the writes, each gets a cursor that returns tuples and the id of the
+# playback it is about first (roll_up_playback() gets the playback)
+def insert_playback(c, playback_id, time_started, time_ended, song_id):
+    c.execute('INSERT INTO playbacks\
+               (id, time_started, time_ended, song_id)\
+               VALUES (?, ?, ?, ?)',
+              (playback_id, time_started, time_ended, song_id))
+
+# for when the id the journal handed out was taken, returns the one sqlite
+# gave it instead
+def insert_playback_with_new_id(c, time_started, time_ended, song_id):
+    c.execute('INSERT INTO playbacks (time_started, time_ended, song_id)\
+               VALUES (?, ?, ?)', (time_started, time_ended, song_id))
+    return c.lastrowid
+
+def insert_pause(c, playback_id, time):
+    c.execute('INSERT INTO pauses (time, playback_id) VALUES (?, ?)',
+              (time, playback_id))
+
+def insert_resume(c, playback_id, time):
+    c.execute('INSERT INTO resumes (time, playback_id) VALUES (?, ?)',
+              (time, playback_id))
+
+def insert_seek(c, playback_id, time, position):
+    c.execute('INSERT INTO seeks (time, position, playback_id)\
+               VALUES (?, ?, ?)', (time, position, playback_id))
+
+def set_playback_time_ended(c, playback_id, time_ended):
+    c.execute('UPDATE playbacks SET time_ended = ? WHERE id = ?',
+              (time_ended, playback_id))
+
+def roll_up_playback(c, playback):
+    add_playbacks_to_rollups(c, [playback])
+
+# write-behind log of what the player does. MusicMonitor runs on the audio
+# thread (a song ends there and the next one starts), committing there
+# would hold up the next song by an fsync, so the writes are queued and a
+# writer thread commits everything that piled up in one transaction.
+# playback ids are handed out from memory so the player doesnt have to wait
+# for the database. something else (a script) can add playbacks meanwhile,
+# if one of them took the id a playback was handed it is inserted with a new
+# one and the writes about it after that use the new one too
+class PlaybackJournal:
+    def __init__(self, db_provider, commit_delay=None):
+        self.db_provider = db_provider
+        if commit_delay is None:
+            commit_delay = config.journal_commit_delay
+        # how long the writer waits for more writes after the first one
+        self.commit_delay = commit_delay
+        self.next_playback_id = db_provider.get_next_id('playbacks')
+        self.id_lock = threading.Lock()
+        # ids handed out -> ids the playbacks got in the database instead,
+        # only used by the writer thread
+        self.db_playback_ids = {}
+        self.queue = queue.Queue()
+        self.terminated = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, func, *args):
+        if self.terminated:
+            print('journal terminated, dropping {}'.format(func.__name__))
+            return
+        self.queue.put((func, args))
+
+    # returns the id the playback will have
+    def add_playback(self, time_started, time_ended, song_id):
+        with self.id_lock:
+            playback_id = self.next_playback_id
+            self.next_playback_id += 1
+        self.write(insert_playback, playback_id, time_started, time_ended,
+                   song_id)
+        return playback_id
+
+    def add_pause(self, time, playback_id):
+        self.write(insert_pause, playback_id, time)
+
+    def add_resume(self, time, playback_id):
+        self.write(insert_resume, playback_id, time)
+
+    def add_seek(self, time, position, playback_id):
+        self.write(insert_seek, playback_id, time, position)
+
+    def update_playback_time_ended(self, playback_id, time_ended):
+        self.write(set_playback_time_ended, playback_id, time_ended)
+
+    # the playback has to have ended and not change anymore
+    def add_playback_to_rollups(self, playback):
+        self.write(roll_up_playback, playback)
+
+    # waits until everything queued so far is committed
+    def flush(self):
+        self.queue.join()
+
+    # commits what is left and stops the writer
+    def terminate(self):
+        if self.terminated:
+            return
+        self.terminated = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is not None and self.commit_delay:
+                time.sleep(self.commit_delay)
+            while len(batch) < JOURNAL_MAX_BATCH and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [write for write in batch if write is not None]
+            if writes:
+                self.write_batch(writes)
+            for i in range(len(batch)):
+                self.queue.task_done()
+            if batch[-1] is None:
+                return
+
+    # if a write fails with something other than the database being locked
+    # the batch is written again one write at a time, so only that write is
+    # lost
+    def write_batch(self, writes):
+        for attempt in range(JOURNAL_RETRIES):
+            try:
+                with self.db_provider.writing():
+                    c = self.db_provider.tuple_cursor()
+                    for func, args in writes:
+                        self.apply_write(c, func, args)
+                return
+            except sqlite3.OperationalError as e:
+                # another process can still hold the write lock for longer
+                # than the busy timeout
+                print('journal couldnt write, retrying: {}'.format(e))
+                time.sleep(0.1 * (attempt + 1))
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print('journal couldnt write {} writes at once, writing them\
+ one at a time: {}'.format(len(writes), e))
+                self.write_one_at_a_time(writes)
+                return
+        print('journal dropped {} writes'.format(len(writes)))
+
+    def write_one_at_a_time(self, writes):
+        for func, args in writes:
+            try:
+                with self.db_provider.writing():
+                    self.apply_write(self.db_provider.tuple_cursor(), func,
+                                     args)
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print('journal dropped {}{}: {}'.format(func.__name__, args, e))
+
+    # runs the write with the id the playback has in the database
+    def apply_write(self, c, func, args):
+        if func is roll_up_playback:
+            playback = copy.copy(args[0])
+            playback.id = self.db_playback_ids.get(playback.id, playback.id)
+            func(c, playback)
+            return
+        playback_id = self.db_playback_ids.get(args[0], args[0])
+        if func is not insert_playback:
+            func(c, playback_id, *args[1:])
+            return
+        try:
+            func(c, playback_id, *args[1:])
+        except sqlite3.IntegrityError:
+            db_playback_id = insert_playback_with_new_id(c, *args[1:])
+            print('playback id {} was taken, the playback got {}'.format(
+                args[0], db_playback_id))
+            self.db_playback_ids[args[0]] = db_playback_id
+            with self.id_lock:
+                self.next_playback_id = max(self.next_playback_id,
+                                            db_playback_id + 1)
@@ -0,0 +1,205 @@
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from pmus.config import config
+
+# metrics about the daemon kept in memory and served by the metrics command
+# in the prometheus text format. recording them is off unless enable_metrics
+# is set in the config, then every function below returns right away, except
+# for the phase timings of loading and scanning which only happen once in a
+# while. sqlite statements are only timed if metrics were enabled when the
+# connection was opened
+
+enabled = config.enable_metrics
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+lock = threading.Lock()
+
+class Counter:
+    def __init__(self, name, help_text, metric_type='counter'):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.values = {} # label values -> value
+
+    def add(self, labels, amount=1):
+        with lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, labels, value):
+        with lock:
+            self.values[labels] = value
+
+    def render(self, label_names):
+        lines = ['# HELP {} {}'.format(self.name, self.help_text),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for labels, value in sorted(self.values.items()):
+            lines.append('{}{} {}'.format(
+                self.name, format_labels(label_names, labels), value))
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        with lock:
+            values = self.values.get(labels)
+            if values is None:
+                values = [0] * (len(self.buckets) + 2)
+                self.values[labels] = values
+            for idx, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    values[idx] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self, label_names):
+        lines = ['# HELP {} {}'.format(self.name, self.help_text),
+                 '# TYPE {} histogram'.format(self.name)]
+        for labels, values in sorted(self.values.items()):
+            for idx, bucket in enumerate(self.buckets):
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(label_names + ('le',),
+                                             labels + (str(bucket),)),
+                    values[idx]))
+            lines.append('{}_bucket{} {}'.format(
+                self.name, format_labels(label_names + ('le',),
+                                         labels + ('+Inf',)), values[-1]))
+            lines.append('{}_sum{} {}'.format(
+                self.name, format_labels(label_names, labels), values[-2]))
+            lines.append('{}_count{} {}'.format(
+                self.name, format_labels(label_names, labels), values[-1]))
+        return lines
+
+def format_labels(label_names, labels):
+    if not label_names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(label_names, labels)) + '}'
+
+# (metric, names of its labels)
+command_duration = (Histogram('pmus_command_duration_seconds',
+                              'time it took to handle a command'),
+                    ('command',))
+command_bytes_sent = (Counter('pmus_command_bytes_sent_total',
+                              'bytes sent in responses to commands'),
+                      ('command',))
+command_errors = (Counter('pmus_command_errors_total',
+                          'commands that failed with an exception'),
+                  ('command',))
+commands_in_flight = (Counter('pmus_commands_in_flight',
+                              'commands being handled right now', 'gauge'),
+                      ())
+sqlite_statement_duration = (Histogram('pmus_sqlite_statement_duration_seconds',
+                                       'time it took sqlite to execute a\
+ statement (not counting fetching the rows)'),
+                             ('statement',))
+phase_duration = (Counter('pmus_phase_duration_seconds',
+                          'how long a phase of loading or scanning the music\
+ took the last time it ran', 'gauge'),
+                  ('operation', 'phase'))
+
+METRICS = [command_duration, command_bytes_sent, command_errors,
+           commands_in_flight, sqlite_statement_duration, phase_duration]
+
+# commands are whatever clients send, dont let them make up label values
+def get_command_label(cmd):
+    if cmd.isidentifier() and len(cmd) <= 32:
+        return cmd
+    return 'invalid'
+
+# returns what has to be passed to command_finished, None if metrics are off
+def command_started():
+    if not enabled:
+        return None
+    commands_in_flight[0].add((), 1)
+    return time.perf_counter()
+
+def command_finished(cmd, time_started, bytes_sent, failed=False):
+    if time_started is None:
+        return
+    labels = (get_command_label(cmd),)
+    command_duration[0].observe(labels, time.perf_counter() - time_started)
+    command_bytes_sent[0].add(labels, bytes_sent)
+    if failed:
+        command_errors[0].add(labels)
+    commands_in_flight[0].add((), -1)
+
+@contextmanager
+def time_phase(operation, phase):
+    time_started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_duration[0].set((operation, phase),
+                              time.perf_counter() - time_started)
+
+def get_statement_label(sql):
+    words = sql.split(None, 1)
+    if not words:
+        return 'none'
+    return words[0].upper()
+
+def observe_statement(sql, time_started):
+    sqlite_statement_duration[0].observe((get_statement_label(sql),),
+                                         time.perf_counter() - time_started)
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        time_started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_statement(sql, time_started)
+
+    def executemany(self, sql, seq_of_parameters):
+        time_started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_statement(sql, time_started)
+
+    def executescript(self, sql_script):
+        time_started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            observe_statement('SCRIPT', time_started)
+
+# Connection.execute and co. dont go through cursor(), so they are
+# overridden too
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+# the connection class DBProvider should use
+def get_connection_factory():
+    if enabled:
+        return TimedConnection
+    return sqlite3.Connection
+
+def render():
+    lines = []
+    if not enabled:
+        lines.append('# metrics are disabled, set enable_metrics in the config'
+                     ' to record commands and sqlite statements')
+    for metric, label_names in METRICS:
+        lines.extend(metric.render(label_names))
+    return '\n'.join(lines) + '\n'
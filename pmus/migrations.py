@@ -0,0 +1,161 @@
+from pmus.ingest import normalize_name
+from pmus.rollups import fill_rollups
+
+# schema.sql holds the schema of the first release, every change since then
+# is a migration below. PRAGMA user_version stores how many of them a
+# database has had applied, so new and old databases end up the same.
+# migrations only ever get appended to this list, never edited or removed
+
+def add_scan_manifest(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_manifest (
+                      path TEXT PRIMARY KEY,
+                      size INTEGER NOT NULL,
+                      mtime INTEGER NOT NULL,
+                      inode INTEGER NOT NULL,
+                      time_scanned INTEGER NOT NULL,
+                      time_vanished INTEGER
+                    )''')
+
+# keeps the row with the lowest id for every group of rows that have the
+# same values in columns
+def delete_duplicate_rows(conn, table, columns):
+    conn.execute('DELETE FROM {0} WHERE id NOT IN\
+                  (SELECT MIN(id) FROM {0} GROUP BY {1})'.format(
+                      table, ', '.join(columns)))
+
+# artists that were added multiple times (see the old find_music) are merged
+# into the oldest one
+def merge_duplicate_artists(conn):
+    artist_ids = {}
+    duplicates = []
+    for artist_id, name in conn.execute('SELECT id, name FROM artists\
+                                         ORDER BY id').fetchall():
+        key = normalize_name(name)
+        if key in artist_ids:
+            duplicates.append((artist_ids[key], artist_id))
+        else:
+            artist_ids[key] = artist_id
+    for table in ('song_artists', 'album_artists'):
+        conn.executemany('UPDATE {} SET artist_id = ? WHERE artist_id = ?'\
+                         .format(table), duplicates)
+    conn.executemany('DELETE FROM artists WHERE id = ?',
+                     [(duplicate_id,) for artist_id, duplicate_id in duplicates])
+
+def add_indexes(conn):
+    merge_duplicate_artists(conn)
+    delete_duplicate_rows(conn, 'song_artists', ['song_id', 'artist_id'])
+    delete_duplicate_rows(conn, 'album_artists', ['album_id', 'artist_id'])
+    delete_duplicate_rows(conn, 'liked_songs', ['song_id'])
+    for statement in [
+            'CREATE UNIQUE INDEX artists_name ON artists (name)',
+            'CREATE UNIQUE INDEX song_artists_song_artist\
+             ON song_artists (song_id, artist_id)',
+            'CREATE INDEX song_artists_artist ON song_artists (artist_id)',
+            'CREATE UNIQUE INDEX album_artists_album_artist\
+             ON album_artists (album_id, artist_id)',
+            'CREATE INDEX album_artists_artist ON album_artists (artist_id)',
+            'CREATE UNIQUE INDEX liked_songs_song ON liked_songs (song_id)',
+            # a replaced song keeps its old album_songs row, so the same index
+            # can show up more than once in an album
+            'CREATE INDEX album_songs_album_index\
+             ON album_songs (album_id, index_in_album)',
+            'CREATE INDEX album_songs_song ON album_songs (song_id)',
+            'CREATE INDEX songs_audio_url ON songs (audio_url)',
+            'CREATE INDEX albums_name ON albums (name)',
+            'CREATE INDEX playbacks_song ON playbacks (song_id)',
+            'CREATE INDEX pauses_playback ON pauses (playback_id)',
+            'CREATE INDEX resumes_playback ON resumes (playback_id)',
+            'CREATE INDEX seeks_playback ON seeks (playback_id)']:
+        conn.execute(statement)
+
+# tables (and for updates, columns) MusicProvider.load_music reads, any
+# change to them bumps db_state.change_counter which the snapshot of the
+# loaded music is keyed by
+TRACKED_TABLES = {
+    'songs': ['name', 'audio_url', 'duration'],
+    'artists': None,
+    'albums': None,
+    'song_artists': None,
+    'album_artists': None,
+    'album_songs': None,
+    'liked_songs': None,
+    'playbacks': None,
+    'pauses': None,
+    'resumes': None,
+}
+
+def add_change_counter(conn):
+    conn.execute('''CREATE TABLE db_state (
+                      id INTEGER PRIMARY KEY CHECK (id = 1),
+                      change_counter INTEGER NOT NULL
+                    )''')
+    conn.execute('INSERT INTO db_state (id, change_counter) VALUES (1, 0)')
+    for table, columns in TRACKED_TABLES.items():
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            event = operation
+            if operation == 'UPDATE' and columns is not None:
+                event = 'UPDATE OF {}'.format(', '.join(columns))
+            conn.execute('''CREATE TRIGGER {0}_{1}_change AFTER {2} ON {0}
+                            BEGIN
+                              UPDATE db_state
+                              SET change_counter = change_counter + 1;
+                            END'''.format(table, operation.lower(), event))
+
+def add_listening_rollups(conn):
+    conn.execute('''CREATE TABLE hourly_listening (
+                      song_id INTEGER NOT NULL,
+                      hour INTEGER NOT NULL,
+                      ms INTEGER NOT NULL,
+                      PRIMARY KEY (song_id, hour)
+                    )''')
+    conn.execute('''CREATE TABLE daily_listening (
+                      song_id INTEGER NOT NULL,
+                      day INTEGER NOT NULL,
+                      ms INTEGER NOT NULL,
+                      PRIMARY KEY (song_id, day)
+                    )''')
+    conn.execute('CREATE INDEX hourly_listening_hour ON hourly_listening (hour)')
+    conn.execute('CREATE INDEX daily_listening_day ON daily_listening (day)')
+    conn.execute('''CREATE TABLE rolled_up_playbacks (
+                      playback_id INTEGER PRIMARY KEY
+                    )''')
+    conn.execute('''CREATE TABLE rollup_state (
+                      id INTEGER PRIMARY KEY CHECK (id = 1),
+                      max_playback_length INTEGER NOT NULL
+                    )''')
+    conn.execute('INSERT INTO rollup_state (id, max_playback_length)\
+                  VALUES (1, 0)')
+    conn.execute('CREATE INDEX playbacks_time_started\
+                  ON playbacks (time_started)')
+    fill_rollups(conn)
+
+MIGRATIONS = [
+    add_scan_manifest,
+    add_indexes,
+    add_change_counter,
+    add_listening_rollups,
+]
+
+def get_schema_version(conn):
+    c = conn.cursor()
+    c.row_factory = None
+    return c.execute('PRAGMA user_version').fetchone()[0]
+
+# applies the migrations the database at conn doesnt have yet, each one in
+# its own transaction together with the version bump
+def migrate(conn):
+    row_factory = conn.row_factory
+    conn.row_factory = None
+    try:
+        version = get_schema_version(conn)
+        for idx in range(version, len(MIGRATIONS)):
+            conn.execute('BEGIN')
+            try:
+                MIGRATIONS[idx](conn)
+                conn.execute('PRAGMA user_version = {}'.format(idx + 1))
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+    finally:
+        conn.row_factory = row_factory
@@ -1,4 +1,42 @@
+from pmus.timeline import PlaybackTimeline
+
+# songs, albums and artists keep running totals of (time listened, play
+# count, last played) over all their playbacks, so that time_listened() over
+# all time doesnt have to go through every playback. MusicProvider computes
+# them when the music is loaded and adds to them when a playback ends.
+# playbacks that havent ended yet arent counted
+def get_playbacks_totals(playbacks):
+    time_listened = 0
+    play_count = 0
+    last_played = None
+    for playback in playbacks:
+        if playback.time_ended == -1:
+            continue
+        time_listened += playback.time_listened()
+        play_count += 1
+        if last_played is None or playback.time_started > last_played:
+            last_played = playback.time_started
+    return time_listened, play_count, last_played
+
+def sum_totals(totals_list):
+    time_listened = 0
+    play_count = 0
+    last_played = None
+    for totals in totals_list:
+        time_listened += totals[0]
+        play_count += totals[1]
+        if totals[2] is not None and\
+                (last_played is None or totals[2] > last_played):
+            last_played = totals[2]
+    return time_listened, play_count, last_played
+
+def add_totals_to_map(music_object, music_object_map):
+    music_object_map['time_listened'] = music_object.total_time_listened
+    music_object_map['play_count'] = music_object.play_count
+    music_object_map['last_played'] = music_object.last_played
+
 class Playback:
+    # pauses and resumes are lists of the times (ms) they happened at
     def __init__(self, playback_id, song_id, time_started, time_ended,
                  pauses=None, resumes=None):
         self.song_id = song_id
@@ -26,11 +64,7 @@ class Playback:
         if to_time > self.time_ended:
             to_time = self.time_ended
         milliseconds = to_time - from_time
-        for i in range(len(self.resumes)):
-            pause = self.pauses[i]
-            resume = self.resumes[i]
-            time_paused = pause['time']
-            time_resumed = resume['time']
+        for time_paused, time_resumed in zip(self.pauses, self.resumes):
             if time_paused > to_time:
                 continue
             if time_resumed < from_time:
@@ -41,7 +75,7 @@ class Playback:
                 time_resumed = to_time
             milliseconds -= time_resumed - time_paused
         if len(self.pauses) > len(self.resumes):
-            time_paused = self.pauses[-1]['time']
+            time_paused = self.pauses[-1]
             if time_paused < to_time:
                 if time_paused < from_time:
                     time_paused = from_time
@@ -61,16 +95,30 @@ class Song:
         self.duration = duration
         self.time_liked = time_liked
         self.playbacks = playbacks
+        # the playbacks sorted by time, built when a window is first asked for
+        self.timeline = None
+        self.total_time_listened = 0
+        self.play_count = 0
+        self.last_played = None
 
+    # the song as plain values that can be turned into json, its album and
+    # artists are included without their songs
     def to_map(self, include_artists=True):
         self_map = {}
-        self_map['id'] = self.song_id
+        self_map['id'] = self.id
         self_map['name'] = self.name
         if include_artists:
             self_map['artists'] = [artist.to_map() for artist in self.artists]
         self_map['audio_url'] = self.audio_url
+        self_map['duration'] = self.duration
+        self_map['index_in_album'] = self.index_in_album
+        self_map['time_liked'] = self.time_liked
         if self.album is not None:
-            self_map['album'] = self.album.to_map()
+            self_map['album'] = self.album.to_map(include_artists=False)
+        else:
+            self_map['album'] = None
+        add_totals_to_map(self, self_map)
+        return self_map
 
     def has_album(self):
         return self.album is not None
@@ -81,9 +129,35 @@ class Song:
     def is_liked(self):
         return self.time_liked is not None
 
+    def get_totals(self):
+        return self.total_time_listened, self.play_count, self.last_played
+
+    def set_totals(self, totals):
+        self.total_time_listened, self.play_count, self.last_played = totals
+
+    def compute_totals(self):
+        return get_playbacks_totals(self.playbacks)
+
+    def add_playback(self, playback):
+        self.playbacks.append(playback)
+        if self.timeline is not None:
+            self.timeline.add(playback)
+
+    def on_playback_ended(self, playback):
+        if self.timeline is not None:
+            self.timeline.on_playback_ended(playback)
+
+    def get_timeline(self):
+        if self.timeline is None:
+            self.timeline = PlaybackTimeline(self.playbacks)
+        return self.timeline
+
     def time_listened(self, from_time=None, to_time=None):
+        if from_time is None and to_time is None:
+            return self.total_time_listened
         total = 0
-        for playback in self.playbacks:
+        for playback in self.get_timeline().get_playbacks_between(from_time,
+                                                                  to_time):
             total += playback.time_listened(from_time, to_time)
         return total
 
@@ -94,8 +168,34 @@ class Album:
         self.artists = artists
         self.year = year
         self.songs = songs
+        self.total_time_listened = 0
+        self.play_count = 0
+        self.last_played = None
+
+    def to_map(self, include_artists=True):
+        self_map = {}
+        self_map['id'] = self.id
+        self_map['name'] = self.name
+        self_map['year'] = self.year
+        if include_artists:
+            self_map['artists'] = [artist.to_map() for artist in self.artists]
+        self_map['song_ids'] = [song.id for song in self.songs]
+        add_totals_to_map(self, self_map)
+        return self_map
+
+    def get_totals(self):
+        return self.total_time_listened, self.play_count, self.last_played
+
+    def set_totals(self, totals):
+        self.total_time_listened, self.play_count, self.last_played = totals
+
+    # from the totals of its songs, which have to be up to date
+    def compute_totals(self):
+        return sum_totals(song.get_totals() for song in self.songs)
 
     def time_listened(self, from_time=None, to_time=None):
+        if from_time is None and to_time is None:
+            return self.total_time_listened
         total = 0
         for song in self.songs:
             total += song.time_listened(from_time, to_time)
@@ -107,8 +207,38 @@ class Artist:
         self.name = name
         self.albums = albums
         self.singles = singles
+        self.total_time_listened = 0
+        self.play_count = 0
+        self.last_played = None
+
+    def to_map(self):
+        self_map = {}
+        self_map['id'] = self.id
+        self_map['name'] = self.name
+        add_totals_to_map(self, self_map)
+        return self_map
+
+    def get_totals(self):
+        return self.total_time_listened, self.play_count, self.last_played
+
+    def set_totals(self, totals):
+        self.total_time_listened, self.play_count, self.last_played = totals
+
+    # from the totals of its songs, which have to be up to date
+    def compute_totals(self):
+        return sum_totals([song.get_totals() for song in self.get_songs()])
+
+    # the songs counted towards the artist, those of its albums and its singles
+    def get_songs(self):
+        songs = []
+        for album in self.albums:
+            songs.extend(album.songs)
+        songs.extend(self.singles)
+        return songs
 
     def time_listened(self, from_time=None, to_time=None):
+        if from_time is None and to_time is None:
+            return self.total_time_listened
         total = 0
         for album in self.albums:
             total += album.time_listened(from_time, to_time)
@@ -0,0 +1,35 @@
+import json
+
+from pmus.config import config
+
+# given as the format instead of a -F template to get every music object as
+# a line of json (see the to_map() methods in pmus/music.py), so that
+# clients dont have to split the output themselves
+JSON_FORMAT = '@json'
+
+def is_json_format(fmt):
+    return fmt.strip() == JSON_FORMAT
+
+def encode_json(music_object, extra_fields=None):
+    music_object_map = music_object.to_map()
+    if extra_fields:
+        music_object_map.update(extra_fields)
+    return json.dumps(music_object_map) + '\n'
+
+# joins the lines a command yields into chunks of at least flush_size
+# characters (except for the last one), so that the server sends one big
+# write for a lot of small lines instead of a write for every line
+def buffer_output(lines, flush_size=None):
+    if flush_size is None:
+        flush_size = config.output_flush_size
+    buffered = []
+    buffered_size = 0
+    for line in lines:
+        buffered.append(line)
+        buffered_size += len(line)
+        if buffered_size >= flush_size:
+            yield ''.join(buffered)
+            buffered = []
+            buffered_size = 0
+    if buffered:
+        yield ''.join(buffered)
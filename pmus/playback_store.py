@@ -0,0 +1,184 @@
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# holds every playback as intervals of time (ms) in flat columns instead of
+# Playback objects: the interval from the start to the end of the playback
+# counts positively and every pause in it counts negatively, so the time
+# listened in a window is the sum of the signed overlaps of the intervals
+# with it. this lets the time listened per song in many windows be computed
+# in one pass over the intervals, with numpy if it is installed
+class PlaybackStore:
+    def __init__(self, playbacks):
+        song_ids = []
+        starts = []
+        ends = []
+        signs = []
+        for playback in playbacks:
+            # same rules as Playback.time_listened
+            if playback.time_ended == -1:
+                continue
+            if abs(len(playback.pauses) - len(playback.resumes)) > 1:
+                continue
+            song_ids.append(playback.song_id)
+            starts.append(playback.time_started)
+            ends.append(playback.time_ended)
+            signs.append(1)
+            pauses = list(zip(playback.pauses, playback.resumes))
+            if len(playback.pauses) > len(playback.resumes):
+                pauses.append((playback.pauses[-1], playback.time_ended))
+            for time_paused, time_resumed in pauses:
+                time_paused = max(time_paused, playback.time_started)
+                time_resumed = min(time_resumed, playback.time_ended)
+                if time_paused < time_resumed:
+                    song_ids.append(playback.song_id)
+                    starts.append(time_paused)
+                    ends.append(time_resumed)
+                    signs.append(-1)
+        if numpy is not None:
+            self.song_ids = numpy.array(song_ids, dtype=numpy.int64)
+            self.starts = numpy.array(starts, dtype=numpy.float64)
+            self.ends = numpy.array(ends, dtype=numpy.float64)
+            self.signs = numpy.array(signs, dtype=numpy.float64)
+        else:
+            self.song_ids = song_ids
+            self.starts = starts
+            self.ends = ends
+            self.signs = signs
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    # returns {group: [ms listened in [edges[i], edges[i + 1]) for every i]}
+    # where song_groups maps song ids to the groups their playbacks count
+    # towards (e.g. the artists of the song), songs that arent in it are left
+    # out. edges have to be increasing
+    def histogram(self, edges, song_groups):
+        group_keys = []
+        group_indices = {}
+        song_group_indices = {}
+        for song_id, groups in song_groups.items():
+            indices = []
+            for group in groups:
+                if not group in group_indices:
+                    group_indices[group] = len(group_keys)
+                    group_keys.append(group)
+                indices.append(group_indices[group])
+            song_group_indices[song_id] = indices
+        if len(edges) < 2 or not group_keys:
+            return {group: [0] * max(len(edges) - 1, 0)
+                    for group in group_keys}
+        if numpy is not None:
+            rows = self.numpy_histogram(edges, song_group_indices,
+                                        len(group_keys))
+        else:
+            rows = self.python_histogram(edges, song_group_indices,
+                                         len(group_keys))
+        return {group: rows[idx] for idx, group in enumerate(group_keys)}
+
+    # every interval is clipped to the edges and split into the part in the
+    # bin it starts in, the part in the bin it ends in and the bins it covers
+    # entirely in between, the latter are counted with a difference array so
+    # each interval costs the same no matter how many bins it spans
+    def python_histogram(self, edges, song_group_indices, group_count):
+        bin_count = len(edges) - 1
+        first_edge = edges[0]
+        last_edge = edges[-1]
+        partial = [[0] * bin_count for i in range(group_count)]
+        coverage = [[0] * (bin_count + 1) for i in range(group_count)]
+        for song_id, start, end, sign in zip(self.song_ids, self.starts,
+                                             self.ends, self.signs):
+            groups = song_group_indices.get(song_id)
+            if not groups:
+                continue
+            start = max(start, first_edge)
+            end = min(end, last_edge)
+            if start >= end:
+                continue
+            start_bin = bisect_right(edges, start) - 1
+            end_bin = bisect_left(edges, end) - 1
+            for group in groups:
+                if start_bin == end_bin:
+                    partial[group][start_bin] += sign * (end - start)
+                else:
+                    partial[group][start_bin] +=\
+                            sign * (edges[start_bin + 1] - start)
+                    partial[group][end_bin] += sign * (end - edges[end_bin])
+                    coverage[group][start_bin + 1] += sign
+                    coverage[group][end_bin] -= sign
+        rows = []
+        for group in range(group_count):
+            row = []
+            covering = 0
+            for idx in range(bin_count):
+                covering += coverage[group][idx]
+                row.append(partial[group][idx] +
+                           covering * (edges[idx + 1] - edges[idx]))
+            rows.append(row)
+        return rows
+
+    def numpy_histogram(self, edges, song_group_indices, group_count):
+        edges = numpy.asarray(edges, dtype=numpy.float64)
+        bin_count = len(edges) - 1
+
+        # one interval per (interval, group it counts towards)
+        song_ids = list(song_group_indices)
+        group_counts = numpy.array([len(song_group_indices[song_id])
+                                    for song_id in song_ids], dtype=numpy.int64)
+        flat_groups = numpy.array([group for song_id in song_ids
+                                   for group in song_group_indices[song_id]],
+                                  dtype=numpy.int64)
+        group_offsets = numpy.cumsum(group_counts) - group_counts
+        sorted_song_ids = numpy.array(song_ids, dtype=numpy.int64)
+        order = numpy.argsort(sorted_song_ids)
+        sorted_song_ids = sorted_song_ids[order]
+        song_idx = numpy.searchsorted(sorted_song_ids, self.song_ids)
+        song_idx[song_idx == len(sorted_song_ids)] = 0
+        known = sorted_song_ids[song_idx] == self.song_ids
+        song_idx = order[song_idx[known]]
+        counts = group_counts[song_idx]
+        interval_idx = numpy.repeat(numpy.flatnonzero(known), counts)
+        within = numpy.arange(counts.sum()) -\
+                numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        groups = flat_groups[numpy.repeat(group_offsets[song_idx], counts) +
+                             within]
+
+        starts = numpy.maximum(self.starts[interval_idx], edges[0])
+        ends = numpy.minimum(self.ends[interval_idx], edges[-1])
+        signs = self.signs[interval_idx]
+        inside = starts < ends
+        starts = starts[inside]
+        ends = ends[inside]
+        signs = signs[inside]
+        groups = groups[inside]
+
+        start_bins = numpy.searchsorted(edges, starts, side='right') - 1
+        end_bins = numpy.searchsorted(edges, ends, side='left') - 1
+        same_bin = start_bins == end_bins
+        size = group_count * bin_count
+        row_offsets = groups * bin_count
+        result = numpy.bincount(
+            row_offsets + start_bins,
+            signs * numpy.where(same_bin, ends - starts,
+                                edges[start_bins + 1] - starts),
+            minlength=size)
+        spanning = ~same_bin
+        result += numpy.bincount(
+            (row_offsets + end_bins)[spanning],
+            (signs * (ends - edges[end_bins]))[spanning],
+            minlength=size)
+        coverage_offsets = (groups * (bin_count + 1))[spanning]
+        coverage = numpy.bincount(
+            coverage_offsets + start_bins[spanning] + 1, signs[spanning],
+            minlength=group_count * (bin_count + 1))
+        coverage -= numpy.bincount(
+            coverage_offsets + end_bins[spanning], signs[spanning],
+            minlength=group_count * (bin_count + 1))
+        covering = numpy.cumsum(
+            coverage.reshape(group_count, bin_count + 1), axis=1)[:, :bin_count]
+        result = result.reshape(group_count, bin_count) +\
+                covering * numpy.diff(edges)
+        return result.tolist()
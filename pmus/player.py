@@ -4,9 +4,10 @@ import threading
 import os
 from enum import Enum
 
-from pmus.music import Song
+from pmus.music import Song, Playback
 from pmus.utils import current_time, file_exists
 from pmus.db import DBProvider
+from pmus.journal import PlaybackJournal
 from pmus.config import config_on_play
 
 CHUNK = 2048    # number of bytes to read on each iteration
@@ -65,12 +66,19 @@ class AudioTask():
             on_complete()
 
 class MusicPlayer:
-    def __init__(self):
+    # music_provider gets told about playbacks so it can keep its listening
+    # totals up to date, its database connection is written through too
+    def __init__(self, music_provider=None):
         self.song_queue = []
         self.ended_song_queue = []
         self.audio_task = None
         self.audio_task_thread = None
-        self.music_monitor = MusicMonitor(self, DBProvider())
+        if music_provider is not None:
+            db_provider = music_provider.db_provider
+        else:
+            db_provider = DBProvider()
+        self.music_monitor = MusicMonitor(self, PlaybackJournal(db_provider),
+                                          music_provider)
         self.progress = None
         self.playing = False
         self.mode = MusicPlayerMode.LOOP_QUEUE
@@ -224,10 +232,13 @@ class MusicPlayer:
     def current_songs(self):
         return self.song_queue + self.ended_song_queue
 
+# writes go through the journal (see pmus/journal.py) so they dont block
+# the audio thread
 class MusicMonitor:
-    def __init__(self, music_player, db_provider):
+    def __init__(self, music_player, journal, music_provider=None):
         self.music_player = music_player
-        self.db_provider = db_provider
+        self.journal = journal
+        self.music_provider = music_provider
         self.playback = None
 
     def on_play(self):
@@ -236,31 +247,45 @@ class MusicMonitor:
         self.update_current_playback_time_ended(now)
         playback_time_started = now
         playback_time_ended = -1
-        playback_id = self.db_provider.add_playback(playback_time_started,
-                                                    playback_time_ended,
-                                                    song_id)
-        self.playback = {'time_started': playback_time_started,
-                         'time_ended': playback_time_ended,
-                         'id': playback_id}
+        playback_id = self.journal.add_playback(playback_time_started,
+                                                playback_time_ended,
+                                                song_id)
+        if self.music_provider is not None:
+            self.playback = self.music_provider.add_playback(
+                    playback_id, song_id, playback_time_started)
+        else:
+            self.playback = Playback(playback_id, song_id,
+                                     playback_time_started,
+                                     playback_time_ended, [], [])
 
     def update_current_playback_time_ended(self, time_ended):
         if self.playback:
-            self.db_provider.update_playback_time_ended(self.playback['id'],
-                                                        time_ended)
+            self.journal.update_playback_time_ended(self.playback.id,
+                                                    time_ended)
+            if self.music_provider is not None:
+                self.music_provider.end_playback(self.playback, time_ended)
+            else:
+                self.playback.time_ended = time_ended
+            self.journal.add_playback_to_rollups(self.playback)
 
     def terminate(self):
         self.update_current_playback_time_ended(current_time())
+        self.journal.terminate()
 
     def on_skip(self):
         self.on_play()
 
     def on_pause(self):
-        self.db_provider.add_pause(current_time(), self.playback['id'])
+        now = current_time()
+        self.journal.add_pause(now, self.playback.id)
+        self.playback.pauses.append(now)
 
     def on_resume(self):
-        self.db_provider.add_resume(current_time(), self.playback['id'])
+        now = current_time()
+        self.journal.add_resume(now, self.playback.id)
+        self.playback.resumes.append(now)
 
     def on_seek(self):
-        self.db_provider.add_seek(current_time(),
-                                  self.music_player.progress,
-                                  self.playback['id'])
+        self.journal.add_seek(current_time(),
+                              self.music_player.progress,
+                              self.playback.id)
@@ -0,0 +1,50 @@
+import struct
+
+# the framed protocol, clients that dont start with MAGIC are served the old
+# way: one command per connection read with a single recv (so it has to be
+# shorter than MAX_LEGACY_REQUEST_SIZE and arrive in one piece), the response
+# is whatever is sent until the server closes the connection.
+#
+# a framed client starts by sending MAGIC and the version of the protocol it
+# speaks (one byte), the server answers with MAGIC and the same version, or
+# 0 if it doesnt speak it and then closes the connection. after that the
+# client can send any number of requests on the connection without waiting
+# for the responses:
+#   request id (4 bytes), length (4 bytes), the command (utf-8)
+# and the server answers each with any number of frames, frames of different
+# requests can be interleaved:
+#   request id (4 bytes), frame type (1 byte), length (4 bytes), payload
+# where the frame type is one of FRAME_DATA (a piece of the output),
+# FRAME_ERROR (the command failed, the payload is why) and FRAME_END (the
+# last frame of the response, with no payload). all integers are big endian.
+# the server closes connections that stay idle for longer than
+# config.idle_connection_timeout between requests
+
+MAGIC = b'PMUS'
+PROTOCOL_VERSION = 1
+
+REQUEST_HEADER = struct.Struct('>II')
+RESPONSE_HEADER = struct.Struct('>IBI')
+
+FRAME_DATA = 0
+FRAME_ERROR = 1
+FRAME_END = 2
+
+MAX_REQUEST_SIZE = 1 << 20 # longest command the server accepts
+MAX_LEGACY_REQUEST_SIZE = 1 << 16 # longest command an old client can send
+
+class CommandError(Exception):
+    pass
+
+def encode_handshake(version=PROTOCOL_VERSION):
+    return MAGIC + bytes([version])
+
+def encode_request(request_id, cmd):
+    if isinstance(cmd, str):
+        cmd = cmd.encode()
+    return REQUEST_HEADER.pack(request_id, len(cmd)) + cmd
+
+def encode_frame(request_id, frame_type, payload=b''):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return RESPONSE_HEADER.pack(request_id, frame_type, len(payload)) + payload
@@ -0,0 +1,150 @@
+from pmus.music import Playback
+
+HOUR = 3600 * 1000
+DAY = 24 * HOUR
+
+# the time listened to every song is kept per hour in hourly_listening and
+# per (utc) day in daily_listening, keyed by the time the hour/day started
+# at, so that the time listened between two times only has to look at the
+# playbacks themselves for the parts of the range that dont cover a whole
+# hour. rolled_up_playbacks holds the ids of the playbacks that were already
+# added so that none is counted twice. conn can be a connection or a cursor,
+# either way its rows have to be tuples
+
+def floor_time(time, bucket_size):
+    return time // bucket_size * bucket_size
+
+def ceil_time(time, bucket_size):
+    return -(-time // bucket_size) * bucket_size
+
+# returns [(hour started, ms listened in it), ...] for the playback
+def get_hourly_time_listened(playback):
+    hourly_time_listened = []
+    hour = floor_time(playback.time_started, HOUR)
+    while hour < playback.time_ended:
+        time_listened = playback.time_listened(hour, hour + HOUR)
+        if time_listened:
+            hourly_time_listened.append((hour, time_listened))
+        hour += HOUR
+    return hourly_time_listened
+
+# adds the playbacks (which have to have ended) to the rollups, returns how
+# many werent added before
+def add_playbacks_to_rollups(conn, playbacks):
+    hourly_rows = []
+    daily_time_listened = {}
+    added_count = 0
+    max_playback_length = 0
+    for playback in playbacks:
+        if playback.time_ended == -1:
+            continue
+        c = conn.execute('INSERT OR IGNORE INTO rolled_up_playbacks\
+                          (playback_id) VALUES (?)', (playback.id,))
+        if c.rowcount == 0:
+            continue
+        added_count += 1
+        max_playback_length = max(max_playback_length,
+                                  playback.time_ended - playback.time_started)
+        for hour, time_listened in get_hourly_time_listened(playback):
+            hourly_rows.append((playback.song_id, hour, time_listened))
+            day_key = (playback.song_id, floor_time(hour, DAY))
+            daily_time_listened[day_key] =\
+                    daily_time_listened.get(day_key, 0) + time_listened
+    conn.executemany('INSERT INTO hourly_listening (song_id, hour, ms)\
+                      VALUES (?, ?, ?) ON CONFLICT (song_id, hour)\
+                      DO UPDATE SET ms = ms + excluded.ms', hourly_rows)
+    conn.executemany('INSERT INTO daily_listening (song_id, day, ms)\
+                      VALUES (?, ?, ?) ON CONFLICT (song_id, day)\
+                      DO UPDATE SET ms = ms + excluded.ms',
+                     [(song_id, day, time_listened) for (song_id, day),
+                      time_listened in daily_time_listened.items()])
+    conn.execute('UPDATE rollup_state SET max_playback_length =\
+                  MAX(max_playback_length, ?)', (max_playback_length,))
+    return added_count
+
+# fills in the pauses and resumes of the playbacks in {playback id: playback}
+def add_pauses_and_resumes(conn, playbacks):
+    playback_ids = list(playbacks)
+    for table in ('pauses', 'resumes'):
+        for idx in range(0, len(playback_ids), 500):
+            chunk = playback_ids[idx:idx + 500]
+            for playback_id, time in conn.execute(
+                    'SELECT playback_id, time FROM {} WHERE playback_id IN ({})'
+                    .format(table, ','.join('?' * len(chunk))), chunk):
+                getattr(playbacks[playback_id], table).append(time)
+
+# returns the ended playbacks that were (partly) between from_time and
+# to_time with their pauses and resumes
+def get_playbacks_between(conn, from_time, to_time):
+    max_playback_length = conn.execute('SELECT max_playback_length\
+                                        FROM rollup_state').fetchone()[0]
+    playbacks = {}
+    for playback_id, song_id, time_started, time_ended in conn.execute(
+            'SELECT id, song_id, time_started, time_ended FROM playbacks\
+             WHERE time_started < ? AND time_started >= ?\
+             AND time_ended > ? AND time_ended != -1',
+            (to_time, from_time - max_playback_length, from_time)):
+        playbacks[playback_id] = Playback(playback_id, song_id, time_started,
+                                          time_ended, [], [])
+    add_pauses_and_resumes(conn, playbacks)
+    return list(playbacks.values())
+
+def add_rows(totals, rows):
+    for song_id, time_listened in rows:
+        totals[song_id] = totals.get(song_id, 0) + time_listened
+
+def add_playbacks_between(conn, totals, from_time, to_time):
+    if from_time >= to_time:
+        return
+    for playback in get_playbacks_between(conn, from_time, to_time):
+        time_listened = playback.time_listened(from_time, to_time)
+        if time_listened:
+            totals[playback.song_id] = totals.get(playback.song_id, 0) +\
+                    time_listened
+
+def add_buckets_between(conn, totals, table, column, from_time, to_time):
+    if from_time >= to_time:
+        return
+    add_rows(totals, conn.execute(
+        'SELECT song_id, SUM(ms) FROM {0} WHERE {1} >= ? AND {1} < ?\
+         GROUP BY song_id'.format(table, column), (from_time, to_time)))
+
+# returns {song id: ms listened between from_time and to_time}, whole days
+# come from daily_listening, whole hours from hourly_listening and only the
+# hours at the edges of the range that are partly in it from the playbacks
+def get_songs_time_listened(conn, from_time, to_time):
+    totals = {}
+    first_hour = ceil_time(from_time, HOUR)
+    last_hour = floor_time(to_time, HOUR)
+    if first_hour >= last_hour:
+        add_playbacks_between(conn, totals, from_time, to_time)
+        return totals
+    first_day = ceil_time(first_hour, DAY)
+    last_day = floor_time(last_hour, DAY)
+    if first_day < last_day:
+        add_buckets_between(conn, totals, 'daily_listening', 'day',
+                            first_day, last_day)
+        add_buckets_between(conn, totals, 'hourly_listening', 'hour',
+                            first_hour, first_day)
+        add_buckets_between(conn, totals, 'hourly_listening', 'hour',
+                            last_day, last_hour)
+    else:
+        add_buckets_between(conn, totals, 'hourly_listening', 'hour',
+                            first_hour, last_hour)
+    add_playbacks_between(conn, totals, from_time, first_hour)
+    add_playbacks_between(conn, totals, last_hour, to_time)
+    return totals
+
+# rolls up every ended playback that isnt yet, returns how many there were
+def fill_rollups(conn):
+    playbacks = {}
+    for playback_id, song_id, time_started, time_ended in conn.execute(
+            'SELECT id, song_id, time_started, time_ended FROM playbacks\
+             WHERE time_ended != -1 AND id NOT IN\
+             (SELECT playback_id FROM rolled_up_playbacks)'):
+        playbacks[playback_id] = Playback(playback_id, song_id, time_started,
+                                          time_ended, [], [])
+    if not playbacks:
+        return 0
+    add_pauses_and_resumes(conn, playbacks)
+    return add_playbacks_to_rollups(conn, playbacks.values())
@@ -0,0 +1,82 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from pmus.tags import get_audio_format
+
+AUDIO_FILE_EXTENSIONS = ['mp3', 'flac', 'opus', 'm4a']
+
+def is_audio_file(filename):
+    for audio_ext in AUDIO_FILE_EXTENSIONS:
+        if filename.endswith('.' + audio_ext):
+            return True
+    return False
+
+# returns the paths of all audio files in music_dir, sorted so that scans
+# always visit (and write to the database) files in the same order
+def list_audio_files(music_dir):
+    filepaths = []
+    for folder, subs, files in os.walk(music_dir):
+        if '/trash' in folder:
+            continue
+        for filename in files:
+            if is_audio_file(filename):
+                filepaths.append(os.path.join(folder, filename))
+    filepaths.sort()
+    return filepaths
+
+# like list_audio_files but returns (filepath, size, mtime, inode) tuples,
+# mtime is in nanoseconds
+def stat_audio_files(music_dir):
+    file_stats = []
+    for filepath in list_audio_files(music_dir):
+        try:
+            stat = os.stat(filepath)
+        except OSError: # deleted while we were walking
+            continue
+        file_stats.append((filepath, stat.st_size, stat.st_mtime_ns,
+                           stat.st_ino))
+    return file_stats
+
+# returns directory and the set of names of the files in it, the set is empty
+# if the directory doesnt exist (anymore)
+def list_dir_files(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return directory, set(entry.name for entry in entries
+                                  if entry.is_file())
+    except OSError:
+        return directory, set()
+
+def is_in_dir(filepath, directory):
+    directory = os.path.join(directory, '')
+    return filepath.startswith(directory)
+
+def probe_file(filepath):
+    # a broken file shouldnt stop the whole scan, so errors are returned
+    # instead of raised, this also keeps process pools happy
+    try:
+        return filepath, get_audio_format(filepath), None
+    except Exception as e:
+        return filepath, None, e
+
+# probes filepaths using a pool of workers and yields (filepath, audio_format,
+# error) tuples in the same order as filepaths, at most workers * 2 files are
+# in flight at any time so memory stays bounded on huge libraries
+def probe_files(filepaths, workers=1, use_processes=False):
+    if workers <= 1:
+        for filepath in filepaths:
+            yield probe_file(filepath)
+        return
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        pending = deque()
+        for filepath in filepaths:
+            pending.append(executor.submit(probe_file, filepath))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def print_probe_error(filepath, error):
+    print('failed to probe {}: {}'.format(filepath, error))
@@ -1,58 +1,263 @@
-import socket
+import asyncio
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from pmus.player import MusicPlayerMode
 from pmus.config import config
-from pmus.music import Song, Artist, Album
-from pmus.utils import multiple_replace, reversed_if
+from pmus import metrics
+from pmus.utils import current_time
+from pmus.sorting import sort, parse_sort_by
+from pmus.export import export_history, EXPORT_FORMATS
+from pmus.output import buffer_output
+from pmus.info_format import get_info_formatter
+from pmus.jobs import JobManager
+from pmus.protocol import (MAGIC, PROTOCOL_VERSION, REQUEST_HEADER,
+                           MAX_REQUEST_SIZE, MAX_LEGACY_REQUEST_SIZE,
+                           FRAME_DATA, FRAME_ERROR, FRAME_END,
+                           encode_handshake, encode_frame)
+
+# commands that need the loaded music, while it is loading they wait for it
+# up to config.catalog_wait_timeout and then answer with how far along it is,
+# the rest (pausing, skipping, progress..) work right away
+CATALOG_COMMANDS = {'play', 'list', 'add', 'like', 'is_liked', 'top', 'stats',
+                    'played_at', 'check_totals', 'find_music', 'info'}
+
+# commands that control the player or report what it (or a job) is doing,
+# they are answered right away even while a heavy command is running
+PLAYER_COMMANDS = {'pause', 'resume', 'play', 'add', 'next', 'prev', 'seek',
+                   'progress', 'current', 'queue', 'mode', 'loop_song',
+                   'loop_queue', 'loaded', 'validated', 'job'}
+
+# chunks of a command's output (see buffer_output()) that can wait to be
+# sent to the client
+OUTPUT_QUEUE_SIZE = 16
+
+# a stream reader with some bytes that were already read in front of it
+class BufferedReader:
+    def __init__(self, reader, data=b''):
+        self.reader = reader
+        self.data = data
+
+    async def read_exactly(self, n):
+        if len(self.data) >= n:
+            data, self.data = self.data[:n], self.data[n:]
+            return data
+        data, self.data = self.data, b''
+        return data + await self.reader.readexactly(n - len(data))
 
 class Server:
     def __init__(self, music_player, music_provider, host=config.host,
                  port=config.port):
         self.music_player = music_player
         self.music_provider = music_provider
-        self.socket = None
+        self.loop = None
+        self.server = None
+        self.executor = ThreadPoolExecutor(max_workers=config.server_workers)
         self.terminated = False
         self.port = port
         self.host = host
-        self.finding_music = False
+        # long commands like find_music run as jobs, see the job command
+        self.jobs = JobManager()
 
     def start(self):
-        self.socket = socket.socket()
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((self.host, self.port))
-        self.socket.listen()
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client,
+                                                 self.host, self.port,
+                                                 reuse_address=True)
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def handle_client(self, reader, writer):
+        try:
+            data = await asyncio.wait_for(self.read_first_data(reader),
+                                          config.client_timeout)
+            if data.startswith(MAGIC):
+                await self.handle_framed_client(
+                        BufferedReader(reader, data[len(MAGIC):]), writer)
+            else:
+                await self.handle_legacy_client(data, writer)
+        except asyncio.TimeoutError:
+            print('closing connection of a client that didnt send anything')
+        except Exception as e:
+            traceback.print_tb(e.__traceback__)
+            print(e)
+        finally:
+            writer.close()
+
+    async def read_first_data(self, reader):
+        data = await reader.read(MAX_LEGACY_REQUEST_SIZE)
+        # the magic could be split between reads
+        while data and len(data) < len(MAGIC) and MAGIC.startswith(data):
+            more = await reader.read(MAX_LEGACY_REQUEST_SIZE)
+            if not more:
+                break
+            data += more
+        return data
+
+    # one command read with a single recv, its output is sent as it is and
+    # the end of it is the connection being closed
+    async def handle_legacy_client(self, data, writer):
+        async def send(line):
+            data = line.encode()
+            writer.write(data)
+            await writer.drain()
+            return len(data)
+        # it was probably cut off, dont run what we got of it
+        if len(data) >= MAX_LEGACY_REQUEST_SIZE:
+            await send('command longer than {} bytes, send it with\
+ pmus.client.Connection instead'.format(MAX_LEGACY_REQUEST_SIZE - 1))
+            return
+        await self.handle_command(data.decode(), send)
+
+    # see pmus/protocol.py
+    async def handle_framed_client(self, reader, writer):
+        version = (await asyncio.wait_for(reader.read_exactly(1),
+                                          config.client_timeout))[0]
+        if version != PROTOCOL_VERSION:
+            writer.write(encode_handshake(0))
+            await writer.drain()
+            return
+        writer.write(encode_handshake())
+        await writer.drain()
+
+        write_lock = asyncio.Lock()
+        async def send_frame(request_id, frame_type, payload=b''):
+            frame = encode_frame(request_id, frame_type, payload)
+            async with write_lock:
+                writer.write(frame)
+                await writer.drain()
+            return len(frame)
+        async def handle_request(request_id, message):
+            async def send(line):
+                return await send_frame(request_id, FRAME_DATA, line)
+            error = await self.handle_command(message, send)
+            try:
+                if error is not None:
+                    await send_frame(request_id, FRAME_ERROR, '{}: {}'.format(
+                        type(error).__name__, error))
+                await send_frame(request_id, FRAME_END)
+            except ConnectionError:
+                pass
+
+        # every request is handled in its own task so a slow one doesnt hold
+        # up the ones sent after it, the tasks start in the order the
+        # requests came in
+        tasks = set()
         while True:
-            if self.terminated:
-                return
             try:
-                client_socket, addr = self.socket.accept()
-                message = client_socket.recv(1024)
-                try:
-                    for line in self.handle_message(message.decode()):
-                        client_socket.sendall(line.encode())
-                except Exception as e:
-                    traceback.print_tb(e.__traceback__)
-                    print(e)
-                    pass
-                client_socket.close()
+                header = await asyncio.wait_for(
+                        reader.read_exactly(REQUEST_HEADER.size),
+                        config.idle_connection_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                break
+            request_id, length = REQUEST_HEADER.unpack(header)
+            if length > MAX_REQUEST_SIZE:
+                await send_frame(request_id, FRAME_ERROR,
+                                 'command longer than {} bytes'.format(
+                                     MAX_REQUEST_SIZE))
+                break
+            try:
+                message = (await asyncio.wait_for(reader.read_exactly(length),
+                                                  config.client_timeout))\
+                        .decode()
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                break
+            task = asyncio.create_task(handle_request(request_id, message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # runs the command in message sending its output with send (which returns
+    # the number of bytes it sent) and records it in the metrics, returns the
+    # exception it failed with if it did
+    async def handle_command(self, message, send):
+        cmd = message.split(' ')[0]
+        time_started = metrics.command_started()
+        bytes_sent = 0
+        async def send_counted(line):
+            nonlocal bytes_sent
+            bytes_sent += await send(line)
+        error = None
+        try:
+            await self.run_command(cmd, message, send_counted)
+        except Exception as e:
+            error = e
+            traceback.print_tb(e.__traceback__)
+            print(e)
+        metrics.command_finished(cmd, time_started, bytes_sent,
+                                 error is not None)
+        return error
+
+    # player commands are quick so they run right in the event loop, anything
+    # that could take a while runs in the executor so they dont have to wait
+    # for it. the output a command yields in the executor is passed to the
+    # event loop through a queue, at most OUTPUT_QUEUE_SIZE chunks at a time
+    async def run_command(self, cmd, message, send):
+        if cmd in PLAYER_COMMANDS and not (cmd in CATALOG_COMMANDS and
+                                           not self.music_provider.loaded):
+            for chunk in buffer_output(self.handle_message(message)):
+                await send(chunk)
+            return
+
+        lines = asyncio.Queue()
+        free_slots = threading.Semaphore(OUTPUT_QUEUE_SIZE)
+        stopped = threading.Event()
+        def put(item):
+            self.loop.call_soon_threadsafe(lines.put_nowait, item)
+        def produce():
+            try:
+                for line in buffer_output(self.handle_message(message)):
+                    # the client is gone if nothing is taken for a while
+                    while not free_slots.acquire(timeout=0.1):
+                        if stopped.is_set():
+                            return
+                    put((line, None))
             except Exception as e:
-                traceback.print_tb(e.__traceback__)
-                print(e)
+                put((None, e))
+            finally:
+                put((None, None))
+
+        self.loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                line, error = await lines.get()
+                if error is not None:
+                    raise error
+                if line is None:
+                    return
+                free_slots.release()
+                await send(line)
+        finally:
+            stopped.set()
 
     def terminate(self):
         print('terminating server')
         self.terminated = True
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
+        if self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
         self.music_player.terminate()
         self.music_provider.db_provider.commit()
+        self.music_provider.update_snapshot()
+        self.executor.shutdown(wait=False)
 
     def handle_message(self, msg):
         split_by_space = msg.split(' ')
         cmd = split_by_space[0]
         args = split_by_space[1:]
 
+        if cmd in CATALOG_COMMANDS and not self.music_provider.wait_loaded(
+                config.catalog_wait_timeout):
+            yield get_loading_status(self.music_provider)
+            return
+
         if cmd == 'pause':
             self.music_player.pause()
         elif cmd == 'resume':
@@ -185,6 +390,91 @@ class Server:
                 return
             song_id = int(args[0])
             yield str(self.music_provider.songs[song_id].is_liked()).lower()
+        elif cmd == 'top': # top <output_music_type> <n> [from] [to] [fmt]
+            # from and to are times in ms, - leaves that end open
+            if len(args) < 2:
+                yield 'usage: top <song|album|artist> <n> [from] [to] [fmt]'
+                return
+            output_music_type = args[0]
+            limit = int(args[1])
+            times = []
+            args = args[2:]
+            while args and len(times) < 2 and\
+                    (args[0] == '-' or args[0].isdigit()):
+                times.append(None if args[0] == '-' else int(args[0]))
+                args = args[1:]
+            times += [None] * (2 - len(times))
+            fmt = 'id name\n'
+            if args:
+                fmt = ' '.join(args)
+            try:
+                top = self.music_provider.get_top(output_music_type, limit,
+                                                  times[0], times[1])
+            except ValueError as e:
+                yield str(e)
+                return
+            formatter = get_info_formatter(fmt)
+            for music_object, time_listened in top:
+                yield formatter.format(music_object,
+                                       {'time_listened': time_listened})
+        elif cmd == 'stats': # stats <from> <to> [song|album|artist]
+            # from and to are times in ms, - leaves that end open
+            if len(args) < 2:
+                yield 'usage: stats <from> <to> [song|album|artist]'
+                return
+            from_time = 0 if args[0] == '-' else int(args[0])
+            to_time = current_time() if args[1] == '-' else int(args[1])
+            group_by = args[2] if len(args) > 2 else None
+            try:
+                stats = self.music_provider.get_listening_stats(
+                        from_time, to_time, group_by)
+            except ValueError as e:
+                yield str(e)
+                return
+            if group_by is None:
+                yield str(stats[None])
+                return
+            for music_object_id, time_listened in sorted(
+                    stats.items(), key=lambda item: item[1], reverse=True):
+                yield '{} {}\n'.format(music_object_id, time_listened)
+        elif cmd == 'played_at': # played_at <time in ms> [fmt]
+            if not args:
+                yield 'please provide a time'
+                return
+            fmt = 'id name\n'
+            if len(args) > 1:
+                fmt = ' '.join(args[1:])
+            formatter = get_info_formatter(fmt)
+            for song in self.music_provider.get_songs_played_at(int(args[0])):
+                yield formatter.format(song)
+        elif cmd == 'export': # export <jsonl|csv> [since time in ms]
+            if not args:
+                yield 'usage: export <{}> [since]'.format('|'.join(EXPORT_FORMATS))
+                return
+            since_time = int(args[1]) if len(args) > 1 else None
+            try:
+                for chunk in export_history(self.music_provider.db_provider,
+                                            args[0], since_time):
+                    yield chunk
+            except ValueError as e:
+                yield str(e)
+        elif cmd == 'metrics':
+            yield metrics.render()
+        elif cmd == 'check_totals':
+            mismatches = self.music_provider.check_listening_totals()
+            for music_object, totals, expected_totals in mismatches:
+                yield '{} {} has {} instead of {}\n'.format(
+                    type(music_object).__name__.lower(), music_object.id,
+                    totals, expected_totals)
+            if not mismatches:
+                yield 'ok'
+        elif cmd == 'loaded':
+            if self.music_provider.loaded:
+                yield 'true'
+            else:
+                yield get_loading_status(self.music_provider)
+        elif cmd == 'validated':
+            yield str(self.music_provider.validated).lower()
         elif cmd == 'loop_song':
             self.music_player.mode = MusicPlayerMode.LOOP_SONG
         elif cmd == 'loop_queue':
@@ -202,111 +492,99 @@ class Server:
             else:
                 yield lyrics
             return
-        elif cmd == 'find_music':
-            if self.finding_music:
+        elif cmd == 'find_music': # answers with the id of the job
+            music_dir = ' '.join(args) if args else config.music_dir
+            job = self.jobs.start('find_music', self.music_provider.find_music,
+                                  music_dir, exclusive=True)
+            if job is None:
                 yield 'already looking for music, chill'
                 return
-            self.finding_music = True
-            if args:
-                self.music_provider.find_music(' '.join(args))
+            yield 'job {}'.format(job.id)
+        elif cmd == 'job': # job status|cancel <id>, job list
+            if len(args) == 0:
+                yield 'usage: job status <id>, job cancel <id>, job list'
+                return
+            if args[0] == 'list':
+                for job in self.jobs.get_jobs_list():
+                    yield job.get_summary()
+                return
+            if len(args) < 2 or not args[0] in ('status', 'cancel'):
+                yield 'usage: job status <id>, job cancel <id>, job list'
+                return
+            job = self.jobs.get(int(args[1]))
+            if job is None:
+                yield 'no job with id {}'.format(args[1])
+                return
+            if args[0] == 'cancel':
+                if not job.is_running():
+                    yield 'job {} already {}'.format(job.id, job.state)
+                    return
+                job.cancel()
+                yield 'cancelling job {}'.format(job.id)
             else:
-                self.music_provider.find_music()
-            self.music_provider.unload_music()
-            self.music_provider.load_music()
-            self.finding_music = False
-            yield 'done'
+                yield job.get_status()
         elif cmd == 'info': # info <output_music_type> <specifier> <sort_by> <limit> <fmt>
             output_music_type = args[0]
             specifier = args[1]
-            sort_by = args[2]
-            reverse = False
-            if sort_by.startswith('rev_'):
-                reverse = True
-                sort_by = sort_by.split('rev_')[1] # get rid of rev_
+            sort_by = args[2] # comma separated keys, each can have rev_
+            try:
+                parse_sort_by(sort_by)
+            except ValueError as e:
+                yield str(e)
+                return
             limit = int(args[3])
             fmt = 'id name\n'
             if len(args) > 4:
                 fmt = ' '.join(args[4:])
             for info in get_info(self, output_music_type, specifier, sort_by,
-                                 limit, fmt, reverse):
+                                 limit, fmt):
                 yield info
         else:
             yield 'unknown command'
         return
 
 def get_artists_of_songs(songs):
-    artists = []
+    artists = {}
     for song in songs:
         for artist in song.artists:
-            if not artist in artists:
-                artists.append(artist)
-    return artists
+            artists.setdefault(artist.id, artist)
+    return list(artists.values())
 
 def get_albums_of_songs(songs):
-    albums = []
+    albums = {}
     for song in songs:
-        if not song.album in albums:
-            albums.append(song.album)
-    return albums
-
-def sort(music_objects, sort_by):
-    if sort_by == 'id':
-        return music_objects
-    def is_bigger(music_object1, music_object2):
-        if sort_by == 'name':
-            return music_object1.name < music_object2.name
-        if sort_by == 'time_liked':
-            return music_object1.time_liked > music_object2.time_liked
-        if sort_by == 'idx_in_album':
-            return music_object1.index_in_album < music_object2.index_in_album
-    for idx1 in range(len(music_objects)):
-        for idx2 in range(len(music_objects)):
-            if is_bigger(music_objects[idx1], music_objects[idx2]):
-                music_objects[idx1], music_objects[idx2] =\
-                        music_objects[idx2], music_objects[idx1]
-    """
-    we are sorting in-place so returning the list wouldnt make sense
-    but it makes for loops easier to type by just doing 'for in sort(list)'
-    """
-    return music_objects
+        if song.album is not None:
+            albums.setdefault(song.album.id, song.album)
+    return list(albums.values())
 
-def get_info(server, output_music_type, specifier, sort_by, limit, fmt,
-             reverse=False):
+def get_info(server, output_music_type, specifier, sort_by, limit, fmt):
     music_objects_map = server.music_provider.songs
     if output_music_type == 'artist':
         music_objects_map = server.music_provider.artists
     elif output_music_type == 'album':
         music_objects_map = server.music_provider.albums
     if limit <= 0:
-        limit = None # [:None] results in all elements be selected in list
+        limit = None
 
     if specifier == 'current' or specifier == 'liked':
         if specifier == 'current':
             desired_songs = server.music_player.current_songs()
         else:
             desired_songs = []
-            for song in server.music_provider.songs.values():
+            for song in server.music_provider.get_songs_list():
                 if song.is_liked():
                     desired_songs.append(song)
         if output_music_type == 'artist':
-            for artist in reversed_if(sort(get_artists_of_songs(desired_songs),
-                                           sort_by), reverse)[:limit]:
-                yield format_info(artist, fmt)
+            desired_music_objects = get_artists_of_songs(desired_songs)
         elif output_music_type == 'album':
-            for album in reversed_if(sort(get_albums_of_songs(desired_songs),
-                                          sort_by), reverse)[:limit]:
-                yield format_info(album, fmt)
+            desired_music_objects = get_albums_of_songs(desired_songs)
         else:
-            for song in reversed_if(sort(desired_songs, sort_by),
-                                    reverse)[:limit]:
-                yield format_info(song, fmt)
+            desired_music_objects = desired_songs
     elif specifier == 'all':
-        for music_object in reversed_if(sort(list(music_objects_map.values()),
-                                             sort_by), reverse)[:limit]:
-            yield format_info(music_object, fmt)
+        desired_music_objects = list(music_objects_map.values())
     else:
         desired_music_objects = []
-        for music_object_specifier in reversed_if(specifier.split(','), reverse):
+        for music_object_specifier in specifier.split(','):
             if '=' in music_object_specifier:
                 input_object_type = music_object_specifier.split('=')[0]
                 input_object_id = int(music_object_specifier.split('=')[1])
@@ -343,35 +621,15 @@ def get_info(server, output_music_type, specifier, sort_by, limit, fmt,
                         desired_music_objects.append(artist)
                 else:
                     desired_music_objects.append(song)
-        objects_yielded = 0
-        for music_obj in reversed_if(sort(desired_music_objects, sort_by),
-                                     reverse)[:limit]:
-            if limit and objects_yielded == limit:
-                break
-            yield format_info(music_obj, fmt)
-            objects_yielded += 1
+    formatter = get_info_formatter(fmt)
+    for music_object in sort(desired_music_objects, sort_by, limit):
+        yield formatter.format(music_object)
 
-def format_info(music_object, fmt):
-    if isinstance(music_object, Song):
-        return multiple_replace(fmt, # music object is song
-                {'artist_name' : music_object.artists[0].name,
-                 'album_id' : str(music_object.album.id),
-                 'album_name': music_object.album.name,
-                 'name': music_object.name,
-                 'id': str(music_object.id),
-                 'url': music_object.audio_url})
-    if isinstance(music_object, Album): # music object is album
-        return multiple_replace(fmt,
-                {'id': str(music_object.id),
-                 'artist_name': music_object.artists[0].name,
-                 'name': music_object.name,
-                 'first_audio_url': music_object.songs[0].audio_url})
-    if isinstance(music_object, Artist): # music object is artist
-        try:
-            first_audio_url = music_object.albums[0].songs[0].audio_url
-        except:
-            first_audio_url = 'none'
-        return multiple_replace(fmt,
-                {'id': str(music_object.id),
-                 'name': music_object.name,
-                 'first_audio_url': first_audio_url})
+def get_loading_status(music_provider):
+    return 'loading {}%'.format(int(music_provider.load_progress * 100))
+
+# extra_fields are replaced in fmt on top of the fields of the music object,
+# fmt can also be JSON_FORMAT (see pmus/output.py). formatting a lot of
+# objects is faster with the formatter from get_info_formatter() directly
+def format_info(music_object, fmt, extra_fields=None):
+    return get_info_formatter(fmt).format(music_object, extra_fields)
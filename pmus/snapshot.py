@@ -0,0 +1,40 @@
+import os
+import pickle
+
+# the rows MusicProvider.load_music builds the loaded music from, pickled
+# next to the database so a restart doesnt have to query every table again.
+# a snapshot is only used if it was taken at the same change counter (see
+# the db_state table) and schema version as the database has now, so any
+# write to the database since then makes us fall back to sqlite
+
+SNAPSHOT_VERSION = 1
+
+def get_snapshot_path(db_path):
+    return db_path + '.snapshot'
+
+def load_snapshot(path, change_counter, schema_version):
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print('couldnt read snapshot {}: {}'.format(path, e))
+        return None
+    if not isinstance(snapshot, dict) or\
+            snapshot.get('version') != SNAPSHOT_VERSION or\
+            snapshot.get('schema_version') != schema_version or\
+            snapshot.get('change_counter') != change_counter:
+        return None
+    return snapshot['rows']
+
+def save_snapshot(path, change_counter, schema_version, rows):
+    snapshot = {'version': SNAPSHOT_VERSION,
+                'schema_version': schema_version,
+                'change_counter': change_counter,
+                'rows': rows}
+    # write to a temporary file first so a crash never leaves half a snapshot
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as snapshot_file:
+        pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
@@ -0,0 +1,138 @@
+import heapq
+
+from pmus.music import Song, Album, Artist
+
+# wraps a value so that it sorts in descending order inside a key tuple
+class Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+# index_in_album is an int unless the track tag wasnt a number, in which case
+# it is kept as a string, numbers go first
+def index_in_album_key(song):
+    index_in_album = song.index_in_album
+    if index_in_album is None:
+        return (2, 0)
+    if isinstance(index_in_album, str):
+        return (1, index_in_album)
+    return (0, index_in_album)
+
+# songs without a track tag end up last whichever way they are sorted
+def get_index_in_album(song):
+    if song.index_in_album is None:
+        return None
+    return index_in_album_key(song)
+
+def get_first_artist_name(music_object):
+    if music_object.artists:
+        return music_object.artists[0].name
+    return None
+
+def get_album_name(song):
+    if song.album is not None:
+        return song.album.name
+    return None
+
+def get_album_year(song):
+    if song.album is not None:
+        return song.album.year
+    return None
+
+# sort key -> (function that returns the value to sort by, whether the values
+# are sorted in descending order without rev_), per music object type. a value
+# of None means the object doesnt have one (e.g. time_liked of a song that
+# isnt liked), those always end up last
+SORT_KEYS = {
+    Song: {
+        'name': (lambda song: song.name, False),
+        'time_liked': (lambda song: song.time_liked, True),
+        'idx_in_album': (get_index_in_album, False),
+        'duration': (lambda song: song.duration, False),
+        'time_listened': (lambda song: song.time_listened(), True),
+        'artist_name': (get_first_artist_name, False),
+        'album_name': (get_album_name, False),
+        'year': (get_album_year, False),
+    },
+    Album: {
+        'name': (lambda album: album.name, False),
+        'year': (lambda album: album.year, False),
+        'time_listened': (lambda album: album.time_listened(), True),
+        'artist_name': (get_first_artist_name, False),
+    },
+    Artist: {
+        'name': (lambda artist: artist.name, False),
+        'time_listened': (lambda artist: artist.time_listened(), True),
+    },
+}
+
+# 'id' keeps the order the objects were given in
+INPUT_ORDER_KEY = 'id'
+
+def get_sort_key_names():
+    sort_key_names = set([INPUT_ORDER_KEY])
+    for sort_keys in SORT_KEYS.values():
+        sort_key_names.update(sort_keys)
+    return sort_key_names
+
+# parses 'name' or 'rev_time_liked,name' into [(key name, reverse), ...]
+def parse_sort_by(sort_by):
+    sort_keys = []
+    for key_name in sort_by.split(','):
+        reverse = False
+        if key_name.startswith('rev_'):
+            reverse = True
+            key_name = key_name[len('rev_'):]
+        if not key_name in get_sort_key_names():
+            raise ValueError('unknown sort key {}'.format(key_name))
+        sort_keys.append((key_name, reverse))
+    return sort_keys
+
+# returns the objects sorted by the comma separated keys in sort_by, each of
+# which can be prefixed by rev_, objects that are equal in every key keep
+# their order. keys are computed once per object, and if a limit is given
+# only the first limit objects are picked out with a heap instead of sorting
+# all of them. keys that dont apply to an object's type count as None
+def sort(music_objects, sort_by, limit=None):
+    if not limit:
+        limit = None
+    sort_keys = parse_sort_by(sort_by)
+    if sort_keys == [(INPUT_ORDER_KEY, False)]:
+        return list(music_objects[:limit])
+
+    def get_key(item):
+        position, music_object = item
+        key = []
+        for key_name, reverse in sort_keys:
+            if key_name == INPUT_ORDER_KEY:
+                value = position
+                descending = False
+            else:
+                type_sort_keys = SORT_KEYS.get(type(music_object), {})
+                if key_name in type_sort_keys:
+                    get_value, descending = type_sort_keys[key_name]
+                    value = get_value(music_object)
+                else:
+                    value = None
+            if value is None:
+                key.append((1,))
+            elif descending != reverse:
+                key.append((0, Descending(value)))
+            else:
+                key.append((0, value))
+        key.append(position)
+        return key
+
+    items = enumerate(music_objects)
+    if limit is not None:
+        items = heapq.nsmallest(limit, items, key=get_key)
+    else:
+        items = sorted(items, key=get_key)
+    return [music_object for position, music_object in items]
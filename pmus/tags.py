@@ -0,0 +1,506 @@
+import os
+import struct
+
+from pmus import ffmpeg
+from pmus.config import config
+
+# a small reader for the tags and duration of the audio formats we support,
+# it returns the same {'duration': .., 'tags': {..}} map get_audio_format()
+# in pmus.ffmpeg returns (with the same tag names ffprobe uses) so that we
+# dont have to spawn an ffprobe process for every file we scan
+
+class TagReadError(Exception):
+    pass
+
+ID3V24_FRAMES = {
+    'TIT2': 'title',
+    'TPE1': 'artist',
+    'TPE2': 'album_artist',
+    'TALB': 'album',
+    'TRCK': 'track',
+    'TPOS': 'disc',
+    'TCON': 'genre',
+    'TDRC': 'date',
+    'TDRL': 'date',
+    'TYER': 'date',
+}
+
+ID3V22_FRAMES = {
+    'TT2': 'title',
+    'TP1': 'artist',
+    'TP2': 'album_artist',
+    'TAL': 'album',
+    'TRK': 'track',
+    'TPA': 'disc',
+    'TCO': 'genre',
+    'TYE': 'date',
+}
+
+VORBIS_COMMENT_KEYS = {
+    'albumartist': 'album_artist',
+    'tracknumber': 'track',
+    'discnumber': 'disc',
+    'description': 'comment',
+}
+
+MP4_ATOMS = {
+    b'\xa9nam': 'title',
+    b'\xa9ART': 'artist',
+    b'aART': 'album_artist',
+    b'\xa9alb': 'album',
+    b'\xa9day': 'date',
+    b'\xa9gen': 'genre',
+    b'trkn': 'track',
+    b'disk': 'disc',
+}
+
+# containers we have to look into to find the ilst atom and mvhd
+MP4_CONTAINER_ATOMS = [b'moov', b'udta', b'meta', b'ilst']
+
+# bitrates in kbps, indexed by [mpeg version 1 or not][layer][bitrate index]
+MPEG_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+MPEG_SAMPLE_RATES = {
+    3: [44100, 48000, 32000], # mpeg 1
+    2: [22050, 24000, 16000], # mpeg 2
+    0: [11025, 12000, 8000],  # mpeg 2.5
+}
+
+# how far past the id3 tag we look for the first mpeg frame
+MPEG_SYNC_SEARCH_SIZE = 64 * 1024
+# how much of the end of an ogg file we read to find the last page
+OGG_TAIL_SIZE = 64 * 1024
+
+def syncsafe_int(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise TagReadError('unexpected end of file')
+    return data
+
+def add_tag(tags, key, value):
+    value = value.strip('\x00').strip()
+    if not value:
+        return
+    # ffmpeg joins repeated tags with ';'
+    if key in tags:
+        tags[key] = tags[key] + ';' + value
+    else:
+        tags[key] = value
+
+def decode_id3_text(data):
+    if not data:
+        return ''
+    encoding = data[0]
+    data = data[1:]
+    if encoding in (1, 2) and len(data) % 2:
+        data = data[:-1] # stray terminating null
+    if encoding == 0:
+        text = data.decode('latin-1')
+    elif encoding == 1:
+        text = data.decode('utf-16')
+    elif encoding == 2:
+        text = data.decode('utf-16-be')
+    elif encoding == 3:
+        text = data.decode('utf-8')
+    else:
+        raise TagReadError('unknown id3 text encoding {}'.format(encoding))
+    # id3v2.4 can hold multiple values separated by nulls, like ffmpeg we
+    # only keep the first one
+    return text.split('\x00')[0]
+
+def remove_unsynchronisation(data):
+    return data.replace(b'\xff\x00', b'\xff')
+
+# returns the size of the id3v2 tag at the start of the file (0 if there is
+# none) and fills tags with the text frames we know about
+def read_id3v2(f, tags):
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    major_version = header[3]
+    flags = header[5]
+    tag_size = syncsafe_int(header[6:10]) + 10
+    if flags & 0x10: # footer present
+        tag_size += 10
+    if major_version not in (2, 3, 4):
+        return tag_size
+    data = read_exactly(f, syncsafe_int(header[6:10]))
+    if flags & 0x80 and major_version < 4:
+        data = remove_unsynchronisation(data)
+    pos = 0
+    if flags & 0x40 and major_version == 3:
+        pos = struct.unpack('>I', data[:4])[0] + 4
+    elif flags & 0x40 and major_version == 4:
+        pos = syncsafe_int(data[:4])
+
+    if major_version == 2:
+        frame_names = ID3V22_FRAMES
+        frame_header_size = 6
+    else:
+        frame_names = ID3V24_FRAMES
+        frame_header_size = 10
+    while pos + frame_header_size <= len(data):
+        frame_header = data[pos:pos + frame_header_size]
+        if frame_header[0] == 0: # padding
+            break
+        if major_version == 2:
+            frame_id = frame_header[:3].decode('latin-1')
+            frame_size = int.from_bytes(frame_header[3:6], 'big')
+            frame_flags = 0
+        else:
+            frame_id = frame_header[:4].decode('latin-1')
+            if major_version == 4:
+                frame_size = syncsafe_int(frame_header[4:8])
+            else:
+                frame_size = struct.unpack('>I', frame_header[4:8])[0]
+            frame_flags = struct.unpack('>H', frame_header[8:10])[0]
+        pos += frame_header_size
+        frame_data = data[pos:pos + frame_size]
+        pos += frame_size
+        if frame_id not in frame_names:
+            continue
+        if major_version == 4:
+            if frame_flags & 0x000c: # compressed or encrypted
+                continue
+            if frame_flags & 0x0002:
+                frame_data = remove_unsynchronisation(frame_data)
+            if frame_flags & 0x0001: # data length indicator
+                frame_data = frame_data[4:]
+        elif major_version == 3 and frame_flags & 0x00c0:
+            continue
+        key = frame_names[frame_id]
+        if key in tags: # TDRC and TYER can both be there
+            continue
+        value = decode_id3_text(frame_data).strip()
+        if value:
+            tags[key] = value
+    return tag_size
+
+def read_id3v1(f, tags):
+    f.seek(0, os.SEEK_END)
+    if f.tell() < 128:
+        return 0
+    f.seek(-128, os.SEEK_END)
+    data = f.read(128)
+    if data[:3] != b'TAG':
+        return 0
+    def field(start, end):
+        return data[start:end].split(b'\x00')[0].decode('latin-1').strip()
+    for key, start, end in [('title', 3, 33), ('artist', 33, 63),
+                            ('album', 63, 93), ('date', 93, 97)]:
+        value = field(start, end)
+        if value and key not in tags:
+            tags[key] = value
+    if data[125] == 0 and data[126] != 0 and 'track' not in tags:
+        tags['track'] = str(data[126])
+    return 128
+
+def parse_mpeg_header(header):
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or\
+            sample_rate_index == 3:
+        return None
+    layer = 4 - layer_bits
+    is_mpeg1 = version == 3
+    bitrate = MPEG_BITRATES[is_mpeg1][layer][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x1
+    is_mono = (header[3] >> 6) == 3
+    if layer == 1:
+        samples_per_frame = 384
+        frame_size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        if layer == 3 and not is_mpeg1:
+            samples_per_frame = 576
+        else:
+            samples_per_frame = 1152
+        frame_size = samples_per_frame // 8 * bitrate // sample_rate + padding
+    if is_mpeg1:
+        side_info_size = 17 if is_mono else 32
+    else:
+        side_info_size = 9 if is_mono else 17
+    return {'bitrate': bitrate, 'sample_rate': sample_rate,
+            'samples_per_frame': samples_per_frame, 'frame_size': frame_size,
+            'side_info_size': side_info_size, 'layer': layer}
+
+def read_mpeg_duration(f, audio_start, audio_end):
+    f.seek(audio_start)
+    data = f.read(MPEG_SYNC_SEARCH_SIZE)
+    pos = data.find(b'\xff')
+    frame = None
+    while pos != -1 and pos + 4 <= len(data):
+        frame = parse_mpeg_header(data[pos:pos + 4])
+        # make sure this wasnt a random 0xff by checking the next frame too
+        if frame is not None:
+            next_pos = pos + frame['frame_size']
+            if next_pos + 4 > len(data) or\
+                    parse_mpeg_header(data[next_pos:next_pos + 4]) is not None:
+                break
+        frame = None
+        pos = data.find(b'\xff', pos + 1)
+    if frame is None:
+        raise TagReadError('no mpeg frame found')
+
+    # a xing/info or vbri header in the first frame tells us the frame count
+    frame_data = data[pos:pos + frame['frame_size']]
+    xing_pos = 4 + frame['side_info_size']
+    frame_count = None
+    if frame_data[xing_pos:xing_pos + 4] in (b'Xing', b'Info'):
+        xing_flags = struct.unpack('>I', frame_data[xing_pos + 4:xing_pos + 8])[0]
+        if xing_flags & 0x1:
+            frame_count = struct.unpack(
+                    '>I', frame_data[xing_pos + 8:xing_pos + 12])[0]
+    elif frame_data[36:40] == b'VBRI':
+        frame_count = struct.unpack('>I', frame_data[50:54])[0]
+    if frame_count is not None:
+        return frame_count * frame['samples_per_frame'] / frame['sample_rate']
+    # no header, assume constant bitrate
+    audio_size = audio_end - (audio_start + pos)
+    return audio_size * 8 / frame['bitrate']
+
+def read_mp3(f):
+    tags = {}
+    audio_start = read_id3v2(f, tags)
+    f.seek(0, os.SEEK_END)
+    audio_end = f.tell() - read_id3v1(f, tags)
+    duration = read_mpeg_duration(f, audio_start, audio_end)
+    return duration, tags
+
+def read_vorbis_comment(data, tags):
+    pos = 0
+    vendor_length = struct.unpack('<I', data[pos:pos + 4])[0]
+    pos += 4 + vendor_length
+    comment_count = struct.unpack('<I', data[pos:pos + 4])[0]
+    pos += 4
+    for i in range(comment_count):
+        comment_length = struct.unpack('<I', data[pos:pos + 4])[0]
+        pos += 4
+        comment = data[pos:pos + comment_length].decode('utf-8', 'replace')
+        pos += comment_length
+        if not '=' in comment:
+            continue
+        key, value = comment.split('=', 1)
+        key = key.lower()
+        if key == 'metadata_block_picture':
+            continue
+        add_tag(tags, VORBIS_COMMENT_KEYS.get(key, key), value)
+
+def read_flac(f):
+    tags = {}
+    f.seek(read_id3v2(f, {}))
+    if f.read(4) != b'fLaC':
+        raise TagReadError('not a flac file')
+    duration = None
+    is_last = False
+    while not is_last:
+        block_header = read_exactly(f, 4)
+        is_last = block_header[0] & 0x80
+        block_type = block_header[0] & 0x7f
+        block_size = int.from_bytes(block_header[1:4], 'big')
+        if block_type == 0: # STREAMINFO
+            streaminfo = read_exactly(f, block_size)
+            sample_rate = int.from_bytes(streaminfo[10:13], 'big') >> 4
+            total_samples = int.from_bytes(streaminfo[13:18], 'big') & 0xfffffffff
+            if sample_rate and total_samples:
+                duration = total_samples / sample_rate
+        elif block_type == 4: # VORBIS_COMMENT
+            read_vorbis_comment(read_exactly(f, block_size), tags)
+        else: # skip pictures, seek tables, padding etc
+            f.seek(block_size, os.SEEK_CUR)
+    return duration, tags
+
+def parse_ogg_page_header(data):
+    if len(data) < 27 or data[:4] != b'OggS':
+        raise TagReadError('bad ogg page')
+    granule_position, serial = struct.unpack('<qI', data[6:18])
+    segment_count = data[26]
+    return granule_position, serial, segment_count
+
+# yields the packets of the first logical stream in the file, stopping as
+# soon as the caller stops asking for more
+def read_ogg_packets(f):
+    packet = b''
+    while True:
+        header = f.read(27)
+        if not header:
+            return
+        granule_position, serial, segment_count =\
+                parse_ogg_page_header(header)
+        segment_table = read_exactly(f, segment_count)
+        page_data = read_exactly(f, sum(segment_table))
+        pos = 0
+        for segment_size in segment_table:
+            packet += page_data[pos:pos + segment_size]
+            pos += segment_size
+            if segment_size < 255:
+                yield serial, packet
+                packet = b''
+
+def read_last_ogg_granule(f, serial):
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    tail_size = OGG_TAIL_SIZE
+    while True:
+        start = max(0, file_size - tail_size)
+        f.seek(start)
+        data = f.read(file_size - start)
+        pos = data.rfind(b'OggS')
+        while pos != -1:
+            try:
+                granule_position, page_serial, segment_count =\
+                        parse_ogg_page_header(data[pos:pos + 27])
+                if page_serial == serial and granule_position >= 0:
+                    return granule_position
+            except TagReadError:
+                pass
+            pos = data.rfind(b'OggS', 0, pos)
+        if start == 0:
+            raise TagReadError('no ogg page with a granule position found')
+        tail_size *= 4
+
+def read_opus(f):
+    tags = {}
+    packets = read_ogg_packets(f)
+    serial, opus_head = next(packets)
+    if opus_head[:8] != b'OpusHead':
+        raise TagReadError('not an opus file')
+    pre_skip = struct.unpack('<H', opus_head[10:12])[0]
+    tags_serial, opus_tags = next(packets)
+    if opus_tags[:8] != b'OpusTags' or tags_serial != serial:
+        raise TagReadError('opus tags missing')
+    read_vorbis_comment(opus_tags[8:], tags)
+    # opus granule positions always count 48khz samples
+    duration = (read_last_ogg_granule(f, serial) - pre_skip) / 48000
+    return max(duration, 0), tags
+
+# yields (atom type, data offset, data size) for the atoms in [start, end)
+def iter_mp4_atoms(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        atom_size, atom_type = struct.unpack('>I4s', read_exactly(f, 8))
+        header_size = 8
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', read_exactly(f, 8))[0]
+            header_size = 16
+        elif atom_size == 0:
+            atom_size = end - pos
+        if atom_size < header_size:
+            raise TagReadError('bad mp4 atom size')
+        yield atom_type, pos + header_size, atom_size - header_size
+        pos += atom_size
+
+def read_mp4_item(f, atom_type, offset, size, tags):
+    for data_type, data_offset, data_size in iter_mp4_atoms(f, offset,
+                                                           offset + size):
+        if data_type != b'data' or data_size < 8:
+            continue
+        f.seek(data_offset)
+        data = read_exactly(f, data_size)
+        value_type = int.from_bytes(data[1:4], 'big')
+        value = data[8:]
+        key = MP4_ATOMS[atom_type]
+        if atom_type in (b'trkn', b'disk'):
+            if len(value) < 6:
+                continue
+            number, total = struct.unpack('>HH', value[2:6])
+            if total:
+                tags[key] = '{}/{}'.format(number, total)
+            elif number:
+                tags[key] = str(number)
+        elif value_type == 1: # utf-8
+            add_tag(tags, key, value.decode('utf-8', 'replace'))
+        return
+
+def read_mp4_atoms(f, start, end, tags, state):
+    for atom_type, offset, size in iter_mp4_atoms(f, start, end):
+        if atom_type == b'mvhd':
+            f.seek(offset)
+            mvhd = read_exactly(f, min(size, 32))
+            if mvhd[0] == 1:
+                timescale, duration = struct.unpack('>IQ', mvhd[20:32])
+            else:
+                timescale, duration = struct.unpack('>II', mvhd[12:20])
+            if timescale:
+                state['duration'] = duration / timescale
+        elif atom_type == b'meta':
+            # meta is a full atom with 4 bytes of version and flags, except
+            # in quicktime files where it is a plain container
+            f.seek(offset + 4)
+            if f.read(4) == b'hdlr':
+                read_mp4_atoms(f, offset, offset + size, tags, state)
+            else:
+                read_mp4_atoms(f, offset + 4, offset + size, tags, state)
+        elif atom_type in MP4_CONTAINER_ATOMS:
+            read_mp4_atoms(f, offset, offset + size, tags, state)
+        elif atom_type in MP4_ATOMS:
+            read_mp4_item(f, atom_type, offset, size, tags)
+
+def read_m4a(f):
+    tags = {}
+    state = {'duration': None}
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(4)
+    if f.read(4) != b'ftyp':
+        raise TagReadError('not an mp4 file')
+    # only moov is looked into, mdat (the audio) is skipped over
+    for atom_type, offset, size in iter_mp4_atoms(f, 0, file_size):
+        if atom_type == b'moov':
+            read_mp4_atoms(f, offset, offset + size, tags, state)
+            break
+    return state['duration'], tags
+
+TAG_READERS = {
+    'mp3': read_mp3,
+    'flac': read_flac,
+    'opus': read_opus,
+    'm4a': read_m4a,
+}
+
+# returns the format map for filepath or None if it cant be read without
+# ffprobe, errors in the file are raised as TagReadError
+def read_audio_format(filepath):
+    extension = filepath.rsplit('.', 1)[-1].lower()
+    if extension not in TAG_READERS:
+        return None
+    with open(filepath, 'rb') as f:
+        try:
+            duration, tags = TAG_READERS[extension](f)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise TagReadError(str(e))
+    if duration is None:
+        return None
+    format_map = {'duration': duration}
+    if tags:
+        format_map['tags'] = tags
+    return format_map
+
+def get_audio_format(filepath):
+    if config.use_builtin_tag_reader:
+        try:
+            format_map = read_audio_format(filepath)
+            if format_map is not None:
+                return format_map
+        except (TagReadError, OSError):
+            pass
+    return ffmpeg.get_audio_format(filepath)
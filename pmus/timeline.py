@@ -0,0 +1,175 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+from pmus.utils import current_time
+
+# playbacks that went on for longer than this (ms) arent indexed, one of them
+# would keep the running maximum end (see PlaybackTimeline) up for every
+# playback that started after it, they are all looked at on every lookup
+# instead, there are few of them (songs left paused for hours)
+LONG_PLAYBACK = 60 * 60 * 1000
+
+# playback end used for indexing, playbacks that havent ended (or never will,
+# if the daemon died while they were going) count as if they ended right
+# when they started
+def get_indexed_end(playback):
+    if playback.time_ended == -1:
+        return playback.time_started
+    return playback.time_ended
+
+def is_long_playback(playback):
+    return get_indexed_end(playback) - playback.time_started > LONG_PLAYBACK
+
+# the playback that is playing, only one song plays at a time so its the
+# unended one that started last, the unended ones before it were left by a
+# daemon that died
+def get_open_playback(open_playback, playback):
+    if playback.time_ended != -1:
+        return open_playback
+    if open_playback is not None and\
+            open_playback.time_started > playback.time_started:
+        return open_playback
+    return playback
+
+# returns the starts and running maximum ends of playbacks, the ones before
+# idx are taken from starts and max_ends, which arent changed
+def get_max_ends(playbacks, starts, max_ends, idx):
+    starts = starts[:idx]
+    max_ends = max_ends[:idx]
+    max_end = max_ends[-1] if max_ends else None
+    for playback in playbacks[idx:]:
+        end = get_indexed_end(playback)
+        if max_end is None or end > max_end:
+            max_end = end
+        starts.append(playback.time_started)
+        max_ends.append(max_end)
+    return starts, max_ends
+
+# playbacks sorted by the time they started at together with the running
+# maximum of the times they ended at, the playbacks that were going on
+# between two times are found by bisecting both: everything after the last
+# playback that started before the window ends is out, and so is everything
+# before the first one whose running maximum end reaches into the window.
+# long playbacks (see LONG_PLAYBACK) are kept apart, so a lookup is
+# O(log n + k + l) where k is the number of playbacks that started between
+# LONG_PLAYBACK before the window and its end and l the number of long ones.
+# lookups from other threads only look at the first count entries of the
+# lists in the index they got, so a playback that starts after all the others
+# (the usual one) is appended and published with the new count, and when it
+# ends its own entry in max_ends is raised in place. anything else builds new
+# lists and swaps them all in at once, so lookups always see lists that fit
+# together
+class PlaybackTimeline:
+    def __init__(self, playbacks=()):
+        playbacks = sorted(playbacks,
+                           key=lambda playback: playback.time_started)
+        long_playbacks = [playback for playback in playbacks
+                          if is_long_playback(playback)]
+        playbacks = [playback for playback in playbacks
+                     if not is_long_playback(playback)]
+        open_playback = None
+        for playback in playbacks:
+            open_playback = get_open_playback(open_playback, playback)
+        starts, max_ends = get_max_ends(playbacks, [], [], 0)
+        # (playbacks, starts, max_ends, count, long playbacks, open playback)
+        self.index = (playbacks, starts, max_ends, len(playbacks),
+                      long_playbacks, open_playback)
+        # taken by the ones changing the timeline, lookups dont need it
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        (playbacks, starts, max_ends, count, long_playbacks,
+         open_playback) = self.index
+        return count + len(long_playbacks)
+
+    def add(self, playback):
+        with self.lock:
+            (playbacks, starts, max_ends, count, long_playbacks,
+             open_playback) = self.index
+            open_playback = get_open_playback(open_playback, playback)
+            if is_long_playback(playback):
+                self.index = (playbacks, starts, max_ends, count,
+                              long_playbacks + [playback], open_playback)
+                return
+            if count == 0 or playback.time_started >= starts[-1]:
+                max_end = get_indexed_end(playback)
+                if count > 0 and max_ends[-1] > max_end:
+                    max_end = max_ends[-1]
+                playbacks.append(playback)
+                starts.append(playback.time_started)
+                max_ends.append(max_end)
+                self.index = (playbacks, starts, max_ends, count + 1,
+                              long_playbacks, open_playback)
+                return
+            idx = bisect_right(starts, playback.time_started)
+            playbacks = playbacks[:idx] + [playback] + playbacks[idx:]
+            starts, max_ends = get_max_ends(playbacks, starts, max_ends, idx)
+            self.index = (playbacks, starts, max_ends, count + 1,
+                          long_playbacks, open_playback)
+
+    # has to be called when a playback in the timeline ends
+    def on_playback_ended(self, playback):
+        with self.lock:
+            (playbacks, starts, max_ends, count, long_playbacks,
+             open_playback) = self.index
+            if playback is open_playback:
+                open_playback = None
+            idx = bisect_left(starts, playback.time_started)
+            while idx < count and playbacks[idx] is not playback:
+                idx += 1
+            if idx == count:
+                self.index = (playbacks, starts, max_ends, count,
+                              long_playbacks, open_playback)
+                return
+            if is_long_playback(playback):
+                playbacks = playbacks[:idx] + playbacks[idx + 1:]
+                long_playbacks = long_playbacks + [playback]
+                count -= 1
+            elif get_indexed_end(playback) <= max_ends[idx] or\
+                    idx == count - 1:
+                # raising the last entry keeps max_ends sorted for lookups
+                # that are bisecting it right now
+                if get_indexed_end(playback) > max_ends[idx]:
+                    max_ends[idx] = get_indexed_end(playback)
+                self.index = (playbacks, starts, max_ends, count,
+                              long_playbacks, open_playback)
+                return
+            starts, max_ends = get_max_ends(playbacks, starts, max_ends, idx)
+            self.index = (playbacks, starts, max_ends, count, long_playbacks,
+                          open_playback)
+
+    # yields the playbacks that were going on at some point between
+    # from_time and to_time, None leaves that end open. the one that is
+    # playing counts as going on until now
+    def get_playbacks_between(self, from_time=None, to_time=None):
+        (playbacks, starts, max_ends, count, long_playbacks,
+         open_playback) = self.index
+        last_idx = count
+        if to_time is not None:
+            last_idx = bisect_right(starts, to_time, 0, count)
+        first_idx = 0
+        if from_time is not None:
+            first_idx = bisect_left(max_ends, from_time, 0, last_idx)
+        for playback in playbacks[first_idx:last_idx]:
+            if playback is open_playback or playback.time_ended == -1:
+                continue
+            if from_time is not None and playback.time_ended < from_time:
+                continue
+            yield playback
+        for playback in long_playbacks:
+            if from_time is not None and playback.time_ended < from_time:
+                continue
+            if to_time is not None and playback.time_started > to_time:
+                continue
+            yield playback
+        if open_playback is not None:
+            # it may have ended since the index was taken
+            time_ended = open_playback.time_ended
+            if time_ended == -1:
+                time_ended = current_time()
+            if (from_time is None or time_ended >= from_time) and\
+                    (to_time is None or open_playback.time_started <= to_time):
+                yield open_playback
+
+    def get_playbacks_at(self, time):
+        return self.get_playbacks_between(time, time)
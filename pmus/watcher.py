@@ -0,0 +1,205 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import traceback
+
+from pmus.config import config
+from pmus.scan import stat_audio_files
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# we dont care about IN_MODIFY, a file is only probed once it was closed
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |\
+             IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    def __init__(self):
+        libc_path = ctypes.util.find_library('c')
+        if libc_path is None:
+            raise OSError('libc not found')
+        self.libc = ctypes.CDLL(libc_path, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify isnt supported on this system')
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watch_paths = {} # watch descriptor -> directory
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # the directory is already gone or isnt a directory, ignore it
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, 'inotify_add_watch failed for {}'.format(path))
+        self.watch_paths[wd] = path
+
+    def add_watch_recursive(self, path):
+        for folder, subs, files in os.walk(path):
+            if not '/trash' in folder:
+                self.add_watch(folder)
+
+    # yields (mask, path) for the events that are ready
+    def read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, name_length =\
+                    INOTIFY_EVENT_HEADER.unpack_from(data, pos)
+            pos += INOTIFY_EVENT_HEADER.size
+            name = data[pos:pos + name_length].rstrip(b'\0')
+            pos += name_length
+            if mask & IN_IGNORED:
+                self.watch_paths.pop(wd, None)
+                continue
+            directory = self.watch_paths.get(wd)
+            if directory is None:
+                yield mask, None
+                continue
+            if name:
+                yield mask, os.path.join(directory, os.fsdecode(name))
+            else:
+                yield mask, directory
+
+    def close(self):
+        os.close(self.fd)
+
+# watches the music directory and tells the music provider to rescan the
+# files that changed, events are debounced so that copying an album in
+# results in one update instead of one per file, inotify is used if it is
+# available, otherwise the directory is polled
+class LibraryWatcher:
+    def __init__(self, music_provider, music_dir=config.music_dir,
+                 debounce=None, poll_interval=None):
+        self.music_provider = music_provider
+        self.music_dir = music_dir
+        self.debounce = config.watch_debounce if debounce is None else debounce
+        self.poll_interval = config.watch_poll_interval\
+                if poll_interval is None else poll_interval
+        self.terminated = False
+        self.thread = None
+        self.pending_paths = set()
+        self.needs_rescan = False
+        self.first_event_time = None
+        self.last_event_time = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def terminate(self):
+        self.terminated = True
+
+    def run(self):
+        try:
+            inotify = Inotify()
+        except OSError as e:
+            print('inotify unavailable ({}), polling {} every {}s'.format(
+                e, self.music_dir, self.poll_interval))
+            self.run_polling()
+            return
+        try:
+            self.run_inotify(inotify)
+        finally:
+            inotify.close()
+
+    def on_path_changed(self, path):
+        now = time.monotonic()
+        if not self.pending_paths:
+            self.first_event_time = now
+        self.last_event_time = now
+        self.pending_paths.add(path)
+
+    # the pending paths are handled once nothing happened for self.debounce
+    # seconds, or at the latest after 10 times that if changes keep coming
+    def get_debounce_timeout(self):
+        if not self.pending_paths:
+            return None
+        now = time.monotonic()
+        return max(0, min(self.last_event_time + self.debounce,
+                          self.first_event_time + self.debounce * 10) - now)
+
+    def flush_pending_paths(self):
+        paths = self.pending_paths
+        self.pending_paths = set()
+        try:
+            time_started = time.monotonic()
+            if self.needs_rescan:
+                self.needs_rescan = False
+                self.music_provider.find_music(self.music_dir)
+            else:
+                self.music_provider.update_music(paths)
+            print('updated {} changed paths in {:.3f}s'.format(
+                len(paths), time.monotonic() - time_started))
+        except Exception as e:
+            traceback.print_tb(e.__traceback__)
+            print(e)
+
+    def run_inotify(self, inotify):
+        inotify.add_watch_recursive(self.music_dir)
+        while not self.terminated:
+            timeout = self.get_debounce_timeout()
+            # wake up every second anyway to notice terminate()
+            if timeout is None or timeout > 1:
+                timeout = 1
+            readable, _, _ = select.select([inotify.fd], [], [], timeout)
+            if readable:
+                for mask, path in inotify.read_events():
+                    if mask & IN_Q_OVERFLOW or path is None:
+                        # we lost events, rescan everything (the manifest
+                        # keeps that cheap)
+                        self.needs_rescan = True
+                        self.on_path_changed(self.music_dir)
+                        continue
+                    if '/trash' in path:
+                        continue
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        inotify.add_watch_recursive(path)
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        continue # the parent directory reports these too
+                    self.on_path_changed(path)
+            if self.pending_paths and self.get_debounce_timeout() == 0:
+                self.flush_pending_paths()
+
+    def run_polling(self):
+        file_stats = self.get_file_stats()
+        while not self.terminated:
+            time.sleep(self.poll_interval)
+            new_file_stats = self.get_file_stats()
+            changed_paths = set()
+            for filepath, file_stat in new_file_stats.items():
+                if file_stats.get(filepath) != file_stat:
+                    changed_paths.add(filepath)
+            for filepath in file_stats:
+                if not filepath in new_file_stats:
+                    changed_paths.add(filepath)
+            file_stats = new_file_stats
+            if changed_paths:
+                self.pending_paths = changed_paths
+                self.flush_pending_paths()
+
+    def get_file_stats(self):
+        file_stats = {}
+        for file_stat in stat_audio_files(self.music_dir):
+            file_stats[file_stat[0]] = file_stat
+        return file_stats
@@ -7,6 +7,10 @@ from pathlib import Path
 
 from pmus.client import cmd_to_stdout, send_cmd_wait_all
 from pmus.config import config
+from pmus.sorting import get_sort_key_names
+from pmus.export import EXPORT_FORMATS
+from pmus.output import JSON_FORMAT
+from pmus.info_format import get_field_names
 
 # fix broken pipes
 from signal import SIGPIPE, SIG_DFL
@@ -16,15 +20,23 @@ def start_server():
     from pmus.player import MusicPlayer
     from pmus.db import MusicProvider
     from pmus.server import Server
+    from pmus.watcher import LibraryWatcher
     provider = MusicProvider()
-    provider.load_music()
-    print('music loaded')
-
-    player = MusicPlayer()
+    player = MusicPlayer(provider)
     server = Server(player, provider)
 
+    watcher = None
+    if config.watch_music_dir:
+        watcher = LibraryWatcher(provider, config.music_dir)
+
+    # the music is loaded (and then validated) in the background so that
+    # clients can connect right away, commands that need it wait for it
+    provider.start_loading(watcher.start if watcher is not None else None)
+
     def on_exit(signum=None, frame=None):
         print('terminating...')
+        if watcher is not None:
+            watcher.terminate()
         server.terminate()
         print('done')
         sys.exit(0)
@@ -97,15 +109,19 @@ if __name__ == '__main__':
                         dest='print_current_song',
                         help='print the current song (that is playing)')
     parser.add_argument('-f', '--find_music', nargs='?', const=config.music_dir,
-                        help='tell the daemon to look for music')
+                        help='tell the daemon to look for music, prints the id of the job that does it (see -r "job status <id>" and "job cancel <id>")')
     parser.add_argument('-I', '--info', action='store_true',
                         help='get info about objects of type specified by -o and -S, choose output format using -F')
     parser.add_argument('-F', '--output_format', nargs='?', default='id,name\n',
-                        help='output format')
-    parser.add_argument('-s', '--sort_by', help='what to sort music objects by', 
-                        choices=('time_liked', 'name', 'id', 'rev_time_liked',
-                                 'rev_name', 'rev_id', 'idx_in_album',
-                                 'rev_idx_in_album'), default='id')
+                        help='output format, every field in it is replaced by its value ({}), or {} for a line of json per object'.format(', '.join(sorted(get_field_names())), JSON_FORMAT))
+    parser.add_argument('-s', '--sort_by', help='what to sort music objects by, a comma separated list of keys each of which can be prefixed by rev_ ({})'.format(', '.join(sorted(get_sort_key_names()))),
+                        default='id')
+    parser.add_argument('-T', '--top', nargs='?', const='- -',
+                        help='get the objects of type specified by -o that were listened to the most, optionally between two times in ms (e.g. "1600000000000 -"), -l sets how many (default 10), choose output format using -F')
+    parser.add_argument('-E', '--export', choices=EXPORT_FORMATS,
+                        help='write the listening history to stdout in the given format')
+    parser.add_argument('--since', type=int,
+                        help='with -E, only export the playbacks that started at or after this time (ms)')
     parser.add_argument('-P', '--port', help='network port to listen on',
                         type=int)
     parser.add_argument('-H', '--host', help='network host to listen on')
@@ -125,7 +141,12 @@ if __name__ == '__main__':
     if args.raw_cmd:
         cmd_to_stdout(args.raw_cmd)
     else:
-        if args.find_music:
+        if args.export:
+            if args.since is not None:
+                cmd_to_stdout('export {} {}'.format(args.export, args.since))
+            else:
+                cmd_to_stdout('export {}'.format(args.export))
+        elif args.find_music:
             cmd_to_stdout('find_music {}'.format(args.find_music))
         elif args.music_object:
             if args.info: # args.info contains the info format
@@ -134,6 +155,11 @@ if __name__ == '__main__':
                                                            args.sort_by,
                                                            args.limit,
                                                            args.output_format))
+            elif args.top:
+                cmd_to_stdout('top {} {} {} {}'.format(args.music_object,
+                                                       int(args.limit) or 10,
+                                                       args.top,
+                                                       args.output_format))
             elif args.play:
                 cmd_to_stdout('play {} {}'.format(args.music_object,
                                                   args.specifier.replace(',', ' ')))
@@ -27,8 +27,6 @@ def on_lyrics(song, lyrics):
     print('got lyrics for {} - {}'.format(song.name, song.artists[0].name))
 
 if __name__ == '__main__':
-    print('note that its better to kill the music daemon before running'
-           ' this script because this script locks the database')
     music_provider.load_music()
 
     with ThreadPoolExecutor(max_workers=CONCURRENT_WORKERS) as executor:
@@ -36,5 +34,4 @@ if __name__ == '__main__':
             if music_provider.db_provider.get_song_lyrics(song.id) is None:
                 executor.submit(get_lyrics, song)
 
-    print('done, saving to database')
-    music_provider.db_provider.commit()
+    print('done')
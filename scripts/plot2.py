@@ -1,31 +1,24 @@
 #!/usr/bin/python3
 import matplotlib.pyplot as plt
-from pmus.db import MusicProvider
+from pmus.db import DBProvider
 from datetime import datetime
 from pmus.utils import current_time
 
 plt.style.use(['dark_background'])
 
 if __name__ == '__main__':
-    provider = MusicProvider()
-    provider.load_music()
-    first_listen_time = provider.playbacks[1].time_started
-    total_time = current_time() - first_listen_time
+    # the time listened comes from the rollups, no need to load the music
+    db_provider = DBProvider()
+    first_listen_time = db_provider.get_playback(1)['time_started']
 
     time_fraction = 500
-    xs = []
-    ys = []
-
-    from_time = first_listen_time
-    to_time = from_time + total_time / time_fraction
-    for i in range(time_fraction):
-        time_listened = 0
-        for song in provider.get_songs_list():
-            time_listened += song.time_listened(from_time, to_time)
-        xs.append(i)
-        ys.append(time_listened)
-        from_time = to_time
-        to_time = from_time + total_time / time_fraction
+    bin_size = (current_time() - first_listen_time) / time_fraction
+    edges = [first_listen_time + bin_size * i for i in range(time_fraction + 1)]
+    time_listened_per_bin = [
+        sum(db_provider.get_songs_time_listened(edges[i], edges[i + 1]).values())
+        for i in range(time_fraction)]
+    xs = list(range(time_fraction))
+    ys = time_listened_per_bin
 
     fig, ax = plt.subplots()
     ax.plot(xs, ys)
@@ -6,26 +6,8 @@ import numpy as np
 
 plt.style.use(['dark_background'])
 
-def get_largest_elements(list_to_sort, limit, compare):
-    mylist = list_to_sort.copy()
-    final_list = []
-    for i in range(limit):
-        biggest = mylist[0]
-        for j in range(len(mylist)):
-            element = mylist[j]
-            if compare(element, biggest):
-                biggest = element
-        final_list.append(biggest)
-        mylist.remove(biggest)
-    return final_list
-
 def get_top_songs(provider, limit):
-    def compare(song1, song2):
-        if song1.time_listened() > song2.time_listened():
-            return True
-        return False
-    print('loaded music')
-    return get_largest_elements(provider.get_songs_list(), limit, compare)
+    return [song for song, time_listened in provider.get_top('song', limit)]
 
 if __name__ == '__main__':
     provider = MusicProvider()
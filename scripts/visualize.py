@@ -6,53 +6,17 @@ plt.style.use(['dark_background'])
 
 ENTRY_COUNT = 8
 
-def get_largest_elements(list_to_sort, limit, compare):
-    mylist = list_to_sort.copy()
-    final_list = []
-    for i in range(limit):
-        biggest = mylist[0]
-        for j in range(len(mylist)):
-            element = mylist[j]
-            if compare(element, biggest):
-                biggest = element
-        final_list.append(biggest)
-        mylist.remove(biggest)
-    return final_list
-
-def get_top_songs(provider, limit):
-    def compare(song1, song2):
-        if song1.time_listened() > song2.time_listened():
-            return True
-        return False
-    return get_largest_elements(provider.get_songs_list(),
-            limit,
-            compare)
-
-def get_top_albums(provider, limit):
-    def compare(album1, album2):
-        if album1.time_listened() > album2.time_listened():
-            return True
-        return False
-    return get_largest_elements(provider.get_albums_list(),
-            limit,
-            compare)
-
-def get_top_artists(provider, limit):
-    def compare(artist1, artist2):
-        if artist1.time_listened() > artist2.time_listened():
-            return True
-        return False
-    return get_largest_elements(provider.get_artists_list(),
-            limit,
-            compare)
+def get_top(provider, music_type, limit):
+    return [music_object for music_object, time_listened
+            in provider.get_top(music_type, limit)]
 
 if __name__ == '__main__':
     provider = MusicProvider()
     provider.load_music()
 
-    top_albums = get_top_albums(provider, ENTRY_COUNT)
-    top_songs = get_top_songs(provider, ENTRY_COUNT)
-    top_artists = get_top_artists(provider, ENTRY_COUNT)
+    top_albums = get_top(provider, 'album', ENTRY_COUNT)
+    top_songs = get_top(provider, 'song', ENTRY_COUNT)
+    top_artists = get_top(provider, 'artist', ENTRY_COUNT)
 
     fig, (songs_ax, albums_ax, artists_ax) = plt.subplots(3)
     fig.tight_layout()
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+
+import pytest
+
+from bench.synthetic import generate_database
+from bench.compare import load_results
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_generate_database(tmp_path):
+    db_path = str(tmp_path / 'music.db')
+    counts = generate_database(db_path, 2, 3, 4, 25, pauses_per_playback=2)
+    assert counts == {'artists': 2, 'albums': 6, 'songs': 24,
+                      'playbacks': 25, 'pauses': 50}
+    conn = sqlite3.connect(db_path)
+    for table, count in [('artists', 2), ('albums', 6), ('songs', 24),
+                         ('album_songs', 24), ('song_artists', 24),
+                         ('playbacks', 25), ('pauses', 50), ('resumes', 50)]:
+        assert conn.execute('SELECT COUNT(*) FROM {}'.format(table))\
+                .fetchone()[0] == count
+    # every playback got rolled up
+    assert conn.execute('SELECT COUNT(*) FROM rolled_up_playbacks')\
+            .fetchone()[0] == 25
+    conn.close()
+
+# the same seed makes the same library
+def test_generate_database_seed(tmp_path):
+    rows = []
+    for name in ('a.db', 'b.db'):
+        db_path = str(tmp_path / name)
+        generate_database(db_path, 1, 2, 3, 10)
+        conn = sqlite3.connect(db_path)
+        rows.append(conn.execute('SELECT * FROM playbacks').fetchall())
+        conn.close()
+    assert rows[0] == rows[1]
+
+# bench.run writes json that bench.compare reads and compares
+def test_run_and_compare(tmp_path):
+    pytest.importorskip('sounddevice')
+    results_path = str(tmp_path / 'results.json')
+    subprocess.run([sys.executable, '-m', 'bench.run', '-s', 'tiny', '-r', '1',
+                    '-o', results_path], cwd=ROOT_DIR, check=True)
+    results = load_results(results_path)
+    scale = results['scales']['tiny']
+    assert scale['counts']['playbacks'] == 50
+    assert scale['timings']
+    for timing in scale['timings'].values():
+        assert timing['runs'] == 1
+        assert timing['min'] >= 0
+    output = subprocess.run([sys.executable, '-m', 'bench.compare',
+                             results_path, results_path], cwd=ROOT_DIR,
+                            check=True, capture_output=True, text=True).stdout
+    assert 'tiny' in output
+    assert 'sort songs name' in output
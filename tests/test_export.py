@@ -0,0 +1,61 @@
+import csv
+import json
+
+import pytest
+
+from bench.synthetic import generate_database
+from pmus.db import DBProvider
+from pmus.export import export_history, CSV_COLUMNS
+
+@pytest.fixture
+def db_provider(tmp_path):
+    path = str(tmp_path / 'music.db')
+    generate_database(path, 1, 2, 3, 45, pauses_per_playback=2)
+    db_provider = DBProvider(path)
+    yield db_provider
+    db_provider.close()
+
+def get_times_started(db_provider):
+    with db_provider.reading(tuples=True) as c:
+        return [row[0] for row in c.execute('SELECT time_started\
+                                             FROM playbacks ORDER BY id')]
+
+def test_export_jsonl(db_provider):
+    times_started = get_times_started(db_provider)
+    playbacks = [json.loads(line) for line in
+                 ''.join(export_history(db_provider, 'jsonl',
+                                        chunk_size=10)).splitlines()]
+    assert [playback['time_started'] for playback in playbacks] ==\
+            times_started
+    assert all(len(playback['pauses']) == 2 and len(playback['resumes']) == 2
+               for playback in playbacks)
+    assert sum(len(playback['seeks']) for playback in playbacks) == 3
+    # the chunk size doesnt change what is written
+    assert ''.join(export_history(db_provider, 'jsonl', chunk_size=7)) ==\
+            ''.join(export_history(db_provider, 'jsonl'))
+    since_playbacks = ''.join(export_history(
+        db_provider, 'jsonl', times_started[30])).splitlines()
+    assert len(since_playbacks) == 15
+    assert ''.join(export_history(db_provider, 'jsonl',
+                                  times_started[-1] + 1)) == ''
+
+def test_export_csv(db_provider):
+    rows = list(csv.reader(''.join(export_history(
+        db_provider, 'csv', chunk_size=10)).splitlines()))
+    assert rows[0] == CSV_COLUMNS
+    events = [row[5] for row in rows[1:]]
+    assert events.count('playback') == 45
+    assert events.count('pause') == 90
+    assert events.count('resume') == 90
+    assert events.count('seek') == 3
+
+# with nothing since the time given there is still a header
+def test_export_csv_nothing_since(db_provider):
+    times_started = get_times_started(db_provider)
+    assert ''.join(export_history(db_provider, 'csv',
+                                  times_started[-1] + 1)) ==\
+            ','.join(CSV_COLUMNS) + '\n'
+
+def test_unknown_format(db_provider):
+    with pytest.raises(ValueError):
+        list(export_history(db_provider, 'xml'))
@@ -0,0 +1,68 @@
+import json
+
+from bench.format_info import FORMATS, legacy_format_info, generate_songs
+from pmus.music import Song, Album, Artist
+from pmus.info_format import InfoFormatter, parse_format
+
+# the compiled formatter gives what the server gave before for the formats
+# that worked then
+def test_matches_legacy_format_info():
+    songs = generate_songs(60, albums_per_artist=2, songs_per_album=5)
+    albums = []
+    artists = []
+    for song in songs:
+        if not song.album in albums:
+            albums.append(song.album)
+        if not song.artists[0] in artists:
+            artists.append(song.artists[0])
+    formats = FORMATS + ['id name first_audio_url time_listened\n']
+    for fmt in formats:
+        formatter = InfoFormatter(fmt)
+        for music_object in songs + albums + artists:
+            assert formatter.format(music_object) ==\
+                    legacy_format_info(music_object, fmt)
+    extra_fields = {'idx': '3', 'position': '1.5'}
+    fmt = 'idx id position name\n'
+    for song in songs:
+        assert InfoFormatter(fmt).format(song, extra_fields) ==\
+                legacy_format_info(song, fmt, extra_fields)
+
+# where field names overlap the longest one is the field
+def test_longest_name_wins():
+    assert parse_format('album_name name', {'name', 'album_name'}) ==\
+            [(True, 'album_name'), (False, ' '), (True, 'name')]
+    assert parse_format('xnamex', {'name'}) ==\
+            [(False, 'x'), (True, 'name'), (False, 'x')]
+    assert parse_format('nothing here', set()) == [(False, 'nothing here')]
+    song = generate_songs(1)[0]
+    assert InfoFormatter('album_id id artist_name name url').format(song) ==\
+            '{} {} {} {} {}'.format(song.album.id, song.id,
+                                    song.artists[0].name, song.name,
+                                    song.audio_url)
+
+def test_json():
+    song = generate_songs(1)[0]
+    line = InfoFormatter('@json').format(song, {'idx': 4})
+    assert line.endswith('\n')
+    song_map = json.loads(line)
+    assert song_map['id'] == song.id
+    assert song_map['name'] == song.name
+    assert song_map['album']['name'] == song.album.name
+    assert song_map['idx'] == 4
+    assert InfoFormatter(' @json \n').json
+
+# a song without an album, an album without a year and an artist without
+# songs have 'none' where the values would be
+def test_missing_values():
+    artist = Artist(1, 'artist', [], [])
+    song = Song(1, '/music/song.flac', 'song', [artist], 100.0)
+    formatter = InfoFormatter('album_id album_name year time_liked\n')
+    assert formatter.format(song) == 'none none none none\n'
+    album = Album(1, 'album', [], [], None)
+    song.album = album
+    assert formatter.format(song) == '1 album none none\n'
+    assert InfoFormatter('name artist_name year first_audio_url')\
+            .format(album) == 'album none none none'
+    assert InfoFormatter('name first_audio_url').format(artist) ==\
+            'artist none'
+    assert InfoFormatter('id').format(object()) is None
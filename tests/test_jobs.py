@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+
+import pmus.db
+from bench.synthetic import generate_database, generate_audio_tree
+from pmus.db import MusicProvider
+from pmus.jobs import (JobManager, JOB_RUNNING, JOB_DONE, JOB_CANCELLED,
+                       JOB_FAILED)
+
+def wait_finished(job, timeout=10):
+    time_started = time.time()
+    while job.is_running():
+        assert time.time() - time_started < timeout
+        time.sleep(0.01)
+
+def wait_for(event, job=None):
+    event.wait(10)
+
+def test_exclusive_start():
+    job_manager = JobManager()
+    release = threading.Event()
+    job = job_manager.start('scan', wait_for, release, exclusive=True)
+    assert job is not None and job.state == JOB_RUNNING
+    assert job_manager.start('scan', wait_for, release, exclusive=True) is None
+    # jobs with another name or that dont ask to be exclusive still start
+    other_job = job_manager.start('other', wait_for, release, exclusive=True)
+    shared_job = job_manager.start('scan', wait_for, release)
+    assert other_job.id != job.id and shared_job.id != job.id
+    release.set()
+    for started_job in (job, other_job, shared_job):
+        wait_finished(started_job)
+        assert started_job.state == JOB_DONE
+    job = job_manager.start('scan', wait_for, release, exclusive=True)
+    assert job is not None
+    wait_finished(job)
+
+def run_until_cancelled(started, job=None):
+    started.set()
+    while not job.cancelled():
+        job.add('rounds')
+        time.sleep(0.001)
+
+def fail(job=None):
+    raise ValueError('bad file')
+
+def test_cancel_and_fail():
+    job_manager = JobManager()
+    started = threading.Event()
+    job = job_manager.start('loop', run_until_cancelled, started)
+    started.wait(10)
+    assert job_manager.get(job.id) is job
+    job.cancel()
+    wait_finished(job)
+    assert job.state == JOB_CANCELLED
+    assert 'state cancelled' in job.get_status()
+    assert job.counters['rounds'][0] > 0
+    assert job.get_summary() == '{} loop cancelled\n'.format(job.id)
+
+    job = job_manager.start('fail', fail)
+    wait_finished(job)
+    assert job.state == JOB_FAILED
+    assert job.error == 'ValueError: bad file'
+    assert 'error ValueError: bad file' in job.get_status()
+
+def do_nothing(job=None):
+    pass
+
+def test_forget_finished_jobs():
+    job_manager = JobManager(finished_jobs_kept=3)
+    release = threading.Event()
+    running_job = job_manager.start('running', wait_for, release)
+    finished_jobs = []
+    for i in range(5):
+        job = job_manager.start('quick', do_nothing)
+        wait_finished(job)
+        finished_jobs.append(job)
+    job = job_manager.start('last', wait_for, release)
+    # the running ones are kept and only the newest finished ones
+    assert [job.id for job in job_manager.get_jobs_list()] ==\
+            [running_job.id] + [job.id for job in finished_jobs[-3:]] +\
+            [job.id]
+    assert job_manager.get(finished_jobs[0].id) is None
+    release.set()
+    wait_finished(running_job)
+    wait_finished(job)
+
+# every loaded song is in its album and under its artists, and the loaded
+# music is what loading it again from the database gives
+def check_catalog(music_provider):
+    for song in music_provider.get_songs_list():
+        assert song.album is not None
+        assert song in song.album.songs
+        assert music_provider.albums[song.album.id] is song.album
+        for artist in song.album.artists:
+            assert music_provider.artists[artist.id] is artist
+            assert song.album in artist.albums
+    for album in music_provider.get_albums_list():
+        assert album.songs
+    reloaded_provider = MusicProvider(music_provider.db_provider.path)
+    reloaded_provider.load_music(validate_files=False)
+    assert sorted((song.id, song.audio_url, song.album.id)
+                  for song in reloaded_provider.get_songs_list()) ==\
+            sorted((song.id, song.audio_url, song.album.id)
+                   for song in music_provider.get_songs_list())
+    reloaded_provider.db_provider.close()
+
+# a scan cancelled halfway writes what it probed, the next one the rest
+def test_cancel_scan_job(tmp_path):
+    music_dir = str(tmp_path / 'music')
+    filepaths = generate_audio_tree(music_dir, 2, 2, 4, ['flac'], seconds=1)
+    music_provider = MusicProvider(str(tmp_path / 'music.db'))
+    music_provider.load_music(validate_files=False)
+
+    def find_music(job=None):
+        add = job.add
+        def add_and_cancel(counter, amount=1):
+            add(counter, amount)
+            if counter == 'files_probed' and job.counters[counter][0] == 5:
+                job.cancel()
+        job.add = add_and_cancel
+        music_provider.find_music(music_dir, 1, job=job)
+
+    job_manager = JobManager()
+    job = job_manager.start('find_music', find_music, exclusive=True)
+    wait_finished(job, 60)
+    assert job.state == JOB_CANCELLED
+    assert job.counters['files_seen'][0] == len(filepaths)
+    assert job.counters['files_probed'][0] == 5
+    assert job.counters['songs_added'][0] == 5
+    assert job.counters['files_vanished'][0] == 0
+    assert len(music_provider.songs) == 5
+    check_catalog(music_provider)
+
+    job = job_manager.start('find_music', music_provider.find_music,
+                            music_dir, 1, exclusive=True)
+    wait_finished(job, 60)
+    assert job.state == JOB_DONE
+    assert job.counters['files_to_probe'][0] == len(filepaths) - 5
+    assert sorted(song.audio_url for song in music_provider.get_songs_list())\
+            == sorted(filepaths)
+    check_catalog(music_provider)
+    music_provider.db_provider.close()
+
+# validates music where the first song of every album is missing, returns
+# the ids of the songs each remove_songs() call removed
+def validate_with_missing_songs(tmp_path, monkeypatch, remove_interval):
+    music_dir = str(tmp_path / 'music')
+    db_path = str(tmp_path / 'music.db')
+    generate_database(db_path, 2, 2, 3, 0, music_dir=music_dir)
+    music_provider = MusicProvider(db_path)
+    music_provider.load_music(validate_files=False)
+    missing_song_ids = []
+    for album in music_provider.get_albums_list():
+        for song in album.songs:
+            if song is album.songs[0]:
+                missing_song_ids.append(song.id)
+                continue
+            os.makedirs(os.path.dirname(song.audio_url), exist_ok=True)
+            open(song.audio_url, 'w').close()
+
+    removals = []
+    remove_songs = music_provider.remove_songs
+    def record_removal(songs):
+        removals.append([song.id for song in songs])
+        remove_songs(songs)
+    monkeypatch.setattr(music_provider, 'remove_songs', record_removal)
+    monkeypatch.setattr(pmus.db, 'VALIDATE_REMOVE_INTERVAL', remove_interval)
+    music_provider.validate_music(workers=2)
+    assert sorted(sum(removals, [])) == sorted(missing_song_ids)
+    assert len(music_provider.songs) == 8
+    assert not any(song_id in music_provider.songs
+                   for song_id in missing_song_ids)
+    music_provider.db_provider.close()
+    return removals
+
+def test_validate_removes_as_it_goes(tmp_path, monkeypatch):
+    removals = validate_with_missing_songs(tmp_path, monkeypatch, 0)
+    assert len(removals) == 4
+
+# missing songs found within VALIDATE_REMOVE_INTERVAL of the last removal are
+# removed together
+def test_validate_removes_in_batches(tmp_path, monkeypatch):
+    removals = validate_with_missing_songs(tmp_path, monkeypatch, 1000)
+    assert len(removals) <= 2
+    assert len(removals[-1]) >= 3
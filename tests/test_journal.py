@@ -0,0 +1,83 @@
+import sqlite3
+
+from bench.synthetic import generate_database, SYNTHETIC_EPOCH
+from pmus.db import DBProvider
+from pmus.music import Playback
+from pmus.journal import PlaybackJournal
+
+def make_journal(tmp_path, commit_delay=0):
+    path = str(tmp_path / 'music.db')
+    generate_database(path, 1, 1, 2, 5)
+    db_provider = DBProvider(path)
+    return path, db_provider, PlaybackJournal(db_provider, commit_delay)
+
+def get_rows(conn, table, playback_id):
+    return [row[0] for row in conn.execute(
+        'SELECT time FROM {} WHERE playback_id = ?'.format(table),
+        (playback_id,))]
+
+# another process took the id the journal handed out, everything about the
+# playback lands on the id it got instead
+def test_playback_id_taken(tmp_path):
+    path, db_provider, journal = make_journal(tmp_path)
+    time_started = SYNTHETIC_EPOCH + 100 * 24 * 3600 * 1000
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('INSERT INTO playbacks (id, time_started, time_ended,\
+                      song_id) VALUES (?, ?, ?, ?)',
+                     (journal.next_playback_id, 1, 2, 2))
+
+    playback_id = journal.add_playback(time_started, -1, 1)
+    journal.add_pause(time_started + 10000, playback_id)
+    journal.add_resume(time_started + 20000, playback_id)
+    journal.update_playback_time_ended(playback_id, time_started + 60000)
+    journal.add_playback_to_rollups(Playback(playback_id, 1, time_started,
+                                             time_started + 60000,
+                                             [time_started + 10000],
+                                             [time_started + 20000]))
+    journal.terminate()
+    db_provider.close()
+
+    # the other process' playback is left alone
+    assert conn.execute('SELECT time_started, time_ended, song_id\
+                         FROM playbacks WHERE id = ?',
+                        (playback_id,)).fetchone() == (1, 2, 2)
+    assert get_rows(conn, 'pauses', playback_id) == []
+    assert get_rows(conn, 'resumes', playback_id) == []
+    db_playback_id, time_ended = conn.execute(
+            'SELECT id, time_ended FROM playbacks WHERE time_started = ?',
+            (time_started,)).fetchone()
+    assert db_playback_id != playback_id
+    assert time_ended == time_started + 60000
+    assert get_rows(conn, 'pauses', db_playback_id) == [time_started + 10000]
+    assert get_rows(conn, 'resumes', db_playback_id) == [time_started + 20000]
+    rolled_up_ids = [row[0] for row in conn.execute(
+        'SELECT playback_id FROM rolled_up_playbacks')]
+    assert db_playback_id in rolled_up_ids
+    assert not playback_id in rolled_up_ids
+    assert conn.execute('SELECT SUM(ms) FROM hourly_listening\
+                         WHERE hour >= ?', (time_started - 3600 * 1000,))\
+            .fetchone()[0] == 50000
+    conn.close()
+
+# a write that fails in a batch doesnt take the rest of the batch with it
+def test_bad_write_in_batch(tmp_path):
+    path, db_provider, journal = make_journal(tmp_path, commit_delay=0.5)
+    time_started = SYNTHETIC_EPOCH + 100 * 24 * 3600 * 1000
+    playback_id = journal.add_playback(time_started, -1, 1)
+    journal.add_pause(time_started + 10000, playback_id)
+    # position cant be null
+    journal.add_seek(time_started + 15000, None, playback_id)
+    journal.add_resume(time_started + 20000, playback_id)
+    journal.add_seek(time_started + 25000, 30, playback_id)
+    journal.update_playback_time_ended(playback_id, time_started + 60000)
+    journal.terminate()
+    db_provider.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT time_ended FROM playbacks WHERE id = ?',
+                        (playback_id,)).fetchone() == (time_started + 60000,)
+    assert get_rows(conn, 'pauses', playback_id) == [time_started + 10000]
+    assert get_rows(conn, 'resumes', playback_id) == [time_started + 20000]
+    assert get_rows(conn, 'seeks', playback_id) == [time_started + 25000]
+    conn.close()
@@ -0,0 +1,62 @@
+from bench.synthetic import generate_database, SYNTHETIC_EPOCH
+from pmus.db import MusicProvider
+
+TIME_STARTED = SYNTHETIC_EPOCH + 100 * 24 * 3600 * 1000
+
+def make_music_provider(tmp_path):
+    path = str(tmp_path / 'music.db')
+    generate_database(path, 2, 2, 3, 50)
+    music_provider = MusicProvider(path)
+    music_provider.load_music(validate_files=False)
+    assert music_provider.check_listening_totals() == []
+    return music_provider
+
+def start_playback(music_provider, song_id):
+    playback_id = music_provider.db_provider.get_next_id('playbacks')
+    return music_provider.add_playback(playback_id, song_id, TIME_STARTED)
+
+def test_playback_ended_once(tmp_path):
+    music_provider = make_music_provider(tmp_path)
+    song = music_provider.songs[1]
+    play_count = song.play_count
+    playback = start_playback(music_provider, 1)
+    assert music_provider.check_listening_totals() == []
+    music_provider.end_playback(playback, TIME_STARTED + 60000)
+    assert music_provider.check_listening_totals() == []
+    assert song.play_count == play_count + 1
+    assert song.last_played == TIME_STARTED
+    music_provider.db_provider.close()
+
+# ending it again replaces what the first end added
+def test_playback_ended_twice(tmp_path):
+    music_provider = make_music_provider(tmp_path)
+    song = music_provider.songs[1]
+    time_listened = song.total_time_listened
+    play_count = song.play_count
+    playback = start_playback(music_provider, 1)
+    music_provider.end_playback(playback, TIME_STARTED + 60000)
+    music_provider.end_playback(playback, TIME_STARTED + 90000)
+    assert music_provider.check_listening_totals() == []
+    assert song.play_count == play_count + 1
+    assert song.total_time_listened == time_listened + 90000
+    music_provider.db_provider.close()
+
+# the playback started in the music from before the music was loaded again,
+# once without it in the database and once with it (the journal wrote it)
+def test_playback_started_before_build_music(tmp_path):
+    music_provider = make_music_provider(tmp_path)
+    for in_database in (False, True):
+        playback = start_playback(music_provider, 2)
+        if in_database:
+            with music_provider.db_provider.writing() as conn:
+                conn.execute('INSERT INTO playbacks (id, time_started,\
+                              time_ended, song_id) VALUES (?, ?, ?, ?)',
+                             (playback.id, TIME_STARTED, -1, 2))
+        music_provider.load_music(validate_files=False)
+        song = music_provider.songs[2]
+        play_count = song.play_count
+        music_provider.end_playback(playback, TIME_STARTED + 60000)
+        assert music_provider.check_listening_totals() == []
+        assert song.play_count == play_count + 1
+        assert playback.time_ended == TIME_STARTED + 60000
+    music_provider.db_provider.close()
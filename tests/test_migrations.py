@@ -0,0 +1,41 @@
+import sqlite3
+
+from pmus.db import get_schema_buffer
+from pmus.migrations import MIGRATIONS, migrate, get_schema_version
+
+def create_first_release_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(get_schema_buffer())
+    return conn
+
+# artists added more than once by the old find_music are merged into the
+# oldest one, and the rows that pointed at the others point at it (once)
+def test_migrate_merges_duplicate_artists(tmp_path):
+    conn = create_first_release_db(str(tmp_path / 'music.db'))
+    assert get_schema_version(conn) == 0
+    with conn:
+        conn.executemany('INSERT INTO artists (id, name, time) VALUES (?, ?, 0)',
+                         [(1, 'Some Artist'), (2, 'some  artist '),
+                          (3, 'Other Artist'), (4, 'SOME ARTIST')])
+        conn.executemany('INSERT INTO song_artists (artist_id, song_id)\
+                          VALUES (?, ?)', [(1, 1), (2, 1), (4, 2), (3, 3)])
+        conn.executemany('INSERT INTO album_artists (artist_id, album_id)\
+                          VALUES (?, ?)', [(2, 1), (4, 1), (3, 2)])
+        conn.executemany('INSERT INTO liked_songs (song_id, time)\
+                          VALUES (?, ?)', [(1, 10), (1, 20), (2, 30)])
+    migrate(conn)
+
+    assert get_schema_version(conn) == len(MIGRATIONS)
+    assert conn.execute('SELECT id, name FROM artists ORDER BY id')\
+            .fetchall() == [(1, 'Some Artist'), (3, 'Other Artist')]
+    assert conn.execute('SELECT song_id, artist_id FROM song_artists\
+                         ORDER BY song_id').fetchall() ==\
+            [(1, 1), (2, 1), (3, 3)]
+    assert conn.execute('SELECT album_id, artist_id FROM album_artists\
+                         ORDER BY album_id').fetchall() == [(1, 1), (2, 3)]
+    assert conn.execute('SELECT song_id, time FROM liked_songs\
+                         ORDER BY song_id').fetchall() == [(1, 10), (2, 30)]
+
+    # migrating again doesnt change anything
+    migrate(conn)
+    assert conn.execute('SELECT COUNT(*) FROM artists').fetchone()[0] == 2
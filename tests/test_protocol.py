@@ -0,0 +1,42 @@
+import pytest
+
+from pmus.protocol import (MAGIC, PROTOCOL_VERSION, REQUEST_HEADER,
+                           RESPONSE_HEADER, FRAME_DATA, FRAME_ERROR, FRAME_END,
+                           encode_handshake, encode_request, encode_frame)
+
+def decode_request(data):
+    request_id, length = REQUEST_HEADER.unpack(data[:REQUEST_HEADER.size])
+    payload = data[REQUEST_HEADER.size:]
+    assert len(payload) == length
+    return request_id, payload.decode()
+
+def decode_frame(data):
+    request_id, frame_type, length = RESPONSE_HEADER.unpack(
+            data[:RESPONSE_HEADER.size])
+    payload = data[RESPONSE_HEADER.size:]
+    assert len(payload) == length
+    return request_id, frame_type, payload.decode()
+
+def test_handshake():
+    assert encode_handshake() == MAGIC + bytes([PROTOCOL_VERSION])
+    assert encode_handshake(0)[-1] == 0
+
+@pytest.mark.parametrize('request_id,cmd', [
+    (1, 'progress'),
+    (2 ** 32 - 1, 'play song ' + ' '.join(str(i) for i in range(5000))),
+    (7, 'info song all name 0 name – ünïcode\n'),
+    (8, ''),
+])
+def test_request_round_trip(request_id, cmd):
+    assert decode_request(encode_request(request_id, cmd)) == (request_id, cmd)
+    assert decode_request(encode_request(request_id, cmd.encode())) ==\
+            (request_id, cmd)
+
+@pytest.mark.parametrize('frame_type,payload', [
+    (FRAME_DATA, '1 song – ünïcode\n' * 1000),
+    (FRAME_ERROR, 'KeyError: 2501'),
+    (FRAME_END, ''),
+])
+def test_frame_round_trip(frame_type, payload):
+    assert decode_frame(encode_frame(42, frame_type, payload)) ==\
+            (42, frame_type, payload)
@@ -0,0 +1,86 @@
+import sqlite3
+
+from bench.synthetic import generate_database, SYNTHETIC_EPOCH
+from pmus.music import Playback
+from pmus.rollups import HOUR, DAY, fill_rollups, get_songs_time_listened
+
+def get_playbacks(conn):
+    playbacks = {}
+    for playback_id, song_id, time_started, time_ended in conn.execute(
+            'SELECT id, song_id, time_started, time_ended FROM playbacks'):
+        playbacks[playback_id] = Playback(playback_id, song_id, time_started,
+                                          time_ended, [], [])
+    for table in ('pauses', 'resumes'):
+        for playback_id, time in conn.execute(
+                'SELECT playback_id, time FROM {}'.format(table)):
+            getattr(playbacks[playback_id], table).append(time)
+    return list(playbacks.values())
+
+def get_expected_time_listened(playbacks, from_time=None, to_time=None):
+    totals = {}
+    for playback in playbacks:
+        time_listened = playback.time_listened(from_time, to_time)
+        if time_listened:
+            totals[playback.song_id] = totals.get(playback.song_id, 0) +\
+                    time_listened
+    return totals
+
+def get_bucket_totals(conn, table):
+    return dict(conn.execute('SELECT song_id, SUM(ms) FROM {}\
+                              GROUP BY song_id'.format(table)).fetchall())
+
+def test_fill_rollups_matches_playbacks(tmp_path):
+    path = str(tmp_path / 'music.db')
+    generate_database(path, 3, 2, 5, 300, pauses_per_playback=2)
+    conn = sqlite3.connect(path)
+    playbacks = get_playbacks(conn)
+    expected = get_expected_time_listened(playbacks)
+    assert get_bucket_totals(conn, 'hourly_listening') == expected
+    assert get_bucket_totals(conn, 'daily_listening') == expected
+
+    # everything is rolled up already
+    assert fill_rollups(conn) == 0
+
+    time_ended = max(playback.time_ended for playback in playbacks)
+    for from_time, to_time in [
+            (SYNTHETIC_EPOCH, time_ended),
+            (SYNTHETIC_EPOCH + HOUR // 3, SYNTHETIC_EPOCH + 2 * DAY + 17),
+            (SYNTHETIC_EPOCH + DAY + 1234, SYNTHETIC_EPOCH + DAY + HOUR // 2),
+            (SYNTHETIC_EPOCH + 5 * HOUR + 1, time_ended - 7 * HOUR - 1)]:
+        assert get_songs_time_listened(conn, from_time, to_time) ==\
+                get_expected_time_listened(playbacks, from_time, to_time)
+
+# playbacks another process wrote while the daemon wasnt running are rolled
+# up when it starts
+def test_db_provider_fills_rollups(tmp_path):
+    from pmus.db import DBProvider
+
+    path = str(tmp_path / 'music.db')
+    generate_database(path, 1, 1, 2, 10)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('INSERT INTO playbacks (id, time_started, time_ended,\
+                      song_id) VALUES (?, ?, ?, ?)',
+                     (100, SYNTHETIC_EPOCH + 10 * DAY,
+                      SYNTHETIC_EPOCH + 10 * DAY + 120000, 1))
+        conn.execute('INSERT INTO pauses (time, playback_id) VALUES (?, ?)',
+                     (SYNTHETIC_EPOCH + 10 * DAY + 30000, 100))
+        conn.execute('INSERT INTO resumes (time, playback_id) VALUES (?, ?)',
+                     (SYNTHETIC_EPOCH + 10 * DAY + 50000, 100))
+        # one that hasnt ended isnt rolled up
+        conn.execute('INSERT INTO playbacks (id, time_started, time_ended,\
+                      song_id) VALUES (?, ?, ?, ?)',
+                     (101, SYNTHETIC_EPOCH + 11 * DAY, -1, 2))
+    db_provider = DBProvider(path)
+    db_provider.close()
+    playbacks = [playback for playback in get_playbacks(conn)
+                 if playback.time_ended != -1]
+    expected = get_expected_time_listened(playbacks)
+    assert get_bucket_totals(conn, 'hourly_listening') == expected
+    assert get_bucket_totals(conn, 'daily_listening') == expected
+    assert conn.execute('SELECT playback_id FROM rolled_up_playbacks\
+                         WHERE playback_id >= 100').fetchall() == [(100,)]
+    assert get_songs_time_listened(conn, SYNTHETIC_EPOCH + 10 * DAY,
+                                   SYNTHETIC_EPOCH + 10 * DAY + HOUR)\
+            == {1: 100000}
+    conn.close()
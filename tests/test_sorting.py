@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from pmus.music import Song, Album, Artist
+from pmus.sorting import sort, parse_sort_by
+
+def make_song(song_id, name, duration=100, index_in_album=None,
+              time_liked=None, artists=None, album=None):
+    return Song(song_id, '/music/{}.flac'.format(song_id), name, artists or [],
+                duration, index_in_album, time_liked, [], album)
+
+def get_ids(music_objects):
+    return [music_object.id for music_object in music_objects]
+
+def test_parse_sort_by():
+    assert parse_sort_by('name') == [('name', False)]
+    assert parse_sort_by('rev_time_liked,name') == [('time_liked', True),
+                                                    ('name', False)]
+    with pytest.raises(ValueError):
+        parse_sort_by('rev_nothing')
+
+def test_multiple_keys_and_rev():
+    songs = [make_song(1, 'b', 200), make_song(2, 'a', 100),
+             make_song(3, 'b', 100), make_song(4, 'a', 300)]
+    assert get_ids(sort(songs, 'id')) == [1, 2, 3, 4]
+    assert get_ids(sort(songs, 'name')) == [2, 4, 1, 3]
+    assert get_ids(sort(songs, 'name,duration')) == [2, 4, 3, 1]
+    assert get_ids(sort(songs, 'name,rev_duration')) == [4, 2, 1, 3]
+    assert get_ids(sort(songs, 'rev_name,duration')) == [3, 1, 2, 4]
+    assert get_ids(sort(songs, 'duration,rev_id')) == [3, 2, 1, 4]
+    # time_liked goes newest first unless reversed
+    liked_songs = [make_song(1, 'a', time_liked=10),
+                   make_song(2, 'b', time_liked=30),
+                   make_song(3, 'c', time_liked=20)]
+    assert get_ids(sort(liked_songs, 'time_liked')) == [2, 3, 1]
+    assert get_ids(sort(liked_songs, 'rev_time_liked')) == [1, 3, 2]
+
+def test_none_last():
+    songs = [make_song(1, 'a', time_liked=None),
+             make_song(2, 'b', time_liked=10),
+             make_song(3, 'c', time_liked=None),
+             make_song(4, 'd', time_liked=20)]
+    assert get_ids(sort(songs, 'time_liked')) == [4, 2, 1, 3]
+    assert get_ids(sort(songs, 'rev_time_liked')) == [2, 4, 1, 3]
+    assert get_ids(sort(songs, 'time_liked', 3)) == [4, 2, 1]
+    assert get_ids(sort(songs, 'rev_time_liked', 3)) == [2, 4, 1]
+    # songs without an album have no year
+    album = Album(1, 'album', [], [], 2000)
+    songs[2].album = album
+    assert get_ids(sort(songs, 'year')) == [3, 1, 2, 4]
+    assert get_ids(sort(songs, 'rev_year')) == [3, 1, 2, 4]
+    # keys that dont apply to a type count as None
+    artist = Artist(1, 'artist', [], [])
+    assert sort([artist, songs[0]], 'duration') == [songs[0], artist]
+
+def test_stable():
+    songs = [make_song(song_id, 'same') for song_id in range(20)]
+    random.Random(0).shuffle(songs)
+    assert sort(songs, 'name') == songs
+    assert sort(songs, 'rev_name') == songs
+    assert sort(songs, 'name', 5) == songs[:5]
+
+# picking the first few with a heap gives what sorting everything does
+def test_limit_matches_full_sort():
+    rand = random.Random(0)
+    artists = [Artist(artist_id, 'artist {}'.format(artist_id % 7), [], [])
+               for artist_id in range(10)]
+    songs = [make_song(song_id, 'song {}'.format(rand.randint(0, 50)),
+                       rand.randint(1, 10),
+                       time_liked=rand.choice([None, rand.randint(0, 100)]),
+                       artists=[rand.choice(artists)])
+             for song_id in range(300)]
+    for sort_by in ['name', 'rev_duration', 'time_liked',
+                    'artist_name,rev_time_liked', 'duration,name,rev_id']:
+        sorted_songs = sort(songs, sort_by)
+        for limit in [1, 10, 299, 300, 1000]:
+            assert sort(songs, sort_by, limit) == sorted_songs[:limit]
+
+# track tags that arent numbers go after the ones that are, songs without one
+# go last
+def test_idx_in_album():
+    songs = [make_song(1, 'a', index_in_album='B side'),
+             make_song(2, 'b', index_in_album=10),
+             make_song(3, 'c', index_in_album=None),
+             make_song(4, 'd', index_in_album=2),
+             make_song(5, 'e', index_in_album='A side')]
+    assert get_ids(sort(songs, 'idx_in_album')) == [4, 2, 5, 1, 3]
+    assert get_ids(sort(songs, 'rev_idx_in_album')) == [1, 5, 2, 4, 3]
+    assert get_ids(sort(songs, 'idx_in_album', 2)) == [4, 2]
@@ -0,0 +1,27 @@
+import pytest
+
+from bench.synthetic import generate_audio_tree
+from pmus.tags import read_audio_format
+
+# the files bench.synthetic writes read back with the tags they were written
+# with, in every format
+@pytest.mark.parametrize('extension', ['mp3', 'flac', 'opus', 'm4a'])
+def test_read_synthetic_tags(tmp_path, extension):
+    filepaths = generate_audio_tree(str(tmp_path), 1, 1, 2, [extension],
+                                    seconds=3)
+    assert len(filepaths) == 2
+    for song_idx, filepath in enumerate(filepaths):
+        format_map = read_audio_format(filepath)
+        tags = format_map['tags']
+        assert tags['title'] == 'song 0 0 {}'.format(song_idx)
+        assert tags['artist'] == 'artist 0'
+        assert tags['album_artist'] == 'artist 0'
+        assert tags['album'] == 'album 0 0'
+        assert tags['date'] == '2000'
+        assert int(tags['track'].split('/')[0]) == song_idx + 1
+        assert format_map['duration'] == pytest.approx(3, abs=0.1)
+
+def test_unknown_extension(tmp_path):
+    filepath = tmp_path / 'song.wav'
+    filepath.write_bytes(b'RIFF')
+    assert read_audio_format(str(filepath)) is None
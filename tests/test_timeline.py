@@ -0,0 +1,129 @@
+import random
+
+from pmus.music import Playback
+from pmus.timeline import PlaybackTimeline, LONG_PLAYBACK
+from pmus.utils import current_time
+
+MINUTE = 60 * 1000
+
+def get_ids(playbacks):
+    return sorted(playback.id for playback in playbacks)
+
+def make_playbacks():
+    return [Playback(1, 1, 0, 3 * MINUTE, [], []),
+            Playback(2, 1, 5 * MINUTE, 8 * MINUTE, [], []),
+            Playback(3, 2, 8 * MINUTE, 12 * MINUTE, [], []),
+            Playback(4, 2, 20 * MINUTE, 21 * MINUTE, [], [])]
+
+def test_between_and_at():
+    timeline = PlaybackTimeline(make_playbacks())
+    assert len(timeline) == 4
+    assert get_ids(timeline.get_playbacks_between()) == [1, 2, 3, 4]
+    assert get_ids(timeline.get_playbacks_between(4 * MINUTE,
+                                                  9 * MINUTE)) == [2, 3]
+    assert get_ids(timeline.get_playbacks_between(None, 4 * MINUTE)) == [1]
+    assert get_ids(timeline.get_playbacks_between(12 * MINUTE)) == [3, 4]
+    assert get_ids(timeline.get_playbacks_between(13 * MINUTE,
+                                                  19 * MINUTE)) == []
+    assert get_ids(timeline.get_playbacks_at(MINUTE)) == [1]
+    # both ends count
+    assert get_ids(timeline.get_playbacks_at(8 * MINUTE)) == [2, 3]
+    assert get_ids(timeline.get_playbacks_at(4 * MINUTE)) == []
+
+# a long playback doesnt hide the short ones after it, and is found itself
+def test_long_playbacks():
+    playbacks = make_playbacks()
+    long_playback = Playback(5, 3, 2 * MINUTE, 2 * MINUTE + 2 * LONG_PLAYBACK,
+                             [], [])
+    timeline = PlaybackTimeline(playbacks + [long_playback])
+    assert get_ids(timeline.get_playbacks_at(MINUTE)) == [1]
+    assert get_ids(timeline.get_playbacks_at(10 * MINUTE)) == [3, 5]
+    assert get_ids(timeline.get_playbacks_at(LONG_PLAYBACK)) == [5]
+    assert get_ids(timeline.get_playbacks_at(3 * LONG_PLAYBACK)) == []
+    added_playback = Playback(6, 3, 30 * MINUTE, 30 * MINUTE + LONG_PLAYBACK
+                              + 1, [], [])
+    timeline.add(added_playback)
+    assert len(timeline) == 6
+    assert get_ids(timeline.get_playbacks_at(30 * MINUTE)) == [5, 6]
+
+# playbacks are added before they end, they are found once they did
+def test_playback_ended_after_indexing():
+    timeline = PlaybackTimeline(make_playbacks())
+    playback = Playback(5, 3, 30 * MINUTE, -1, [], [])
+    timeline.add(playback)
+    playback.time_ended = 33 * MINUTE
+    timeline.on_playback_ended(playback)
+    assert get_ids(timeline.get_playbacks_at(32 * MINUTE)) == [5]
+    # one added out of order that ends after the ones following it
+    playback = Playback(6, 3, 13 * MINUTE, -1, [], [])
+    timeline.add(playback)
+    playback.time_ended = 26 * MINUTE
+    timeline.on_playback_ended(playback)
+    assert get_ids(timeline.get_playbacks_at(25 * MINUTE)) == [6]
+    assert get_ids(timeline.get_playbacks_at(27 * MINUTE)) == []
+    assert get_ids(timeline.get_playbacks_at(20 * MINUTE)) == [4, 6]
+    # and one that ends up long
+    playback = Playback(7, 3, 40 * MINUTE, -1, [], [])
+    timeline.add(playback)
+    playback.time_ended = 40 * MINUTE + 2 * LONG_PLAYBACK
+    timeline.on_playback_ended(playback)
+    assert len(timeline) == 7
+    assert get_ids(timeline.get_playbacks_at(LONG_PLAYBACK)) == [7]
+    assert get_ids(timeline.get_playbacks_at(32 * MINUTE)) == [5]
+
+# the playing playback counts until now, ones a dead daemon left unended dont
+def test_open_playback():
+    now = current_time()
+    dead_playback = Playback(1, 1, now - 50 * MINUTE, -1, [], [])
+    timeline = PlaybackTimeline([dead_playback])
+    playback = Playback(2, 2, now - MINUTE, -1, [], [])
+    timeline.add(playback)
+    assert get_ids(timeline.get_playbacks_at(now - 40 * MINUTE)) == []
+    assert get_ids(timeline.get_playbacks_at(current_time())) == [2]
+    assert get_ids(timeline.get_playbacks_at(now - 2 * MINUTE)) == []
+    assert get_ids(timeline.get_playbacks_between(now - 2 * MINUTE)) == [2]
+    playback.time_ended = now
+    timeline.on_playback_ended(playback)
+    assert get_ids(timeline.get_playbacks_at(now + MINUTE)) == []
+    assert get_ids(timeline.get_playbacks_at(now)) == [2]
+
+# lookups match going through every playback, whatever order they were added
+# and ended in, unended playbacks are left out by looking only at times
+# before they started
+def test_matches_linear_scan():
+    rand = random.Random(0)
+    lengths = [MINUTE, 10 * MINUTE, 2 * LONG_PLAYBACK]
+    for trial in range(50):
+        playbacks = []
+        timeline = PlaybackTimeline()
+        for playback_id in range(50):
+            open_playbacks = [playback for playback in playbacks
+                              if playback.time_ended == -1]
+            if open_playbacks and rand.random() < 0.4:
+                playback = rand.choice(open_playbacks)
+                playback.time_ended = playback.time_started +\
+                        rand.choice(lengths)
+                timeline.on_playback_ended(playback)
+            else:
+                time_started = rand.randint(0, 100 * LONG_PLAYBACK)
+                if playbacks and rand.random() < 0.5:
+                    time_started = max(playback.time_started
+                                       for playback in playbacks) + MINUTE
+                playback = Playback(playback_id, 1, time_started, -1, [], [])
+                if rand.random() < 0.5:
+                    playback.time_ended = time_started + rand.choice(lengths)
+                playbacks.append(playback)
+                timeline.add(playback)
+            assert len(timeline) == len(playbacks)
+            open_starts = [playback.time_started for playback in playbacks
+                           if playback.time_ended == -1]
+            from_time = rand.randint(0, 100 * LONG_PLAYBACK)
+            to_time = from_time + rand.choice([0, MINUTE, LONG_PLAYBACK])
+            if open_starts and to_time >= min(open_starts):
+                continue
+            expected_ids = [playback.id for playback in playbacks
+                            if playback.time_ended != -1 and
+                            playback.time_ended >= from_time and
+                            playback.time_started <= to_time]
+            assert get_ids(timeline.get_playbacks_between(from_time, to_time))\
+                    == sorted(expected_ids)